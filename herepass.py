@@ -19,18 +19,27 @@ along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
 
 from __future__ import annotations
 
+import heapq
+import unicodedata
 from abc import ABC, abstractmethod
 from base64 import b64decode, b64encode
-from datetime import datetime, timezone
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+from functools import partial
+from itertools import accumulate
 from typing import Literal, Optional, Union
 
 import ujson
 from Crypto.Cipher import AES
 from Crypto.Protocol.KDF import scrypt
 from Crypto.Random import get_random_bytes
-from pydantic import BaseModel, Extra, Field, StrictBytes, constr
+from pydantic import BaseModel, Extra, Field, PrivateAttr, StrictBytes, constr
 
 herepass_version = "1.0.0"
+# Every encrypted file starts with its snapshot's envelope:
+vault_header = b'{"encrypter":'
+# Larger files aren't opened, so vaults are compacted well before reaching it:
+max_file_size = 64 * 1048576
 
 
 class ConfiguredModel(BaseModel):
@@ -66,9 +75,13 @@ class ConfiguredModel(BaseModel):
         return output
 
     def set(self, attribute, value):
+        previous = getattr(self, attribute)
         setattr(self, attribute, value)
-        self.set_sync(attribute)
-        return getattr(self, attribute)
+        output = getattr(self, attribute)
+        # Assigning an equal value changes nothing, so there's nothing to sync:
+        if output != previous:
+            self.set_sync(attribute)
+        return output
 
 
 class Scrypt(ConfiguredModel):
@@ -101,6 +114,7 @@ class AESGCM(ConfiguredModel):
     key_derivation: Scrypt
     nonce: StrictBytes = Field(..., min_length=16, max_length=16)
     mac_length: Literal[16] = 16
+    associated_data: Optional[StrictBytes]
     decrypted: Optional[StrictBytes]
     encrypted: Optional[StrictBytes]
     digest: Optional[StrictBytes]
@@ -117,6 +131,8 @@ class AESGCM(ConfiguredModel):
                 nonce=self.nonce,
                 mac_len=self.mac_length,
             )
+            if self.associated_data is not None:
+                cipher.update(self.associated_data)
             self.decrypted = cipher.decrypt_and_verify(self.encrypted, self.digest)
         else:
             if self.decrypted is None:
@@ -127,6 +143,8 @@ class AESGCM(ConfiguredModel):
                 nonce=self.nonce,
                 mac_len=self.mac_length,
             )
+            if self.associated_data is not None:
+                cipher.update(self.associated_data)
             output = cipher.encrypt_and_digest(self.decrypted)
             self.encrypted = output[0]
             self.digest = output[1]
@@ -143,29 +161,143 @@ class GroupListener(ABC):
     def sync(self):
         pass
 
+    def changed(self, data, attribute):
+        pass
+
+    def materialized(self, data, unloaded):
+        pass
+
 
 def group_cascade_listener(data):
     if data.listener and isinstance(data, Group):
-        sets_of_entries = [data.entries]
-        while sets_of_entries:
-            current_entries = sets_of_entries.pop()
-            for i in current_entries:
+        sets_of_groups = [data]
+        while sets_of_groups:
+            current_group = sets_of_groups.pop()
+            for i in current_group.entries:
                 i.listener = data.listener
+                i._parent = current_group
                 if isinstance(i, Group):
-                    sets_of_entries.append(i.entries)
+                    sets_of_groups.append(i)
 
 
 def group_cascade_delete(data):
     if isinstance(data, Group):
+        group_materialize(data)
         sets_of_entries = [data.entries]
         while sets_of_entries:
             current_entries = sets_of_entries.pop()
             for i in current_entries:
                 i.deleted = data.deleted
                 if isinstance(i, Group):
+                    group_materialize(i)
                     sets_of_entries.append(i.entries)
 
 
+def group_materialize(data):
+    # Builds the direct children of a group opened lazily. Their own
+    # children stay as raw decoded dictionaries until they're touched:
+    unloaded = data._unloaded
+    if unloaded is None:
+        return
+    data._unloaded = None
+    for raw in unloaded:
+        data.entries.append(node_from_raw(raw, data))
+    if data.listener:
+        data.listener.materialized(data, unloaded)
+
+
+def node_from_raw(raw, parent):
+    output = raw.copy()
+    output["listener"] = parent.listener
+    if "entries" in raw:
+        output["entries"] = []
+        output = Group.parse_obj(output)
+        output._unloaded = raw["entries"]
+    else:
+        output = Entry.parse_obj(output)
+    output._parent = parent
+    return output
+
+
+def node_path(data):
+    # The positions leading from the root group down to the given node:
+    path = []
+    while data._parent is not None:
+        for i, entry in enumerate(data._parent.entries):
+            if entry is data:
+                path.append(i)
+                break
+        else:
+            raise ValueError("Node is missing from its parent!")
+        data = data._parent
+    path.reverse()
+    return path
+
+
+def node_lineage(data):
+    # The groups leading from the root group down to the given node:
+    output = [data]
+    while data._parent is not None:
+        data = data._parent
+        output.append(data)
+    output.reverse()
+    return output
+
+
+def group_materialize_all(data):
+    sets_of_groups = [data]
+    while sets_of_groups:
+        current_group = sets_of_groups.pop()
+        group_materialize(current_group)
+        for i in current_group.entries:
+            if isinstance(i, Group):
+                sets_of_groups.append(i)
+
+
+def snapshot_nodes(data):
+    # The nodes of a group, or their raw dictionaries if never materialized,
+    # in the order a snapshot lists them, each with its parent's position:
+    return list(iter_snapshot_nodes(data))
+
+
+def iter_snapshot_nodes(data):
+    position = -1
+    sets_of_nodes = [(data, None)]
+    while sets_of_nodes:
+        current_node, parent = sets_of_nodes.pop()
+        position += 1
+        yield current_node, parent
+        if isinstance(current_node, dict):
+            children = current_node.get("entries", ())
+        elif isinstance(current_node, Entry):
+            children = ()
+        elif current_node._unloaded is not None:
+            children = current_node._unloaded
+        else:
+            children = current_node.entries
+        sets_of_nodes.extend(zip(reversed(children), [position] * len(children)))
+
+
+def raw_purge_deleted(entries, seconds_ago, current_time, purged=None):
+    sets_of_entries = [entries]
+    while sets_of_entries:
+        current_entries = sets_of_entries.pop()
+        kept = []
+        for i in current_entries:
+            deleted_at = i.get("deleted")
+            if deleted_at:
+                deleted_at = datetime.fromisoformat(deleted_at)
+                deleted_for = (current_time - deleted_at).total_seconds()
+                if deleted_for > seconds_ago:
+                    if purged is not None:
+                        purged.append(i)
+                    continue
+            kept.append(i)
+            if "entries" in i:
+                sets_of_entries.append(i["entries"])
+        current_entries[:] = kept
+
+
 def group_prepare(data):
     right_now = datetime.now(timezone.utc)
     if not data.created:
@@ -175,6 +307,103 @@ def group_prepare(data):
     group_cascade_listener(data)
 
 
+def node_portable_dict(data):
+    # Read off the fields directly, being twice as quick as data.dict():
+    output = {}
+    for field, value in data.__dict__.items():
+        if field == "listener" or field == "entries":
+            continue
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        output[field] = value
+    return output
+
+
+def normalize(text):
+    # Compatibility forms and case folded, then accents dropped, per the
+    # Unicode caseless matching algorithm:
+    if text.isascii():
+        return text.lower()
+    text = unicodedata.normalize("NFKD", text)
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(i for i in text if not unicodedata.combining(i))
+    return unicodedata.normalize("NFC", text)
+
+
+def tokenize(text):
+    return normalize(text).split() if text else []
+
+
+def node_tokens(data, field):
+    # Normalized once for every value the field takes:
+    text = getattr(data, field)
+    cached = data._tokens.get(field)
+    if cached is None or cached[0] is not text:
+        cached = (text, tuple(tokenize(text)))
+        data._tokens[field] = cached
+    return cached[1]
+
+
+def trigrams(word):
+    # Padded at the front only, since words are matched by their prefixes:
+    padded = "  " + word
+    return {"".join(i) for i in zip(padded, padded[1:], padded[2:])}
+
+
+def prefix_distance(search_word, word, limit):
+    # The optimal string alignment distance (Levenshtein's, plus swapping
+    # neighbours) from search_word to the closest prefix of word, or
+    # limit + 1 once it's certain to exceed limit. Only cells within limit
+    # of the diagonal can be within limit, so only those are computed:
+    word = word[: len(search_word) + limit]
+    too_far = limit + 1
+    if limit == 1:
+        # The common case, spared the table: past the first difference, the
+        # rest has to line up after a single edit.
+        i = 0
+        while i < len(search_word) and i < len(word) and search_word[i] == word[i]:
+            i += 1
+        if i == len(search_word):
+            return 0
+        j = i + 1
+        rest = search_word[j:]
+        if (
+            word.startswith(rest, j)
+            or word.startswith(rest, i)
+            or word.startswith(search_word[i:], j)
+        ):
+            return 1
+        # Swapped neighbours:
+        if len(word) > j and word[j] == search_word[i] and word[i] == rest[0]:
+            if word.startswith(rest[1:], j + 1):
+                return 1
+        return too_far
+    before_previous = None
+    previous = list(range(len(word) + 1))
+    for i in range(1, len(search_word) + 1):
+        current = [i] + [too_far] * len(word)
+        for j in range(max(1, i - limit), min(len(word), i + limit) + 1):
+            value = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (search_word[i - 1] != word[j - 1]),
+            )
+            if (
+                i > 1
+                and j > 1
+                and search_word[i - 1] == word[j - 2]
+                and search_word[i - 2] == word[j - 1]
+            ):
+                value = min(value, before_previous[j - 2] + 1)
+            current[j] = value
+        if min(current) > limit:
+            return too_far
+        before_previous = previous
+        previous = current
+    shortest = max(1, len(search_word) - limit)
+    return min(too_far, *previous[shortest:])
+
+
 def matches_phrase(search_words, words):
     for search_word in search_words:
         assert type(search_word) is str
@@ -189,14 +418,31 @@ def matches_phrase(search_words, words):
     return True
 
 
+def group_matches(data, search_words):
+    if matches_phrase(search_words, node_tokens(data, "label")):
+        return True
+    return matches_phrase(search_words, node_tokens(data, "description"))
+
+
+def linked_lineage(link):
+    # Links are pairs of a group and the link to its parent's:
+    output = []
+    while link is not None:
+        output.append(link[0])
+        link = link[1]
+    output.reverse()
+    return output
+
+
 def group_set_sync(data, attribute):
-    if attribute == "listener":
+    if attribute in ("listener", "entries"):
         group_cascade_listener(data)
     else:
         data.updated = datetime.now(timezone.utc)
         if attribute == "deleted":
             group_cascade_delete(data)
     if data.listener:
+        data.listener.changed(data, attribute)
         data.listener.sync()
 
 
@@ -208,6 +454,9 @@ class Entry(ConfiguredModel):
     updated: Optional[datetime]
     deleted: Optional[datetime]
     listener: Optional[GroupListener]
+    _parent: Optional[Group] = PrivateAttr(default=None)
+    # Normalized words per field, see node_tokens:
+    _tokens: dict = PrivateAttr(default_factory=dict)
 
     def prepare(self):
         group_prepare(self)
@@ -222,15 +471,7 @@ class Entry(ConfiguredModel):
         return deleted_code + ":" + type_code + ":" + secret_code + ":" + self.label
 
     def portable_dict(self):
-        output = self.dict()
-        del output["listener"]
-        if output["created"]:
-            output["created"] = output["created"].isoformat()
-        if output["updated"]:
-            output["updated"] = output["updated"].isoformat()
-        if output["deleted"]:
-            output["deleted"] = output["deleted"].isoformat()
-        return output
+        return node_portable_dict(self)
 
 
 class Group(ConfiguredModel):
@@ -241,23 +482,33 @@ class Group(ConfiguredModel):
     deleted: Optional[datetime]
     listener: Optional[GroupListener]
     entries: list[Union[Group, Entry]]
+    _parent: Optional[Group] = PrivateAttr(default=None)
+    _tokens: dict = PrivateAttr(default_factory=dict)
+    # Raw children of a lazily opened group, see group_materialize:
+    _unloaded: Optional[list] = PrivateAttr(default=None)
 
     def prepare(self):
         group_prepare(self)
 
+    def get_sync(self, attribute):
+        if attribute == "entries":
+            group_materialize(self)
+
     def set_sync(self, attribute):
         group_set_sync(self, attribute)
 
     def add_group(self, label, description):
+        group_materialize(self)
         new_group = Group(label=label, description=description, entries=[])
         self.entries.append(new_group)
-        self.set_sync("listener")
+        self.set_sync("entries")
         return new_group
 
     def add_entry(self, label, content, secret):
+        group_materialize(self)
         new_entry = Entry(label=label, content=content, secret=secret)
         self.entries.append(new_entry)
-        self.set_sync("listener")
+        self.set_sync("entries")
         return new_entry
 
     def get_key(self):
@@ -266,33 +517,45 @@ class Group(ConfiguredModel):
         secret_code = "0"
         return deleted_code + ":" + type_code + ":" + secret_code + ":" + self.label
 
-    def sort_entries(self):
+    def sort_entries(self, recursive=True):
         self.entries.sort(key=lambda entry: entry.get_key())
-        for entry in self.entries:
-            if isinstance(entry, Group):
-                entry.sort_entries()
+        if recursive:
+            for entry in self.entries:
+                if isinstance(entry, Group):
+                    entry.sort_entries()
 
     def search(self, search_phrase):
-        search_words = search_phrase.lower().split()
-        output = []
-        for entry in self.entries:
-            if isinstance(entry, Group):
-                suboutput = entry.search(search_phrase)
-                for matched in suboutput:
-                    matched.insert(0, self)
-                output.extend(suboutput)
-        words = self.label.lower().split()
-        if matches_phrase(search_words, words):
-            output.append([self])
-        elif self.description:
-            words = self.description.lower().split()
-            if matches_phrase(search_words, words):
-                output.append([self])
-        return output
+        return [lineage() for group, lineage in self.iter_search(search_phrase)]
+
+    def iter_search(self, search_phrase):
+        """
+        Yields the matches of search in the same order, as they're found,
+        each paired with a function returning its lineage. The tree is
+        walked without recursion, linking every group to its parent's link,
+        so lineages are only built for the matches that are looked at.
+        """
+        search_words = tokenize(search_phrase)
+        # Links to walk, and whether their subgroups were walked already:
+        stack = [((self, None), False)]
+        while stack:
+            link, walked = stack.pop()
+            group = link[0]
+            if walked:
+                if group_matches(group, search_words):
+                    yield group, partial(linked_lineage, link)
+                continue
+            group_materialize(group)
+            stack.append((link, True))
+            for entry in reversed(group.entries):
+                if isinstance(entry, Group):
+                    stack.append(((entry, link), False))
 
-    def purge_deleted(self, seconds_ago, current_time=None):
+    def purge_deleted(self, seconds_ago, current_time=None, purged=None):
         if current_time is None:
             current_time = datetime.now(timezone.utc)
+        if self._unloaded is not None:
+            raw_purge_deleted(self._unloaded, seconds_ago, current_time, purged)
+            return
         i = 0
         skip_to = 0
         leng = len(self.entries)
@@ -306,11 +569,13 @@ class Group(ConfiguredModel):
             if deleted_at:
                 deleted_for = (current_time - deleted_at).total_seconds()
                 if deleted_for > seconds_ago:
+                    if purged is not None:
+                        purged.append(self.entries[i])
                     skip_to += 1
                     leng -= 1
                     continue
             if isinstance(self.entries[i], Group):
-                self.entries[i].purge_deleted(seconds_ago, current_time)
+                self.entries[i].purge_deleted(seconds_ago, current_time, purged)
             i += 1
             skip_to += 1
         if i != skip_to:
@@ -318,33 +583,736 @@ class Group(ConfiguredModel):
             del self.entries[leng:]
 
     def portable_dict(self):
-        output = self.dict()
-        del output["listener"]
-        if output["created"]:
-            output["created"] = output["created"].isoformat()
-        if output["updated"]:
-            output["updated"] = output["updated"].isoformat()
-        if output["deleted"]:
-            output["deleted"] = output["deleted"].isoformat()
-        sets_of_entries = [output["entries"]]
-        while sets_of_entries:
-            current_entries = sets_of_entries.pop()
-            for i in current_entries:
-                del i["listener"]
-                if i["created"]:
-                    i["created"] = i["created"].isoformat()
-                if i["updated"]:
-                    i["updated"] = i["updated"].isoformat()
-                if i["deleted"]:
-                    i["deleted"] = i["deleted"].isoformat()
-                if "entries" in i:
-                    sets_of_entries.append(i["entries"])
+        output = node_portable_dict(self)
+        output["entries"] = []
+        sets_of_groups = [(self, output)]
+        while sets_of_groups:
+            current_group, current_output = sets_of_groups.pop()
+            if current_group._unloaded is not None:
+                # Never materialized, so the raw dictionaries are still portable:
+                current_output["entries"] = current_group._unloaded
+                continue
+            for i in current_group.entries:
+                i_output = node_portable_dict(i)
+                if isinstance(i, Group):
+                    i_output["entries"] = []
+                    sets_of_groups.append((i, i_output))
+                current_output["entries"].append(i_output)
         return output
 
 
+def parse_period(value):
+    # A year, month or day, as the times from its start up to its end:
+    parts = value.split("-")
+    try:
+        if len(parts) > 3 or any(len(i) != j for i, j in zip(parts, (4, 2, 2))):
+            raise ValueError
+        numbers = [int(i) for i in parts] + [1] * (3 - len(parts))
+        start = datetime(*numbers, tzinfo=timezone.utc)
+    except ValueError:
+        raise ValueError("Dates look like 2025, 2025-01 or 2025-01-31.")
+    if len(parts) == 1:
+        end = start.replace(year=start.year + 1)
+    elif len(parts) == 2:
+        if start.month == 12:
+            end = start.replace(year=start.year + 1, month=1)
+        else:
+            end = start.replace(month=start.month + 1)
+    else:
+        end = start + timedelta(days=1)
+    return start, end
+
+
+def parse_query(search_phrase, typing=False):
+    """
+    Splits a search phrase into its free words, words that must match in a
+    given field ("label:bank"), time ranges ("updated:<2025-01-01",
+    "created:2025-06") and flags ("is:secret", "is:deleted", "is:group",
+    "is:entry"). Times compare by "<", "<=", ">", ">=" or, with none, fall
+    within the given year, month or day. Operators left without a value,
+    as while typing, are ignored. With "typing", so is a last operator whose
+    value isn't valid (yet), like "is:s" or "updated:<2025-0".
+    """
+    output = {"words": [], "fields": {}, "ranges": {}, "flags": set()}
+    terms = search_phrase.split()
+    for i, term in enumerate(terms):
+        incomplete = typing and i == len(terms) - 1
+        name, colon, value = term.partition(":")
+        name = name.lower()
+        if not colon or name not in SearchIndex.fields + SearchIndex.times + ("is",):
+            output["words"].extend(tokenize(term))
+        elif not value:
+            continue
+        elif name == "is":
+            flag = value.lower()
+            if flag not in ("secret", "deleted", "group", "entry"):
+                if incomplete:
+                    continue
+                raise ValueError("Unknown flag: " + value)
+            output["flags"].add(flag)
+        elif name in SearchIndex.times:
+            operator = ""
+            for i in ("<=", ">=", "<", ">"):
+                if value.startswith(i):
+                    operator = i
+                    break
+            try:
+                start, end = parse_period(value.removeprefix(operator))
+            except ValueError:
+                if incomplete:
+                    continue
+                raise
+            if operator == "<":
+                start, end = None, start
+            elif operator == "<=":
+                start = None
+            elif operator == ">":
+                start, end = end, None
+            elif operator == ">=":
+                end = None
+            # Repeating a time narrows its range:
+            previous_start, previous_end = output["ranges"].get(name, (None, None))
+            if start is None or (previous_start and previous_start > start):
+                start = previous_start
+            if end is None or (previous_end and previous_end < end):
+                end = previous_end
+            output["ranges"][name] = (start, end)
+        elif tokenize(value):
+            output["fields"].setdefault(name, []).extend(tokenize(value))
+    return output
+
+
+def searchable_tokens(data, field):
+    # Secrets are never indexed:
+    if field == "content" and (not isinstance(data, Entry) or data.secret):
+        return ()
+    if field == "description" and not isinstance(data, Group):
+        return ()
+    return node_tokens(data, field)
+
+
+class SearchIndex:
+    """
+    Maps word prefixes to the groups and entries containing them, keeping
+    every field's distinct words sorted so a prefix is a contiguous range of
+    them. The words are also indexed by their trigrams, to find those within
+    a few typos of a search word. Like Group.search, all search words must
+    match within one field.
+
+    Matches are ranked by how well their words match, which field matched,
+    how deep the node is and how recently it was updated.
+
+    The last search's matches are kept, so that a search extending it, as
+    when typing, only has to check those again.
+
+    Searches can also be narrowed by field, time and flag, see parse_query.
+    Times are kept sorted, so that a range is found in O(log n) and read in
+    O(k).
+
+    Nodes are keyed by number, so that the index can be dumped alongside a
+    snapshot and loaded back without the nodes, see load. Nodes still raw
+    are only built once they're matched.
+    """
+
+    fields = ("label", "description", "content")
+    times = ("created", "updated", "deleted")
+    field_weights = {"label": 1.0, "description": 0.6, "content": 0.5}
+    # Search words shorter than this are only matched by prefix:
+    fuzzy_min_length = 4
+    # Each typo halves a word's score:
+    fuzzy_weight = 0.5
+    depth_weight = 0.1
+    recency_weight = 0.1
+    recency_half_life = 30 * 86400
+    # Candidates beyond this many are matched through the index instead:
+    scan_limit = 2000
+    # Dumps of another version are rebuilt instead of loaded:
+    dump_version = 2
+
+    def __init__(self):
+        self.nodes = {}
+        self.keys = {}
+        # Keys of the raw dictionaries not materialized yet:
+        self.raw_keys = {}
+        self.parents = {}
+        self.depths = {}
+        self.groups = set()
+        self.next_key = 0
+        # Per field, each node's words and times:
+        self.node_words = {field: {} for field in self.fields}
+        self.words = {field: [] for field in self.fields}
+        self.postings = {field: {} for field in self.fields}
+        self.trigrams = {field: {} for field in self.fields}
+        self.node_times = {field: {} for field in self.times}
+        self.sorted_times = {field: [] for field in self.times}
+        self.secrets = set()
+        # Bumped on every change, outdating the last search:
+        self.version = 0
+        self.last_search = None
+
+    def build(self, data):
+        for i in self.iter_build(data):
+            pass
+
+    def iter_build(self, data, chunk=200):
+        """
+        Indexes a group and everything in it, yielding the count so far after
+        every "chunk" nodes. Groups are materialized once they're reached, and
+        only the nodes they hold then are indexed.
+        """
+        # Sorting once is much cheaper than inserting every word in order:
+        sets_of_nodes = [data]
+        count = 0
+        while sets_of_nodes:
+            current_node = sets_of_nodes.pop()
+            self.add(current_node, False)
+            if isinstance(current_node, Group):
+                sets_of_nodes.extend(current_node.get("entries"))
+            count += 1
+            if not count % chunk:
+                yield count
+        for field in self.fields:
+            self.words[field] = sorted(self.postings[field])
+        for field in self.times:
+            self.sorted_times[field].sort()
+            yield count
+
+    def bind(self, key, data):
+        self.nodes[key] = data
+        self.keys[id(data)] = key
+
+    def materialized(self, data, unloaded):
+        # Binds the nodes just built from raw dictionaries to their keys:
+        for raw, node in zip(unloaded, data.entries):
+            key = self.raw_keys.pop(id(raw), None)
+            if key is not None:
+                self.bind(key, node)
+
+    def node(self, key):
+        # Materializes the groups leading down to a node still raw:
+        unbound = []
+        while key not in self.nodes:
+            unbound.append(key)
+            key = self.parents[key]
+        for key in reversed(unbound):
+            group_materialize(self.nodes[self.parents[key]])
+        return self.nodes[key]
+
+    def add(self, data, in_order=True):
+        self.version += 1
+        key = self.next_key
+        self.next_key += 1
+        self.bind(key, data)
+        parent = None if data._parent is None else self.keys[id(data._parent)]
+        self.parents[key] = parent
+        self.depths[key] = 0 if parent is None else self.depths[parent] + 1
+        if isinstance(data, Group):
+            self.groups.add(key)
+        self.insert(key, data, in_order)
+
+    def add_all(self, data):
+        # Every group has to be built to be indexed:
+        if isinstance(data, Group):
+            group_materialize_all(data)
+        sets_of_nodes = [data]
+        while sets_of_nodes:
+            current_node = sets_of_nodes.pop()
+            self.add(current_node)
+            if isinstance(current_node, Group):
+                sets_of_nodes.extend(current_node.entries)
+
+    def insert(self, key, data, in_order=True):
+        for field in self.fields:
+            words = set(searchable_tokens(data, field))
+            if words:
+                self.node_words[field][key] = words
+            postings = self.postings[field]
+            for word in words:
+                if word not in postings:
+                    postings[word] = set()
+                    if in_order:
+                        sorted_words = self.words[field]
+                        sorted_words.insert(bisect_left(sorted_words, word), word)
+                    for trigram in trigrams(word):
+                        self.trigrams[field].setdefault(trigram, set()).add(word)
+                postings[word].add(key)
+        for field in self.times:
+            value = getattr(data, field)
+            if value is None:
+                continue
+            value = value.timestamp()
+            self.node_times[field][key] = value
+            if in_order:
+                insort(self.sorted_times[field], (value, key))
+            else:
+                self.sorted_times[field].append((value, key))
+        if isinstance(data, Entry) and data.secret:
+            self.secrets.add(key)
+
+    def discard(self, key):
+        for field in self.fields:
+            words = self.node_words[field].pop(key, ())
+            postings = self.postings[field]
+            for word in words:
+                postings[word].discard(key)
+                if not postings[word]:
+                    del postings[word]
+                    sorted_words = self.words[field]
+                    del sorted_words[bisect_left(sorted_words, word)]
+                    for trigram in trigrams(word):
+                        trigram_words = self.trigrams[field][trigram]
+                        trigram_words.discard(word)
+                        if not trigram_words:
+                            del self.trigrams[field][trigram]
+        for field in self.times:
+            value = self.node_times[field].pop(key, None)
+            if value is None:
+                continue
+            sorted_times = self.sorted_times[field]
+            del sorted_times[bisect_left(sorted_times, (value, key))]
+        self.secrets.discard(key)
+
+    def remove(self, data):
+        # Also takes raw dictionaries, as purged before they're materialized:
+        if isinstance(data, dict):
+            key = self.raw_keys.pop(id(data), None)
+        else:
+            key = self.keys.pop(id(data), None)
+        if key is None:
+            return
+        self.version += 1
+        self.discard(key)
+        self.nodes.pop(key, None)
+        del self.parents[key]
+        del self.depths[key]
+        self.groups.discard(key)
+
+    def remove_all(self, data):
+        for current_node, parent in snapshot_nodes(data):
+            self.remove(current_node)
+
+    def update(self, data):
+        # Nodes not indexed yet are once their own addition is caught up with:
+        key = self.keys.get(id(data))
+        if key is None:
+            return
+        self.version += 1
+        self.discard(key)
+        self.insert(key, data)
+
+    def update_all(self, data):
+        sets_of_nodes = [data]
+        while sets_of_nodes:
+            current_node = sets_of_nodes.pop()
+            # Added since, so indexed along with its descendants once that is:
+            if id(current_node) not in self.keys:
+                continue
+            self.update(current_node)
+            if isinstance(current_node, Group):
+                sets_of_nodes.extend(current_node.get("entries"))
+
+    def dump(self, data):
+        """
+        The words of every field as plain lists and dictionaries, each with
+        the nodes containing it numbered in the order a snapshot of the given
+        group lists them. Everything else is read back from the snapshot, see
+        load.
+        """
+        slots = {}
+        for current_node, parent in snapshot_nodes(data):
+            if isinstance(current_node, dict):
+                key = self.raw_keys[id(current_node)]
+            else:
+                key = self.keys[id(current_node)]
+            slots[key] = len(slots)
+        output = {"version": self.dump_version, "nodes": len(slots), "words": {}}
+        for field in self.fields:
+            postings = self.postings[field]
+            field_words = output["words"][field] = {}
+            for word in self.words[field]:
+                # As the gaps between the sorted numbers, being much shorter:
+                keys = sorted(slots[key] for key in postings[word])
+                field_words[word] = keys[:1] + [j - i for i, j in zip(keys, keys[1:])]
+        return output
+
+    def load(self, snapshot, dumped):
+        for i in self.iter_load(snapshot, dumped):
+            pass
+
+    def iter_load(self, snapshot, dumped, chunk=200):
+        """
+        Loads a dump of the index for the nodes of a snapshot, listed like
+        snapshot_nodes does, binding those already built and keeping the rest
+        raw until they're materialized. Their times and flags are read from
+        the nodes themselves. Yields the count so far after every "chunk"
+        nodes or words. Raises ValueError if the dump doesn't fit.
+        """
+        if dumped["version"] != self.dump_version:
+            raise ValueError("Search index version mismatch!")
+        count = 0
+        for key, (current_node, parent) in enumerate(snapshot):
+            self.parents[key] = parent
+            self.depths[key] = 0 if parent is None else self.depths[parent] + 1
+            if isinstance(current_node, dict):
+                self.raw_keys[id(current_node)] = key
+                is_group = "entries" in current_node
+                secret = current_node.get("secret")
+            else:
+                self.bind(key, current_node)
+                is_group = isinstance(current_node, Group)
+                secret = not is_group and current_node.secret
+            if is_group:
+                self.groups.add(key)
+            elif secret:
+                self.secrets.add(key)
+            for field in self.times:
+                value = current_node.get(field)
+                if value is None:
+                    continue
+                if isinstance(value, str):
+                    value = datetime.fromisoformat(value)
+                value = value.timestamp()
+                self.node_times[field][key] = value
+                self.sorted_times[field].append((value, key))
+            count += 1
+            if not count % chunk:
+                yield count
+        if dumped["nodes"] != len(self.parents):
+            raise ValueError("Search index doesn't match the snapshot!")
+        self.next_key = len(self.parents)
+        for field in self.times:
+            self.sorted_times[field].sort()
+            yield count
+        for field in self.fields:
+            postings = self.postings[field]
+            node_words = self.node_words[field]
+            field_trigrams = self.trigrams[field]
+            for word, gaps in dumped["words"][field].items():
+                keys = set(accumulate(gaps))
+                postings[word] = keys
+                for key in keys:
+                    if key in node_words:
+                        node_words[key].add(word)
+                    else:
+                        node_words[key] = {word}
+                for trigram in trigrams(word):
+                    if trigram in field_trigrams:
+                        field_trigrams[trigram].add(word)
+                    else:
+                        field_trigrams[trigram] = {word}
+                count += 1
+                if not count % chunk:
+                    yield count
+            self.words[field] = list(postings)
+        self.version += 1
+
+    def within(self, field, start, end):
+        sorted_times = self.sorted_times[field]
+        i = 0
+        if start is not None:
+            i = bisect_left(sorted_times, (start.timestamp(),))
+        j = len(sorted_times)
+        if end is not None:
+            j = bisect_left(sorted_times, (end.timestamp(),))
+        return {key for value, key in sorted_times[i:j]}
+
+    def filtered(self, query):
+        # The nodes within every time range and with every flag:
+        sets_of_keys = []
+        for field, (start, end) in query["ranges"].items():
+            sets_of_keys.append(self.within(field, start, end))
+        flags = query["flags"]
+        if "secret" in flags:
+            sets_of_keys.append(self.secrets)
+        if "deleted" in flags:
+            sets_of_keys.append(self.within("deleted", None, None))
+        if "group" in flags:
+            sets_of_keys.append(self.groups)
+        if not sets_of_keys:
+            sets_of_keys.append(self.parents)
+        sets_of_keys.sort(key=len)
+        output = set(sets_of_keys[0])
+        for keys in sets_of_keys[1:]:
+            output.intersection_update(keys)
+        if "entry" in flags:
+            output.difference_update(self.groups)
+        return output
+
+    def passes(self, key, query):
+        # Whether a node is within every time range and has every flag:
+        for field, (start, end) in query["ranges"].items():
+            value = self.node_times[field].get(key)
+            if value is None:
+                return False
+            if (start is not None and value < start.timestamp()) or (
+                end is not None and value >= end.timestamp()
+            ):
+                return False
+        flags = query["flags"]
+        if "secret" in flags and key not in self.secrets:
+            return False
+        if "deleted" in flags and key not in self.node_times["deleted"]:
+            return False
+        if "group" in flags and key not in self.groups:
+            return False
+        if "entry" in flags and key in self.groups:
+            return False
+        return True
+
+    def prefixed(self, field, search_word):
+        sorted_words = self.words[field]
+        output = []
+        i = bisect_left(sorted_words, search_word)
+        while i < len(sorted_words) and sorted_words[i].startswith(search_word):
+            output.append(sorted_words[i])
+            i += 1
+        return output
+
+    def typo_limit(self, search_word, fuzzy):
+        if not fuzzy or len(search_word) < self.fuzzy_min_length:
+            return 0
+        return 1 if len(search_word) < 8 else 2
+
+    def word_score(self, search_word, word, limit):
+        # Exact words score 1, longer words less, and each typo halves that:
+        if word.startswith(search_word):
+            distance = 0
+        elif limit and word[0] == search_word[0]:
+            # Like most spellers, this trusts the first letter:
+            distance = prefix_distance(search_word, word, limit)
+            if distance > limit:
+                return 0
+        else:
+            return 0
+        score = 0.5 + 0.5 * min(1, len(search_word) / len(word))
+        return score * self.fuzzy_weight**distance
+
+    def fuzzy_matched(self, field, search_word, limit):
+        # An edit changes at most three trigrams, or four when swapping two
+        # letters, which bounds the candidates:
+        search_trigrams = trigrams(search_word)
+        counts = {}
+        for trigram in search_trigrams:
+            for word in self.trigrams[field].get(trigram, ()):
+                counts[word] = counts.get(word, 0) + 1
+        needed = len(search_trigrams) - 4 * limit
+        return [
+            word
+            for word, count in counts.items()
+            if count >= needed and not word.startswith(search_word)
+        ]
+
+    def word_scores(self, field, search_word, fuzzy, candidates=None):
+        # The best score of any word matching search_word, per node:
+        limit = self.typo_limit(search_word, fuzzy)
+        output = {}
+        # Checking a few candidates' own words beats going through the index:
+        if candidates is not None and len(candidates) <= self.scan_limit:
+            for key in candidates:
+                score = 0
+                for word in self.node_words[field].get(key, ()):
+                    score = max(score, self.word_score(search_word, word, limit))
+                if score:
+                    output[key] = score
+            return output
+        postings = self.postings[field]
+        matched = self.prefixed(field, search_word)
+        if limit:
+            matched.extend(self.fuzzy_matched(field, search_word, limit))
+        for word in matched:
+            score = self.word_score(search_word, word, limit)
+            if not score:
+                continue
+            for key in postings[word]:
+                if output.get(key, 0) < score:
+                    output[key] = score
+        if candidates is not None:
+            output = {key: output[key] for key in output if key in candidates}
+        return output
+
+    def refines(self, previous_words, search_words, fuzzy):
+        # Whether every match of search_words also matched previous_words:
+        if len(search_words) < len(previous_words):
+            return False
+        for previous_word, search_word in zip(previous_words, search_words):
+            if not search_word.startswith(previous_word):
+                return False
+            # A longer word tolerates more typos, matching more words:
+            if self.typo_limit(search_word, fuzzy) != self.typo_limit(
+                previous_word, fuzzy
+            ):
+                return False
+        return True
+
+    def match(self, search_words, fuzzy, candidates=None, cancelled=None, fields=None):
+        # The unranked scores of every match, or None if cancelled:
+        output = {}
+        for field in self.fields if fields is None else fields:
+            field_matched = candidates
+            for search_word in search_words:
+                if cancelled is not None and cancelled():
+                    return None
+                scores = self.word_scores(field, search_word, fuzzy, field_matched)
+                if field_matched is None or field_matched is candidates:
+                    field_matched = scores
+                else:
+                    field_matched = {
+                        key: field_matched[key] + scores[key] for key in scores
+                    }
+                if not field_matched:
+                    break
+            weight = self.field_weights[field] / len(search_words)
+            for key, score in field_matched.items():
+                score *= weight
+                if output.get(key, 0) < score:
+                    output[key] = score
+        return output
+
+    def score(self, key, score, current_time):
+        score /= 1 + self.depth_weight * self.depths[key]
+        updated = self.node_times["updated"].get(key)
+        if updated is not None:
+            age = current_time - updated
+            score += self.recency_weight * 0.5 ** (max(0, age) / self.recency_half_life)
+        return score
+
+    def find(
+        self,
+        search_phrase,
+        limit=None,
+        fuzzy=True,
+        deleted=True,
+        current_time=None,
+        cancelled=None,
+        typing=False,
+    ):
+        """
+        Returns the best "limit" matches, or all of them, best first. Deleted
+        nodes are left out unless "deleted" is set or the query asks for them.
+        "cancelled" is polled between passes, giving up with no matches once
+        it returns True. Raises ValueError for malformed queries, see
+        parse_query for "typing".
+        """
+        query = parse_query(search_phrase, typing)
+        if not any(query.values()):
+            return []
+        if current_time is None:
+            current_time = datetime.now(timezone.utc)
+        candidates = None
+        if self.last_search is not None:
+            version, previous_fuzzy, previous_query, previous = self.last_search
+            if (
+                version == self.version
+                and previous_fuzzy == fuzzy
+                and previous_query["fields"] == query["fields"]
+                and previous_query["ranges"] == query["ranges"]
+                and previous_query["flags"] == query["flags"]
+                and self.refines(previous_query["words"], query["words"], fuzzy)
+            ):
+                candidates = previous
+        # Without words, the ranges and flags are looked up. Otherwise, the
+        # fewer nodes matching the words are checked against them:
+        words = query["words"] or query["fields"]
+        if candidates is None and not words:
+            candidates = dict.fromkeys(self.filtered(query), 0)
+        filtering = candidates is None and (query["ranges"] or query["flags"])
+        matched = candidates
+        if query["words"]:
+            matched = self.match(query["words"], fuzzy, candidates, cancelled)
+        if matched is None and query["words"]:
+            return []
+        for field, search_words in query["fields"].items():
+            field_matched = self.match(
+                search_words, fuzzy, matched, cancelled, (field,)
+            )
+            if field_matched is None:
+                return []
+            if matched is None:
+                matched = field_matched
+            else:
+                matched = {
+                    key: matched[key] + score for key, score in field_matched.items()
+                }
+        if matched is None:
+            return []
+        if filtering:
+            matched = {key: matched[key] for key in matched if self.passes(key, query)}
+        self.last_search = (self.version, fuzzy, query, matched)
+        if "deleted" in query["flags"] or "deleted" in query["ranges"]:
+            deleted = True
+        current_time = current_time.timestamp()
+        scored = (
+            (self.score(key, score, current_time), key)
+            for key, score in matched.items()
+            if deleted or key not in self.node_times["deleted"]
+        )
+        if limit is None:
+            ranked = sorted(scored, reverse=True)
+        else:
+            ranked = heapq.nlargest(limit, scored)
+        return [self.node(key) for score, key in ranked]
+
+
+def parse_envelope(data):
+    """
+    Does all of loading an encrypted file that needs no passphrase: its
+    snapshot's envelope is parsed and base64-decoded, and its journal's
+    records are split off.
+    """
+    if isinstance(data, str):
+        data = data.encode()
+    records = data.split(b"\n")
+    snapshot_size = len(records[0])
+    data = ujson.loads(records.pop(0))
+    assert type(data) is dict
+    encrypter = data["encrypter"]
+    class_map = {"Scrypt": Scrypt, "AESGCM": AESGCM}
+    b64_list = [
+        "salt",
+        "nonce",
+        "digest",
+        "encrypted",
+    ]
+    key_derivation = encrypter.pop("key_derivation")
+    key_derivation_class = class_map[key_derivation.pop("class")]
+    encrypter_class = class_map[encrypter.pop("class")]
+    for b64_key in b64_list:
+        for key in encrypter:
+            if key == b64_key:
+                encrypter[key] = b64decode(encrypter[key])
+        for key in key_derivation:
+            if key == b64_key:
+                key_derivation[key] = b64decode(key_derivation[key])
+    return {
+        "snapshot_size": snapshot_size,
+        "records": records,
+        "encrypter_class": encrypter_class,
+        "encrypter": encrypter,
+        "key_derivation_class": key_derivation_class,
+        "key_derivation": key_derivation,
+        "index": data.get("index"),
+    }
+
+
 class HerePass(GroupListener):
     # self.group
     # self.encrypter
+    # self.journal
+    # self.journal_digest
+    # self.journal_size
+    # self.snapshot_size
+    # self.compaction_due
+    # self.unsorted
+    # self.index
+    # self.saved_index
+    # self.index_changes
+    # self.indexing
+
+    # Journal size, relative to the snapshot, beyond which it's compacted:
+    journal_ratio = 0.5
+    # File size beyond which it's compacted, whatever the journal's share, so
+    # that it's never written too large to open again:
+    file_size_limit = max_file_size * 3 // 4
 
     def create(self, passphrase):
         self.group = Group(label="New", entries=[], listener=self)
@@ -356,19 +1324,288 @@ class HerePass(GroupListener):
             nonce=nonce,
             decrypted=ujson.dumps(self.group.portable_dict()).encode(),
         )
+        self.reset_journal(0)
+        # Nothing has been written yet:
+        self.compaction_due = True
+        self.index = None
+        self.saved_index = None
+        self.index_changes = None
+        self.indexing = None
+
+    def reset_journal(self, snapshot_size):
+        self.journal = []
+        self.journal_digest = self.encrypter.get("digest")
+        self.journal_size = 0
+        self.snapshot_size = snapshot_size
+        self.compaction_due = False
+        self.unsorted = []
+
+    def mark_unsorted(self, data, attribute):
+        if attribute == "entries":
+            self.unsorted.append((data, False))
+            return
+        if data._parent is not None:
+            self.unsorted.append((data._parent, False))
+        if attribute == "deleted" and isinstance(data, Group):
+            self.unsorted.append((data, True))
+
+    def changed(self, data, attribute):
+        if attribute == "listener":
+            return
+        change = {"path": node_path(data)}
+        self.index_change(data, attribute)
+        if attribute == "entries":
+            change["add"] = data.entries[-1].portable_dict()
+        else:
+            value = getattr(data, attribute)
+            if isinstance(value, datetime):
+                value = value.isoformat()
+            change["set"] = attribute
+            change["value"] = value
+            change["updated"] = data.updated.isoformat()
+        self.journal.append(change)
+        self.mark_unsorted(data, attribute)
+
+    def index_change(self, data, attribute):
+        if attribute == "entries":
+            # Noted as the node added, as others can be added after it:
+            data, attribute = data.entries[-1], "added"
+        if self.index is not None:
+            self.update_index(self.index, data, attribute)
+        elif self.index_changes is not None:
+            # Caught up with once the index is ready, see index_steps:
+            self.index_changes.append((data, attribute))
+
+    def update_index(self, index, data, attribute):
+        if attribute == "added":
+            # Unless already indexed along with a node added before it:
+            if id(data) not in index.keys:
+                index.add_all(data)
+        elif attribute == "purged":
+            index.remove_all(data)
+        elif attribute == "deleted":
+            # Deletions cascade to every descendant:
+            index.update_all(data)
+        else:
+            # Every other change also moves "updated":
+            index.update(data)
+
+    def materialized(self, data, unloaded):
+        if self.index is not None:
+            self.index.materialized(data, unloaded)
+        elif self.saved_index is not None:
+            # Noted to bind the index saved to the nodes built since:
+            nodes = self.saved_index["nodes"]
+            for raw, node in zip(unloaded, data.entries):
+                nodes[id(raw)] = node
+
+    def apply_change(self, change):
+        target = self.group
+        for i in change["path"]:
+            target = target.get("entries")[i]
+        if "add" in change:
+            target.get("entries").append(node_from_raw(change["add"], target))
+            self.index_change(target, "entries")
+            self.mark_unsorted(target, "entries")
+        else:
+            attribute = change["set"]
+            setattr(target, attribute, change["value"])
+            target.updated = change["updated"]
+            if attribute == "deleted":
+                group_cascade_delete(target)
+            self.index_change(target, attribute)
+            self.mark_unsorted(target, attribute)
+        self.sync()
 
     def sync(self):
-        self.group.purge_deleted(86400)
-        self.group.sort_entries()
-        self.encrypter.set(
-            "decrypted", ujson.dumps(self.group.portable_dict()).encode()
+        # Only the groups touched since the last sync need sorting:
+        for group, recursive in self.unsorted:
+            group.sort_entries(recursive)
+        self.unsorted.clear()
+
+    def index_steps(self, build=True, chunk=200):
+        """
+        Opens the search index saved with the snapshot, or else builds one
+        unless "build" is off, yielding the count so far after every "chunk"
+        nodes or words. The vault can be changed between steps, as long as
+        it's not changed during them, and the changes are caught up with at
+        the end. See index_step for sharing the steps.
+
+        The index saved is bound to the nodes built from the snapshot since.
+        One that fails to open against the snapshot, or to match it, is
+        dropped and rebuilt instead.
+        """
+        index = None
+        if self.saved_index is not None:
+            index = SearchIndex()
+            nodes = self.saved_index["nodes"]
+            snapshot = (
+                (nodes.get(id(current_node), current_node), parent)
+                for current_node, parent in iter_snapshot_nodes(
+                    self.saved_index["snapshot"]
+                )
+            )
+            try:
+                yield from index.iter_load(snapshot, self.saved_dump(), chunk)
+            except (ValueError, KeyError, TypeError, IndexError):
+                index = None
+                self.saved_index = None
+                self.index_changes = None
+            else:
+                # Those built after they were reached:
+                for raw_id, node in nodes.items():
+                    key = index.raw_keys.pop(raw_id, None)
+                    if key is not None:
+                        index.bind(key, node)
+        if index is None:
+            if not build:
+                return
+            # Changes made before a group is reached are indexed with it:
+            self.index_changes = []
+            index = SearchIndex()
+            yield from index.iter_build(self.group, chunk)
+        self.saved_index = None
+        changes = self.index_changes
+        self.index_changes = None
+        for data, attribute in changes:
+            self.update_index(index, data, attribute)
+        # Only searched once it's caught up:
+        self.index = index
+
+    def saved_dump(self):
+        sealed = self.saved_index["sealed"]
+        record = AESGCM(
+            key_derivation=self.encrypter.get("key_derivation"),
+            nonce=b64decode(sealed["nonce"]),
+            associated_data=self.encrypter.get("digest"),
+            encrypted=b64decode(sealed["encrypted"]),
+            digest=b64decode(sealed["digest"]),
         )
+        return ujson.loads(record.get("decrypted"))
+
+    def index_step(self, build=True):
+        """
+        Takes the next step of the index_steps in progress, started if need
+        be, returning whether there are more to take. Every caller shares
+        them, so that taking turns never starts them over.
+        """
+        while self.index is None:
+            if self.indexing is None:
+                if not build and self.saved_index is None:
+                    break
+                self.indexing = self.index_steps(build)
+            if next(self.indexing, None) is not None:
+                return True
+            # Finished, or else failed to open the index saved:
+            self.indexing = None
+        return False
+
+    def open_index(self, build=True):
+        # All of the steps at once:
+        while self.index_step(build):
+            pass
+
+    def search(
+        self,
+        search_phrase,
+        limit=None,
+        fuzzy=True,
+        deleted=True,
+        cancelled=None,
+        typing=False,
+    ):
+        """
+        Like Group.search over the root group, but also matching entry labels
+        and non-secret content, and tolerating typos unless "fuzzy" is off.
+        Goes through the index saved with the vault, opened on the first
+        search, or else built then, returning the lineages of the best "limit"
+        matches, or all of them, best first. See SearchIndex.find for the
+        rest.
+        """
+        if self.index is None:
+            self.open_index()
+        matched = self.index.find(
+            search_phrase, limit, fuzzy, deleted, cancelled=cancelled, typing=typing
+        )
+        return [node_lineage(i) for i in matched]
+
+    def needs_compaction(self):
+        if self.compaction_due:
+            return True
+        if self.snapshot_size + self.journal_size > self.file_size_limit:
+            return True
+        return self.journal_size > self.snapshot_size * self.journal_ratio
+
+    def to_journal_record(self):
+        """
+        Seals the changes made since the last record or snapshot. Each record
+        is authenticated together with the previous digest, chaining it to
+        everything before it.
+        """
+        if not self.journal:
+            return b""
+        record = AESGCM(
+            key_derivation=self.encrypter.get("key_derivation"),
+            nonce=get_random_bytes(16),
+            associated_data=self.journal_digest,
+            decrypted=ujson.dumps(self.journal).encode(),
+        )
+        data = {
+            "nonce": b64encode(record.get("nonce")).decode("utf-8"),
+            "digest": b64encode(record.get("digest")).decode("utf-8"),
+            "encrypted": b64encode(record.get("encrypted")).decode("utf-8"),
+        }
+        output = b"\n" + ujson.dumps(data).encode()
+        self.journal = []
+        self.journal_digest = record.get("digest")
+        self.journal_size += len(output)
+        return output
 
     def to_encrypted_json(self):
-        encrypter = self.encrypter
-        nonce = get_random_bytes(16)
-        encrypter.set("nonce", nonce)
-        key_derivation = encrypter.get("key_derivation")
+        # Compaction, folding every change into a new snapshot:
+        snapshot = self.take_snapshot()
+        output = self.seal_snapshot(snapshot)
+        self.adopt_snapshot(snapshot)
+        return output
+
+    def take_snapshot(self):
+        """
+        The first half of compaction, the only one reading the tree: purges
+        and sorts it, then returns it and its index as plain lists and
+        dictionaries, for seal_snapshot. The changes journaled so far are
+        folded into it.
+        """
+        if self.saved_index is not None:
+            # Only an open index can be saved again, renumbered:
+            self.open_index(False)
+        # Purged raw dictionaries are reported too, to leave the index:
+        purged = []
+        self.group.purge_deleted(86400, None, purged)
+        for i in purged:
+            self.index_change(i, "purged")
+        self.group.sort_entries()
+        self.unsorted.clear()
+        self.journal = []
+        # The raw dictionaries of groups never materialized are shared, not
+        # copied, as nothing but compaction changes them:
+        snapshot = {"group": self.group.portable_dict(), "index": None}
+        if self.index is not None:
+            snapshot["index"] = self.index.dump(self.group)
+        return snapshot
+
+    def seal_snapshot(self, snapshot):
+        """
+        The second half of compaction, encrypting what take_snapshot returned
+        into the file's new contents. It neither reads the tree nor changes
+        the vault, so the tree can change in the meantime. Those changes are
+        journaled after it, once adopt_snapshot takes it up.
+        """
+        key_derivation = self.encrypter.get("key_derivation")
+        encrypter = AESGCM(
+            key_derivation=key_derivation,
+            nonce=get_random_bytes(16),
+            decrypted=ujson.dumps(snapshot["group"]).encode(),
+        )
         kd_dict = {"class": type(key_derivation).__name__}
         if key_derivation.has("salt"):
             kd_dict["salt"] = b64encode(key_derivation.get("salt")).decode("utf-8")
@@ -390,37 +1627,101 @@ class HerePass(GroupListener):
         if encrypter.has("encrypted"):
             en_dict["encrypted"] = b64encode(encrypter.get("encrypted")).decode("utf-8")
         data = {"encrypter": en_dict}
-        return ujson.dumps(data).encode()
+        if snapshot["index"] is not None:
+            # Sealed against this snapshot, so that it's only ever loaded
+            # alongside it:
+            index = AESGCM(
+                key_derivation=key_derivation,
+                nonce=get_random_bytes(16),
+                associated_data=encrypter.get("digest"),
+                decrypted=ujson.dumps(snapshot["index"]).encode(),
+            )
+            data["index"] = {
+                "nonce": b64encode(index.get("nonce")).decode("utf-8"),
+                "digest": b64encode(index.get("digest")).decode("utf-8"),
+                "encrypted": b64encode(index.get("encrypted")).decode("utf-8"),
+            }
+        output = ujson.dumps(data).encode()
+        snapshot["sealed"] = (encrypter, len(output))
+        return output
+
+    def adopt_snapshot(self, snapshot):
+        # Journaling from then on follows the snapshot sealed:
+        encrypter, snapshot_size = snapshot["sealed"]
+        self.encrypter = encrypter
+        self.journal_digest = encrypter.get("digest")
+        self.journal_size = 0
+        self.snapshot_size = snapshot_size
+        self.compaction_due = False
 
-    def from_encrypted_json(self, passphrase, data):
+    def from_encrypted_json(self, passphrase, data, lazy=False):
+        """
+        Loads an encrypted file's contents, or the envelope parse_envelope
+        made of them ahead of time.
+        """
         assert type(passphrase) is str
-        data = ujson.loads(data)
-        assert type(data) is dict
-        encrypter = data["encrypter"]
-        class_map = {"Scrypt": Scrypt, "AESGCM": AESGCM}
-        b64_list = [
-            "salt",
-            "nonce",
-            "digest",
-            "encrypted",
-        ]
-        key_derivation = encrypter["key_derivation"]
-        encrypter["key_derivation"] = None
-        key_derivation_class = class_map[key_derivation.pop("class")]
-        encrypter_class = class_map[encrypter.pop("class")]
-        encrypter.pop("key_derivation")
-        for b64_key in b64_list:
-            for key in encrypter:
-                if key == b64_key:
-                    encrypter[key] = b64decode(encrypter[key])
-            for key in key_derivation:
-                if key == b64_key:
-                    key_derivation[key] = b64decode(key_derivation[key])
+        if not isinstance(data, dict):
+            data = parse_envelope(data)
+        # The envelope is left as is, for other passphrases to be tried:
+        key_derivation = dict(data["key_derivation"])
         key_derivation["passphrase"] = passphrase.encode("utf-8")
-        encrypter["key_derivation"] = key_derivation_class.parse_obj(key_derivation)
-        self.encrypter = encrypter_class.parse_obj(encrypter)
-        data.clear()
+        encrypter = dict(data["encrypter"])
+        encrypter["key_derivation"] = data["key_derivation_class"].parse_obj(
+            key_derivation
+        )
+        self.encrypter = data["encrypter_class"].parse_obj(encrypter)
         group = ujson.loads(self.encrypter.get("decrypted"))
         assert isinstance(group, dict)
         group["listener"] = self
+        entries = group.pop("entries")
+        group["entries"] = []
         self.group = Group.parse_obj(group)
+        self.group._unloaded = entries
+        self.index = None
+        self.saved_index = None
+        self.index_changes = None
+        self.indexing = None
+        if data["index"] is not None:
+            # Left sealed until the first search, see index_steps. Until then,
+            # the nodes built from the snapshot and the changes made are noted:
+            snapshot = {"entries": entries}
+            self.saved_index = {
+                "sealed": data["index"],
+                "snapshot": snapshot,
+                "nodes": {id(snapshot): self.group},
+            }
+            self.index_changes = []
+        if lazy:
+            # Only build the root group and its direct children:
+            group_materialize(self.group)
+        else:
+            group_materialize_all(self.group)
+        self.reset_journal(data["snapshot_size"])
+        self.replay_journal(data["records"])
+
+    def replay_journal(self, records):
+        key_derivation = self.encrypter.get("key_derivation")
+        last = len(records) - 1
+        for i, record in enumerate(records):
+            try:
+                record = ujson.loads(record)
+                nonce = b64decode(record["nonce"])
+                digest = b64decode(record["digest"])
+                encrypted = b64decode(record["encrypted"])
+            except (ValueError, KeyError, TypeError):
+                if i == last:
+                    # A torn write, which the next save must overwrite:
+                    self.compaction_due = True
+                    break
+                raise
+            record = AESGCM(
+                key_derivation=key_derivation,
+                nonce=nonce,
+                associated_data=self.journal_digest,
+                encrypted=encrypted,
+                digest=digest,
+            )
+            for change in ujson.loads(record.get("decrypted")):
+                self.apply_change(change)
+            self.journal_digest = digest
+            self.journal_size += len(records[i]) + 1
@@ -0,0 +1,518 @@
+"""
+Copyright (c) 2022 Nader G. Zeid
+
+This file is part of HerePass.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from tempfile import TemporaryDirectory
+
+import ujson
+from Crypto.Random import get_random_bytes
+
+from herepass import (
+    Group,
+    HerePass,
+    SearchIndex,
+    group_materialize_all,
+    parse_envelope,
+)
+from herepass_writer import VaultFile, fsync_policies
+
+try:
+    import resource
+except ImportError:
+    # Not on Windows, where peak RSS goes unreported:
+    resource = None
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    count = len(latencies)
+
+    def percentile(fraction):
+        return latencies[min(count - 1, int(fraction * count))] * 1000
+
+    return {
+        "count": count,
+        "mean_ms": sum(latencies) / count * 1000,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": latencies[-1] * 1000,
+    }
+
+
+def benchmark_saves(
+    directory, saves, snapshot_size, record_size, compact_every, batch_interval
+):
+    """
+    Times journal appends and periodic compactions, as the writer would
+    issue them, under every fsync policy.
+    """
+    snapshot = get_random_bytes(snapshot_size)
+    record = b"\n" + get_random_bytes(record_size)
+    output = {}
+    for policy in fsync_policies:
+        path = os.path.join(directory, policy + ".enc.json")
+        with open(path, "wb") as handle:
+            handle.write(snapshot)
+        vault_file = VaultFile(path, open(path, "rb+"), policy, batch_interval)
+        appends = []
+        rewrites = []
+        for i in range(1, saves + 1):
+            started = time.perf_counter()
+            if i % compact_every:
+                vault_file.append(record)
+                appends.append(time.perf_counter() - started)
+            else:
+                vault_file.rewrite(snapshot)
+                rewrites.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        vault_file.close()
+        output[policy] = {
+            "append": summarize(appends),
+            "rewrite": summarize(rewrites) if rewrites else None,
+            "close_ms": (time.perf_counter() - started) * 1000,
+        }
+    return output
+
+
+def synthetic_group(nodes, vocabulary_size, fanout, generator):
+    """
+    A materialized group of about "nodes" groups and entries labeled with
+    words from a random vocabulary, half the entries holding non-secret
+    content. Each was created and updated at random over five years.
+    """
+    vocabulary = [
+        "".join(generator.choices(string.ascii_lowercase, k=generator.randint(4, 10)))
+        for i in range(vocabulary_size)
+    ]
+
+    def text(words):
+        return " ".join(generator.choices(vocabulary, k=words))
+
+    now = datetime.now(timezone.utc)
+
+    def times(child):
+        created = now - timedelta(seconds=generator.randrange(5 * 365 * 86400))
+        updated = created + (now - created) * generator.random()
+        child["created"] = created.isoformat()
+        child["updated"] = updated.isoformat()
+        return child
+
+    root = {"label": text(2), "entries": []}
+    groups = [root]
+    count = 1
+    i = 0
+    while count < nodes:
+        parent = groups[i % len(groups)]
+        i += 1
+        if generator.random() < 1 / fanout:
+            child = times({"label": text(2), "description": text(3), "entries": []})
+            groups.append(child)
+        else:
+            secret = generator.random() < 0.5
+            child = times({"label": text(2), "content": text(2), "secret": secret})
+        parent["entries"].append(child)
+        count += 1
+    group = Group.parse_obj({"label": root["label"], "entries": []})
+    group._unloaded = root["entries"]
+    group_materialize_all(group)
+    return group
+
+
+def misspell(word, generator):
+    # One typo anywhere but the first letter:
+    letters = list(word)
+    position = generator.randrange(1, len(letters))
+    letter = generator.choice(string.ascii_lowercase)
+    typo = generator.choice(("substitute", "insert", "delete", "transpose"))
+    if typo == "substitute":
+        letters[position] = letter
+    elif typo == "insert":
+        letters.insert(position, letter)
+    elif typo == "delete":
+        del letters[position]
+    else:
+        letters[position - 1], letters[position] = (
+            letters[position],
+            letters[position - 1],
+        )
+    return "".join(letters)
+
+
+def benchmark_search(nodes, vocabulary_size, fanout, queries, typed, limit, seed):
+    """
+    Times index building and ranked queries over a synthetic vault. Recall
+    is how often the node a query was made from ranks within the top
+    "limit", with its label's words intact, cut to prefixes, or with the
+    first one misspelled. The first "typed" labels are also typed out one
+    keystroke at a time.
+    """
+    generator = random.Random(seed)
+    group = synthetic_group(nodes, vocabulary_size, fanout, generator)
+    started = time.perf_counter()
+    index = SearchIndex()
+    index.build(group)
+    build_ms = (time.perf_counter() - started) * 1000
+    targets = generator.sample(list(index.nodes.values()), queries)
+    kinds = {
+        "exact": lambda words: words,
+        "prefix": lambda words: [i[slice(max(3, len(i) // 2))] for i in words],
+        "typo": lambda words: [misspell(words[0], generator)] + words[1:],
+    }
+    output = {"nodes": len(index.nodes), "build_ms": build_ms}
+    for kind, transform in kinds.items():
+        latencies = []
+        found = 0
+        for target in targets:
+            search_phrase = " ".join(transform(target.label.split()))
+            started = time.perf_counter()
+            matched = index.find(search_phrase, limit)
+            latencies.append(time.perf_counter() - started)
+            found += any(i is target for i in matched)
+        output[kind] = summarize(latencies)
+        output[kind]["recall"] = found / queries
+    # Typing a label out, each keystroke either refining the last search or,
+    # for comparison, searching from scratch:
+    for kind, refining in (("typing", True), ("typing_from_scratch", False)):
+        latencies = []
+        for target in targets[:typed]:
+            index.last_search = None
+            for length in range(1, len(target.label) + 1):
+                if not refining:
+                    index.last_search = None
+                started = time.perf_counter()
+                index.find(target.label[slice(length)], limit)
+                latencies.append(time.perf_counter() - started)
+        output[kind] = summarize(latencies)
+    latencies = []
+    for letter in string.ascii_lowercase:
+        started = time.perf_counter()
+        index.find(letter, limit)
+        latencies.append(time.perf_counter() - started)
+    output["single_letter"] = summarize(latencies)
+    # Time ranges, alone and narrowed by a flag or a word:
+    latencies = []
+    for i in range(queries):
+        day = datetime.now(timezone.utc) - timedelta(days=generator.randrange(1825))
+        search_phrase = generator.choice(
+            ("updated:<{}", "created:{} is:secret", "updated:>={} " + targets[i].label)
+        ).format(day.strftime("%Y-%m-%d"))
+        started = time.perf_counter()
+        index.find(search_phrase, limit)
+        latencies.append(time.perf_counter() - started)
+    output["time_range"] = summarize(latencies)
+    # Opening the vault lazily then searching it, with the index saved by
+    # the last compaction or without, rebuilding it:
+    vault = HerePass()
+    vault.create("benchmark")
+    vault.group._unloaded = ujson.loads(ujson.dumps(group.portable_dict()))["entries"]
+    vault.search(targets[0].label, limit)
+    saved = vault.to_encrypted_json()
+    unsaved = ujson.loads(saved)
+    output["index_bytes"] = len(unsaved.pop("index")["encrypted"])
+    unsaved = ujson.dumps(unsaved).encode()
+    for kind, data in (("first_search", saved), ("first_search_rebuilt", unsaved)):
+        opened = HerePass()
+        # What the UI does while the passphrase is typed, then once it's in:
+        started = time.perf_counter()
+        envelope = parse_envelope(data)
+        parse_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        opened.from_encrypted_json("benchmark", envelope, lazy=True)
+        unlock_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        opened.search(targets[1].label, limit)
+        search_ms = (time.perf_counter() - started) * 1000
+        output[kind] = {
+            "open_ms": parse_ms + unlock_ms,
+            "parse_ms": parse_ms,
+            "unlock_ms": unlock_ms,
+            "search_ms": search_ms,
+        }
+    return output
+
+
+def benchmark_ui(nodes, vocabulary_size, fanout, iterations, seed, directory):
+    """
+    Drives HerePassUI frame by frame through Kivy's event loop, on a
+    synthetic vault: unlocking it, opening subgroups and going back,
+    searching, then editing and saving the root group. Each operation is
+    timed from its button's release to the frame its result is shown in,
+    and the window's widgets are counted then.
+    """
+    # Kivy must neither parse these arguments nor be imported before. Unless
+    # told otherwise, its window is drawn offscreen, so that no display is
+    # needed, though still through OpenGL, whose time counts:
+    os.environ["KIVY_NO_ARGS"] = "1"
+    os.environ.setdefault("KIVY_WINDOW", "sdl2")
+    os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+    from kivy.base import EventLoop
+    from kivy.core.window import Window
+    from kivy.uix.button import Button
+    from kivy.uix.textinput import TextInput
+
+    from herepass_ui import HerePassUI
+
+    generator = random.Random(seed)
+    group = synthetic_group(nodes, vocabulary_size, fanout, generator)
+    labels = []
+    groups = [group]
+    while groups:
+        current_group = groups.pop()
+        for i in current_group.entries:
+            labels.append(i.get("label"))
+            if isinstance(i, Group):
+                groups.append(i)
+    vault = HerePass()
+    vault.create("benchmark")
+    vault.group._unloaded = ujson.loads(ujson.dumps(group.portable_dict()))["entries"]
+    path = os.path.join(directory, "benchmark.enc.json")
+    with open(path, "wb") as handle:
+        handle.write(vault.to_encrypted_json())
+
+    app = HerePassUI()
+    # As App.run would, short of its loop:
+    app._run_prepare()
+    data = app.data
+    latencies = {}
+    widgets = {}
+
+    def walk(widget):
+        pending = [widget]
+        while pending:
+            current_widget = pending.pop()
+            yield current_widget
+            pending.extend(current_widget.children)
+
+    def find_button(text):
+        for widget in walk(Window):
+            if isinstance(widget, Button) and widget.text == text:
+                if not widget.disabled:
+                    return widget
+        return None
+
+    def frames_until(done, timeout=120):
+        started = time.perf_counter()
+        while not done():
+            if time.perf_counter() - started > timeout:
+                raise TimeoutError("The UI didn't respond in time.")
+            EventLoop.idle()
+
+    def timed(name, action, done):
+        started = time.perf_counter()
+        action()
+        frames_until(done)
+        # The frame it's shown in:
+        EventLoop.idle()
+        latencies.setdefault(name, []).append(time.perf_counter() - started)
+        count = sum(1 for i in walk(Window))
+        widgets[name] = max(widgets.get(name, 0), count)
+
+    def press(text):
+        return lambda: find_button(text).dispatch("on_release")
+
+    def page_replaced():
+        page = data.current_page
+        return lambda: data.current_page is not page
+
+    frames_until(lambda: data.startup["first_frame_ms"] is not None)
+    # Unlocking, through the file chooser:
+    timed(
+        "file_chooser",
+        press("Load an Existing File"),
+        lambda: data.current_layout is data.file_load_layout,
+    )
+    timed(
+        "list_directory",
+        lambda: setattr(data.file_load_chooser, "path", directory),
+        lambda: path in data.file_load_chooser.files,
+    )
+    data.file_load_chooser.selection = [path]
+    timed("password_page", press("Continue"), page_replaced())
+    data.enter_password_text_input.text = "benchmark"
+    data.edit_allowed_checkbox.active = True
+    timed("unlock", press("Load"), lambda: find_button("Edit") is not None)
+    # Opening subgroups at random, then going back up:
+    depth = 0
+    for i in range(iterations):
+        # Subgroups are listed last, their rows only built once in view:
+        data.main_layout.scroll_y = 0
+        EventLoop.idle()
+        subgroup_buttons = [
+            widget
+            for widget in walk(data.current_page)
+            if hasattr(widget, "herepass_subgroup")
+        ]
+        if subgroup_buttons and depth < 3:
+            subgroup_button = generator.choice(subgroup_buttons)
+            timed(
+                "open_group",
+                lambda: subgroup_button.dispatch("on_release"),
+                page_replaced(),
+            )
+            depth += 1
+        elif depth:
+            timed("back", press("Back"), page_replaced())
+            depth -= 1
+    while depth:
+        timed("back", press("Back"), page_replaced())
+        depth -= 1
+    # Searching, the first search building the index:
+    timed("search_page", press("Search"), page_replaced())
+    search_input = next(i for i in walk(data.current_page) if isinstance(i, TextInput))
+    search_results = data.current_page.children[0]
+
+    def results_shown(previous):
+        def done():
+            children = search_results.children
+            return (
+                children
+                and not any(i in previous for i in children)
+                and not any(
+                    getattr(i, "text", "") == "Indexing the vault..." for i in children
+                )
+            )
+
+        return done
+
+    for i in range(iterations + 1):
+        # Focused, it drops its placeholder:
+        search_input.focus = True
+        search_input.text = generator.choice(labels)
+        previous = list(search_results.children)
+        timed(
+            "first_search" if not i else "search",
+            press("Search"),
+            results_shown(previous),
+        )
+    timed("search_cancel", press("Cancel"), page_replaced())
+    # Editing the root group, then saving it:
+    for i in range(iterations):
+        timed(
+            "edit",
+            press("Edit"),
+            lambda: find_button("Save") is not None
+            and find_button("Add Subgroup") is not None,
+        )
+        label_input = next(
+            i
+            for i in walk(data.current_page)
+            if isinstance(i, TextInput) and i.text == data.herepass.group.get("label")
+        )
+        label_input.text = label_input.text.split(" #")[0] + " #{}".format(i)
+        find_button("Save").dispatch("on_release")
+        frames_until(lambda: find_button("Confirm") is not None)
+        timed("save", press("Confirm"), lambda: find_button("Edit") is not None)
+    app.clean_up_current_file()
+    data.jobs.stop()
+
+    output = {
+        "nodes": nodes,
+        "file_bytes": os.path.getsize(path),
+        "startup": data.startup,
+        "operations": {
+            name: dict(summarize(latencies[name]), widgets=widgets[name])
+            for name in latencies
+        },
+        "layout_passes": data.layout_passes,
+        "collections": data.collection_stats[-1] if data.collection_stats else None,
+        "jobs": {},
+        "peak_rss_mb": None,
+    }
+    for job in data.jobs.history:
+        output["jobs"].setdefault(job["name"], []).append(job["wall_ms"] / 1000)
+    output["jobs"] = {name: summarize(i) for name, i in output["jobs"].items()}
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Kilobytes, but bytes on macOS:
+        output["peak_rss_mb"] = peak / (1048576 if sys.platform == "darwin" else 1024)
+    return output
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(description="HerePass benchmarks.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    saves = subparsers.add_parser("saves", help="Save latency per fsync policy.")
+    saves.add_argument("--directory", default=None)
+    saves.add_argument("--saves", type=int, default=200)
+    saves.add_argument("--snapshot-size", type=int, default=1048576)
+    saves.add_argument("--record-size", type=int, default=512)
+    saves.add_argument("--compact-every", type=int, default=50)
+    saves.add_argument("--batch-interval", type=float, default=2.0)
+    search = subparsers.add_parser(
+        "search", help="Ranked search latency and recall on a synthetic vault."
+    )
+    search.add_argument("--nodes", type=int, default=100000)
+    search.add_argument("--vocabulary-size", type=int, default=20000)
+    search.add_argument("--fanout", type=int, default=10)
+    search.add_argument("--queries", type=int, default=200)
+    search.add_argument("--typed", type=int, default=20)
+    search.add_argument("--limit", type=int, default=50)
+    search.add_argument("--seed", type=int, default=0)
+    ui = subparsers.add_parser(
+        "ui", help="Page build and navigation latency on a synthetic vault."
+    )
+    ui.add_argument("--directory", default=None)
+    ui.add_argument("--nodes", type=int, default=2000)
+    ui.add_argument("--vocabulary-size", type=int, default=2000)
+    ui.add_argument("--fanout", type=int, default=10)
+    ui.add_argument("--iterations", type=int, default=20)
+    ui.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args(arguments)
+    if arguments.benchmark == "search":
+        output = benchmark_search(
+            arguments.nodes,
+            arguments.vocabulary_size,
+            arguments.fanout,
+            arguments.queries,
+            arguments.typed,
+            arguments.limit,
+            arguments.seed,
+        )
+    elif arguments.benchmark == "ui":
+        with TemporaryDirectory(dir=arguments.directory) as directory:
+            output = benchmark_ui(
+                arguments.nodes,
+                arguments.vocabulary_size,
+                arguments.fanout,
+                arguments.iterations,
+                arguments.seed,
+                directory,
+            )
+    elif arguments.benchmark == "saves":
+        with TemporaryDirectory(dir=arguments.directory) as directory:
+            output = benchmark_saves(
+                directory,
+                arguments.saves,
+                arguments.snapshot_size,
+                arguments.record_size,
+                arguments.compact_every,
+                arguments.batch_interval,
+            )
+    print(ujson.dumps(output, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
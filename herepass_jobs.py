@@ -0,0 +1,165 @@
+"""
+Copyright (c) 2022 Nader G. Zeid
+
+This file is part of HerePass.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
+"""
+
+import time
+from collections import deque
+from threading import Condition, Event, Thread
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """
+    Background work submitted to a JobPool. "work" is called with the job
+    itself, to report progress and to check whether it was cancelled. Once
+    it returns or raises, "result" or "error" is set, along with how long it
+    waited, ran, and spent on the CPU.
+    """
+
+    def __init__(self, pool, name, work, on_done, on_progress):
+        self.pool = pool
+        self.name = name
+        self.work = work
+        self.on_done = on_done
+        self.on_progress = on_progress
+        self.cancel_event = Event()
+        self.finished = Event()
+        self.result = None
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.queued_time = None
+        self.wall_time = None
+        self.cpu_time = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        # Running work stops at its next check, queued work never starts:
+        self.cancel_event.set()
+
+    def check(self):
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def wait(self, timeout=None):
+        # Whether it ran, or was skipped once cancelled, within "timeout":
+        return self.finished.wait(timeout)
+
+    def progress(self, done, total):
+        if self.on_progress is not None and not self.cancelled:
+            self.pool.post(lambda: self.on_progress(self, done, total))
+
+    def run(self):
+        started = time.perf_counter()
+        self.queued_time = started - self.submitted_at
+        cpu_started = time.thread_time()
+        try:
+            self.check()
+            self.result = self.work(self)
+        except Exception as caught:
+            self.error = caught
+        self.cpu_time = time.thread_time() - cpu_started
+        self.wall_time = time.perf_counter() - started
+        # Whatever the work held, passphrases included, goes with it:
+        self.work = None
+        self.finished.set()
+
+
+class JobPool:
+    """
+    Runs jobs first in, first out on at most "workers" threads, started as
+    needed. Callbacks are handed to "post", which runs them on the UI's
+    thread: "on_progress" with the job, units done and the total, then
+    "on_done" with the job exactly once, cancelled or not.
+    """
+
+    def __init__(self, post, workers=2, history_size=100):
+        self.post = post
+        self.workers = workers
+        self.condition = Condition()
+        self.queue = deque()
+        self.running = set()
+        self.threads = []
+        self.idle = 0
+        self.keep_running = True
+        # Timings of the latest finished jobs, oldest first:
+        self.history = deque(maxlen=history_size)
+
+    def submit(self, name, work, on_done=None, on_progress=None):
+        job = Job(self, name, work, on_done, on_progress)
+        with self.condition:
+            if not self.keep_running:
+                raise RuntimeError("The job pool is stopped.")
+            self.queue.append(job)
+            if not self.idle and len(self.threads) < self.workers:
+                thread = Thread(target=self.run, daemon=True)
+                self.threads.append(thread)
+                thread.start()
+            self.condition.notify()
+        return job
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.idle += 1
+                while self.keep_running and not self.queue:
+                    self.condition.wait()
+                self.idle -= 1
+                if not self.queue:
+                    return
+                job = self.queue.popleft()
+                self.running.add(job)
+            job.run()
+            with self.condition:
+                self.running.discard(job)
+            self.history.append(
+                {
+                    "name": job.name,
+                    "outcome": (
+                        "cancelled"
+                        if isinstance(job.error, JobCancelled)
+                        else "failed"
+                        if job.error is not None
+                        else "done"
+                    ),
+                    "queued_ms": job.queued_time * 1000,
+                    "wall_ms": job.wall_time * 1000,
+                    "cpu_ms": job.cpu_time * 1000,
+                }
+            )
+            if job.on_done is not None:
+                self.post(lambda job=job: job.on_done(job))
+
+    def stop(self):
+        """
+        Cancels every job, running or queued, then waits for the threads to
+        end. Queued jobs still report, cancelled.
+        """
+        with self.condition:
+            self.keep_running = False
+            for job in list(self.queue) + list(self.running):
+                job.cancel()
+            self.condition.notify_all()
+            threads = list(self.threads)
+        for thread in threads:
+            thread.join()
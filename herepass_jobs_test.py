@@ -0,0 +1,113 @@
+"""
+Copyright (c) 2022 Nader G. Zeid
+
+This file is part of HerePass.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
+"""
+
+import time
+from queue import Queue
+from threading import Event
+
+from herepass_jobs import JobCancelled, JobPool
+
+
+def drain(posted, count, timeout=5):
+    # Runs posted callbacks as the UI's thread would, until "count" ran:
+    for i in range(count):
+        posted.get(timeout=timeout)()
+
+
+def test_job_pool():
+    posted = Queue()
+    pool = JobPool(posted.put, 2)
+    done = []
+    progress = []
+
+    def work(job):
+        for i in range(3):
+            job.progress(i + 1, 3)
+        return sum(range(100000))
+
+    def fail(job):
+        raise ValueError("Bad input")
+
+    pool.submit("sum", work, done.append, lambda *args: progress.append(args[1:]))
+    pool.submit("fail", fail, done.append)
+    drain(posted, 5)
+    assert progress == [(1, 3), (2, 3), (3, 3)]
+    done.sort(key=lambda job: job.name)
+    assert done[0].name == "fail"
+    assert isinstance(done[0].error, ValueError)
+    assert done[1].result == sum(range(100000))
+    assert done[1].error is None
+    # Timed, the work itself let go of:
+    assert done[1].wall_time >= 0 and done[1].cpu_time >= 0
+    assert done[1].work is None
+    outcomes = sorted((i["name"], i["outcome"]) for i in pool.history)
+    assert outcomes == [("fail", "failed"), ("sum", "done")]
+    assert all(i["wall_ms"] >= 0 and i["cpu_ms"] >= 0 for i in pool.history)
+    pool.stop()
+    assert all(not i.is_alive() for i in pool.threads)
+
+
+def test_job_pool_cancellation():
+    posted = Queue()
+    pool = JobPool(posted.put, 1)
+    started = Event()
+    done = []
+
+    def wait(job):
+        started.set()
+        while True:
+            job.check()
+            time.sleep(0.01)
+
+    def never(job):
+        raise AssertionError("A cancelled job ran.")
+
+    running = pool.submit("wait", wait, done.append)
+    queued = pool.submit("never", never, done.append)
+    assert started.wait(5)
+    assert not running.wait(0.05)
+    queued.cancel()
+    running.cancel()
+    assert running.wait(5) and queued.wait(5)
+    drain(posted, 2)
+    assert [i.name for i in done] == ["wait", "never"]
+    assert all(isinstance(i.error, JobCancelled) for i in done)
+    assert [i["outcome"] for i in pool.history] == ["cancelled", "cancelled"]
+    # Stopping cancels what's left, which still reports:
+    started.clear()
+    pool.submit("wait", wait, done.append)
+    pool.submit("never", never, done.append)
+    assert started.wait(5)
+    pool.stop()
+    drain(posted, 2)
+    assert len(done) == 4
+    assert all(isinstance(i.error, JobCancelled) for i in done)
+
+
+def test_job_pool_bounded():
+    posted = Queue()
+    pool = JobPool(posted.put, 2)
+    release = Event()
+    for i in range(6):
+        pool.submit(str(i), lambda job: release.wait(5))
+    time.sleep(0.1)
+    assert len(pool.threads) == 2
+    release.set()
+    pool.stop()
+    assert len(pool.history) == 6
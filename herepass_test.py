@@ -32,6 +32,10 @@ from herepass import (
     GroupListener,
     HerePass,
     Scrypt,
+    SearchIndex,
+    node_tokens,
+    parse_envelope,
+    vault_header,
 )
 
 
@@ -478,6 +482,29 @@ def test_group():
     assert ujson.dumps(grs1) == ujson.dumps(grs1_r)
 
 
+def test_unchanged_values(passphrase_1):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    sh1.to_encrypted_json()
+    sh1_en1 = sh1.group.add_entry("enl1", "ens1", True)
+    sh1.to_journal_record()
+    sh1_u1 = sh1_en1.get("updated")
+    sh1_en1.set("label", "enl1")
+    sh1_en1.set("content", "ens1")
+    sh1_en1.set("secret", True)
+    sh1.group.set("deleted", None)
+    sh1.group.set("description", None)
+    assert sh1_en1.get("updated") == sh1_u1
+    assert sh1.to_journal_record() == b""
+    sh1_en1.set("deleted", True)
+    sh1_u2 = sh1_en1.get("updated")
+    assert sh1_u2 > sh1_u1
+    assert sh1.to_journal_record() != b""
+    sh1_en1.set("deleted", True)
+    assert sh1_en1.get("updated") == sh1_u2
+    assert sh1.to_journal_record() == b""
+
+
 def test_group_search():
     test_group = Group.parse_obj(
         {
@@ -544,6 +571,254 @@ def test_group_search():
     assert fifth[0][2] == test_group.entries[1].entries[0]
     sixth = test_group.search("for")
     assert len(sixth) == 0
+    # The same matches, one at a time:
+    for search_phrase in ("fif six", "thir four", "el tw", "n", "for"):
+        matched = [(i, j()) for i, j in test_group.iter_search(search_phrase)]
+        assert [j for i, j in matched] == test_group.search(search_phrase)
+        assert [i for i, j in matched] == [j[-1] for i, j in matched]
+    # Without recursing, so depth doesn't matter:
+    deep_group = Group.parse_obj({"label": "Deep 0", "entries": []})
+    current_group = deep_group
+    for i in range(1, 5000):
+        current_group = current_group.add_group("Deep " + str(i), None)
+    matched = deep_group.iter_search("deep")
+    group, lineage = next(matched)
+    assert group is current_group
+    assert lineage()[0] is deep_group
+    assert len(lineage()) == 5000
+    assert len(deep_group.search("deep 4999")) == 1
+
+
+def test_herepass_search(passphrase_1):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    sh1.group.set("label", "First Second")
+    sh1.group.set("description", "Third Fourth")
+    sh1_gr1 = sh1.group.add_group("Fifth Sixth", "Seventh Eighth")
+    sh1_gr1.add_entry("en1", "en1_c", False)
+    sh1_gr2 = sh1.group.add_group("Thirteenth Fourteenth", "Fifteenth Sixteenth")
+    sh1_gr3 = sh1_gr2.add_group("Ninth Tenth", "Eleventh Twelfth")
+    sh1_gr4 = sh1.group.add_group("Element Twice", None)
+    sh1.group.add_entry("en3", "en3_c", False)
+
+    def labels(search_phrase, limit=None, fuzzy=True):
+        return [
+            [i.label for i in lineage]
+            for lineage in sh1.search(search_phrase, limit, fuzzy)
+        ]
+
+    # Without typos, the same groups as Group.search:
+    for search_phrase in ("fif six", "thir four", "el tw", "el w", "n", "for"):
+        expected = [[i.label for i in j] for j in sh1.group.search(search_phrase)]
+        assert sorted(labels(search_phrase, fuzzy=False)) == sorted(expected)
+    assert labels("el tw") == [
+        ["First Second", "Element Twice"],
+        ["First Second", "Thirteenth Fourteenth", "Ninth Tenth"],
+    ]
+    assert sh1.search("") == []
+    # The index follows changes:
+    sh1_gr3.set("label", "Nineteenth")
+    assert labels("ninth", fuzzy=False) == []
+    assert labels("nineteen") == [
+        ["First Second", "Thirteenth Fourteenth", "Nineteenth"]
+    ]
+    sh1_gr3.set("description", None)
+    assert labels("eleventh", fuzzy=False) == []
+    sh1_gr1.add_group("Twentieth", None)
+    assert labels("tw") == [
+        ["First Second", "Element Twice"],
+        ["First Second", "Fifth Sixth", "Twentieth"],
+    ]
+    # Including purges:
+    sh1_gr2.set("deleted", True)
+    assert len(labels("nineteen")) == 1
+    assert sh1.search("nineteen", deleted=False) == []
+    sh1.to_encrypted_json()
+    assert labels("nineteen") == []
+    assert labels("thir") == [["First Second"]]
+    sh1_gr4.set("label", "Element Thrice")
+    assert labels("thri", fuzzy=False) == [["First Second", "Element Thrice"]]
+    # Entries match by label, and by content unless it's secret:
+    assert labels("en") == [
+        ["First Second", "en3"],
+        ["First Second", "Fifth Sixth", "en1"],
+    ]
+    assert labels("en1_c", fuzzy=False) == [["First Second", "Fifth Sixth", "en1"]]
+    assert labels("en1_c")[0] == ["First Second", "Fifth Sixth", "en1"]
+    sh1_en4 = sh1_gr4.add_entry("Bank Login", "hunter2 account", True)
+    assert labels("bank log") == [["First Second", "Element Thrice", "Bank Login"]]
+    assert labels("hunter") == []
+    sh1_en4.set("secret", False)
+    assert labels("hunter acc") == [["First Second", "Element Thrice", "Bank Login"]]
+    sh1_en4.set("content", "hunter3")
+    assert labels("acc") == []
+    sh1_en4.set("secret", True)
+    assert labels("hunter") == []
+    assert len(labels("bank")) == 1
+    # Typos are tolerated, ranking below exact matches:
+    assert labels("elemnt") == [["First Second", "Element Thrice"]]
+    assert labels("twentieht") == [["First Second", "Fifth Sixth", "Twentieth"]]
+    sh1_gr4.add_group("Elementary", None)
+    assert labels("elemen")[:2] == [
+        ["First Second", "Element Thrice"],
+        ["First Second", "Element Thrice", "Elementary"],
+    ]
+    assert labels("elemen", fuzzy=False) == labels("elemen")
+    # Labels rank above descriptions and content:
+    sh1_gr5 = sh1.group.add_group("Hidden", "Carrot")
+    sh1_gr5.add_entry("Recipe", "Carrot cake", False)
+    sh1_gr6 = sh1.group.add_group("Carrot", None)
+    assert labels("carrot") == [
+        ["First Second", "Carrot"],
+        ["First Second", "Hidden"],
+        ["First Second", "Hidden", "Recipe"],
+    ]
+    # Then recency breaks ties:
+    sh1_gr6.set("label", "Carrots")
+    sh1_gr7 = sh1.group.add_group("Carrots", None)
+    sh1_gr7.updated = datetime(2000, 1, 1, tzinfo=timezone.utc)
+    # Set directly, as set() would move it, so the index isn't told:
+    sh1.index.update(sh1_gr7)
+    assert len(sh1.search("carrot", 1)) == 1
+    assert sh1.search("carrot", 1)[0][-1] is sh1_gr6
+    assert sh1.search("carrot", 2)[1][-1] is sh1_gr7
+
+
+def test_search_refinement(passphrase_1, monkeypatch):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    sh1.group.set("label", "Alps")
+    sh1_gr1 = sh1.group.add_group("Alphabet Soup", "Letters")
+    sh1_gr1.add_entry("Alpha", "Alphanumeric", False)
+    sh1.group.add_group("Alpine", "Album Alphabetic")
+    sh1.group.add_group("Alhpabet", None)
+
+    def fresh(search_phrase):
+        index = SearchIndex()
+        index.build(sh1.group)
+        return index.find(search_phrase)
+
+    # Typing refines the last search, with the same results as a fresh one:
+    for search_phrase in ("a", "al", "alp", "alph", "alpha", "alphab", "alphabet s"):
+        assert sh1.index is None or sh1.index.last_search is not None
+        matched = [i[-1] for i in sh1.search(search_phrase)]
+        assert matched == fresh(search_phrase)
+        assert matched
+
+    def fail(*arguments):
+        raise AssertionError("The vault was scanned again!")
+
+    # Without scanning the index again:
+    with monkeypatch.context() as patched:
+        patched.setattr(sh1.index, "prefixed", fail)
+        patched.setattr(sh1.index, "fuzzy_matched", fail)
+        assert sh1.search("alphabet so")[0][-1] is sh1_gr1
+        # All words must match within the same field:
+        assert sh1.search("alphabet so le") == []
+        # Neither shorter searches nor longer words tolerating more typos
+        # can be refined:
+        with pytest.raises(AssertionError):
+            sh1.search("alphabet")
+    sh1.search("alp")
+    with monkeypatch.context() as patched:
+        patched.setattr(sh1.index, "fuzzy_matched", fail)
+        with pytest.raises(AssertionError):
+            sh1.search("alph")
+    # Changes outdate the last search:
+    sh1.search("alph")
+    sh1_gr2 = sh1.group.add_group("Alphorn", None)
+    assert sh1.search("alpho")[0][-1] is sh1_gr2
+    # A cancelled search finds nothing, and isn't refined:
+    last_search = sh1.index.last_search
+    assert sh1.index.find("alphor", cancelled=lambda: True) == []
+    assert sh1.index.last_search is last_search
+
+
+def test_search_normalization(passphrase_1):
+    test_group = Group.parse_obj({"label": "Hauptstraße", "entries": []})
+    test_group.add_group("José Núñez", "Ｆｕｌｌ Ｗｉｄｔｈ")
+    test_group.add_group("ﬁnance", None)
+    for search_phrase in ("hauptstrasse", "HAUPTSTRASSE", "hauptstraße"):
+        assert test_group.search(search_phrase) == [[test_group]]
+    for search_phrase in ("jose nunez", "JOSÉ", "nún", "full width"):
+        assert len(test_group.search(search_phrase)) == 1
+    assert test_group.search("finance")[0][-1].label == "ﬁnance"
+    # Normalized once per value:
+    tokens = node_tokens(test_group, "label")
+    assert tokens == ("hauptstrasse",)
+    assert node_tokens(test_group, "label") is tokens
+    test_group.set("label", "Ölweg")
+    assert node_tokens(test_group, "label") == ("olweg",)
+    assert test_group.search("olweg") == [[test_group]]
+    # And the same goes for the index:
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    sh1.group.set("label", "Crème Brûlée")
+    sh1_en1 = sh1.group.add_entry("Straße", "Café Noir", False)
+    assert sh1.search("creme brulee") == [[sh1.group]]
+    assert sh1.search("strasse") == [[sh1.group, sh1_en1]]
+    assert sh1.search("CAFE") == [[sh1.group, sh1_en1]]
+
+
+def test_search_query(passphrase_1):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    sh1_gr1 = sh1.group.add_group("Bank", None)
+    sh1_en1 = sh1_gr1.add_entry("PIN", "1234", True)
+    sh1_en2 = sh1_gr1.add_entry("Note", "Old bank note", False)
+    sh1_gr2 = sh1.group.add_group("Travel", "Old trips")
+
+    def utc(*arguments):
+        return datetime(*arguments, tzinfo=timezone.utc)
+
+    sh1_gr1.created = utc(2023, 3, 3)
+    sh1_en1.created = utc(2020, 1, 1)
+    sh1_en1.updated = utc(2021, 6, 15)
+    sh1_en2.created = utc(2024, 12, 31, 23, 59)
+    sh1_en2.updated = utc(2025, 1, 1)
+    sh1_gr2.created = utc(2026, 10, 5, 12)
+
+    def found(search_phrase, deleted=True):
+        return {id(i[-1]) for i in sh1.search(search_phrase, deleted=deleted)}
+
+    def ids(*nodes):
+        return {id(i) for i in nodes}
+
+    assert found("is:secret updated:<2025-01-01") == ids(sh1_en1)
+    assert found("updated:<2025-01-01") == ids(sh1_en1)
+    assert found("updated:<=2025-01-01") == ids(sh1_en1, sh1_en2)
+    assert found("updated:2025") == ids(sh1_en2)
+    assert found("created:2026-10-05") == ids(sh1_gr2)
+    assert found("created:>=2023 created:<2025") == ids(sh1_gr1, sh1_en2)
+    assert found("created:>2024-12 is:group") == ids(sh1.group, sh1_gr2)
+    # Words can be kept to a field, and mixed with the rest:
+    assert found("old") == ids(sh1_en2, sh1_gr2)
+    assert found("label:old") == set()
+    assert found("description:old") == ids(sh1_gr2)
+    assert found("content:old is:entry") == ids(sh1_en2)
+    assert found("bank is:entry") == ids(sh1_en2)
+    assert found("label:bank content:bank") == set()
+    assert found("label:bank created:<2024") == ids(sh1_gr1)
+    # Operators still being typed are ignored:
+    assert found("label: bank") == ids(sh1_gr1, sh1_en2)
+    for search_phrase in ("is:nothing", "updated:<2025-13-01", "created:25-01-01"):
+        with pytest.raises(ValueError):
+            sh1.search(search_phrase)
+    # As is a last one whose value is still being typed, when searching as
+    # it's typed:
+    assert sh1.search("bank is:s", typing=True) == sh1.search("bank")
+    assert sh1.search("is:secret updated:<2025-0", typing=True)[0][-1] is sh1_en1
+    with pytest.raises(ValueError):
+        sh1.search("updated:<2025-0 is:secret", typing=True)
+    # The indexes follow changes:
+    sh1_en1.set("label", "PIN Code")
+    assert found("updated:<2025-01-01") == set()
+    sh1_gr1.set("deleted", True)
+    assert found("bank", False) == set()
+    assert found("is:deleted", False) == ids(sh1_gr1, sh1_en1, sh1_en2)
+    assert found("is:deleted is:secret", False) == ids(sh1_en1)
+    sh1_gr1.set("deleted", None)
+    assert found("is:deleted") == set()
 
 
 def test_purge_deleted():
@@ -619,6 +894,7 @@ def test_storage_handler(passphrase_1, scrypt, nonce16, encrypt_this_1):
     sh1_d1 = sh1.encrypter.get("digest")
     sh1_e1 = sh1.encrypter.get("encrypted")
     sh1_ej1 = sh1.to_encrypted_json()
+    assert sh1_ej1.startswith(vault_header)
     sh1.from_encrypted_json(passphrase_1, sh1_ej1)
     sh1_g2 = ujson.dumps(sh1.group.portable_dict()).encode()
     sh1_n2 = sh1.encrypter.get("nonce")
@@ -643,18 +919,23 @@ def test_storage_handler(passphrase_1, scrypt, nonce16, encrypt_this_1):
     sh1_n3 = sh1.encrypter.get("nonce")
     sh1_d3 = sh1.encrypter.get("digest")
     sh1_e3 = sh1.encrypter.get("encrypted")
+    # Changes are journaled instead of re-encrypting the snapshot:
     assert sh1_n3 == sh1_n2
-    assert sh1_d3 != sh1_d2
-    assert sh1_e3 != sh1_e2
+    assert sh1_d3 == sh1_d2
+    assert sh1_e3 == sh1_e2
+    assert len(sh1.journal) == 1
     sh2.group.add_entry("test_l", "test_s", True)
     sh2_g2 = ujson.dumps(sh2.group.portable_dict()).encode()
     sh2_n2 = sh2.encrypter.get("nonce")
     sh2_d2 = sh2.encrypter.get("digest")
     sh2_e2 = sh2.encrypter.get("encrypted")
     assert sh2_n2 == sh2_n1
-    assert sh2_d2 != sh2_d1
-    assert sh2_e2 != sh2_e1
-    assert sh2_e2 != sh1_e3
+    assert sh2_d2 == sh2_d1
+    assert sh2_e2 == sh2_e1
+    assert len(sh2.journal) == 1
+    # Both were loaded from the same snapshot:
+    assert sh2_e2 == sh1_e3
+    assert sh2.journal != sh1.journal
     sh1_ej2 = sh1.to_encrypted_json()
     sh3 = HerePass()
     sh3.from_encrypted_json(passphrase_1, sh1_ej2)
@@ -677,3 +958,256 @@ def test_storage_handler(passphrase_1, scrypt, nonce16, encrypt_this_1):
     assert sh2_n2 != sh4_n
     assert sh2_d2 != sh4_d
     assert sh2_e2 != sh4_e
+
+
+def test_lazy_loading(passphrase_1):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    sh1_gr1 = sh1.group.add_group("grl1", "gro1")
+    sh1_gr2 = sh1_gr1.add_group("grl2", None)
+    sh1_gr2.add_entry("enl1", "ens1", True)
+    sh1_gr1.add_entry("enl2", "ens2", False)
+    sh1.group.add_entry("enl3", "ens3", False)
+    sh1_gr3 = sh1.group.add_group("grl3", None)
+    sh1_gr3.add_entry("enl4", "ens4", False).set(
+        "deleted", datetime.now(timezone.utc) - timedelta(seconds=10)
+    )
+    sh1_g1 = ujson.dumps(sh1.group.portable_dict())
+    sh1_ej1 = sh1.to_encrypted_json()
+    sh2 = HerePass()
+    sh2.from_encrypted_json(passphrase_1, sh1_ej1, lazy=True)
+    # Only the root group's direct children are built:
+    assert len(sh2.group.entries) == 3
+    sh2_gr1 = sh2.group.entries[1]
+    assert isinstance(sh2_gr1, Group) and sh2_gr1.get("label") == "grl1"
+    assert sh2_gr1._unloaded is not None and len(sh2_gr1.entries) == 0
+    assert sh2_gr1.get("listener") == sh2
+    assert ujson.dumps(sh2.group.portable_dict()) == sh1_g1
+    # Touching a group builds its children:
+    assert len(sh2_gr1.get("entries")) == 2
+    assert sh2_gr1._unloaded is None
+    sh2_gr2 = sh2_gr1.get("entries")[1]
+    assert sh2_gr2.get("label") == "grl2" and sh2_gr2._unloaded is not None
+    assert sh2_gr2.get("listener") == sh2
+    assert ujson.dumps(sh2.group.portable_dict()) == sh1_g1
+    # Raw subtrees are still purged:
+    sh2_gr3 = sh2.group.entries[2]
+    assert sh2_gr3._unloaded is not None and len(sh2_gr3._unloaded) == 1
+    sh2.group.purge_deleted(5)
+    assert sh2_gr3._unloaded is not None and len(sh2_gr3._unloaded) == 0
+    # Searching builds whatever it needs:
+    found = sh2.group.search("grl2")
+    assert len(found) == 1
+    assert found[0][-1] == sh2_gr2
+    assert sh2_gr2._unloaded is None
+    assert sh2_gr2.get("entries")[0].get("content") == "ens1"
+    # Changes to lazily loaded groups still reach the listener:
+    sh2_gr2.get("entries")[0].set("content", "ens1_s")
+    sh3 = HerePass()
+    sh3.from_encrypted_json(passphrase_1, sh2.to_encrypted_json())
+    assert ujson.dumps(sh3.group.portable_dict()) == ujson.dumps(
+        sh2.group.portable_dict()
+    )
+    assert sh3.group.search("grl2")[0][-1].entries[0].get("content") == "ens1_s"
+
+
+def test_saved_search_index(passphrase_1, monkeypatch):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    sh1_gr1 = sh1.group.add_group("Banking", "Money")
+    sh1_gr1.add_group("Cards", None).add_entry("Visa", "card number", False)
+    sh1_gr1.add_entry("PIN", "1234", True)
+    sh1.group.add_group("Travel", None).add_entry("Passport", "renew", False)
+    # Nothing is saved before the first search:
+    assert "index" not in ujson.loads(sh1.to_encrypted_json())
+    assert len(sh1.search("visa")) == 1
+    sh1_ej1 = sh1.to_encrypted_json()
+    assert "index" in ujson.loads(sh1_ej1)
+
+    def labels(sh, search_phrase):
+        return [[j.label for j in i] for i in sh.search(search_phrase)]
+
+    def fail(*arguments):
+        raise AssertionError("Rebuilt!")
+
+    monkeypatch.setattr(SearchIndex, "build", fail)
+    sh2 = HerePass()
+    sh2.from_encrypted_json(passphrase_1, sh1_ej1, lazy=True)
+    # Left sealed until the first search:
+    assert sh2.index is None
+    assert labels(sh2, "visa") == [["New", "Banking", "Cards", "Visa"]]
+    # Only the groups leading to a match are built:
+    sh2_gr1, sh2_gr2 = sh2.group.entries
+    assert sh2_gr1._unloaded is None and sh2_gr2._unloaded is not None
+    assert labels(sh2, "is:secret") == [["New", "Banking", "PIN"]]
+    # Changes, then those replayed from the journal, keep it current:
+    sh2_gr2.get("entries")[0].set("label", "Visa Application")
+    sh2.group.add_group("Shopping", None).add_entry("Visa Gift Card", "50", False)
+    sh2.search("number")[0][-1].set("deleted", datetime.now(timezone.utc))
+    sh2_labels = labels(sh2, "visa")
+    assert len(sh2_labels) == 3
+    assert labels(sh2, "visa is:deleted") == [["New", "Banking", "Cards", "Visa"]]
+    sh3 = HerePass()
+    sh3.from_encrypted_json(passphrase_1, sh1_ej1 + sh2.to_journal_record())
+    assert labels(sh3, "visa") == sh2_labels
+    assert labels(sh3, "passport") == []
+    # Compaction saves it again, renumbered:
+    sh3_ej1 = sh3.to_encrypted_json()
+    sh4 = HerePass()
+    sh4.from_encrypted_json(passphrase_1, sh3_ej1, lazy=True)
+    # Changes made before the first search are caught up with:
+    sh4_gr1 = [i for i in sh4.group.get("entries") if i.label == "Travel"][0]
+    sh4_gr1.add_entry("Insurance", "policy", False)
+    sh4_gr1.set("description", "Abroad")
+    assert labels(sh4, "visa") == sh2_labels
+    assert labels(sh4, "application") == [["New", "Travel", "Visa Application"]]
+    assert labels(sh4, "policy") == [["New", "Travel", "Insurance"]]
+    assert labels(sh4, "abroad") == [["New", "Travel"]]
+    # One sealed against another snapshot is rebuilt instead:
+    monkeypatch.undo()
+    sh4_file = ujson.loads(sh3_ej1)
+    sh4_file["index"] = ujson.loads(sh1_ej1)["index"]
+    sh5 = HerePass()
+    sh5.from_encrypted_json(passphrase_1, ujson.dumps(sh4_file), lazy=True)
+    assert labels(sh5, "visa") == sh2_labels
+    assert sh5.saved_index is None and sh5.index is not None
+    # Entries added under a group after deleting it, or undeleting it, are
+    # caught up with after its deletion:
+    sh6 = HerePass()
+    sh6.from_encrypted_json(passphrase_1, sh1_ej1)
+    sh6_gr1, sh6_gr2 = sh6.group.get("entries")
+    sh6_gr1.set("deleted", datetime.now(timezone.utc))
+    sh6_gr1.add_entry("Statement", "monthly", False)
+    sh6_gr2.set("deleted", datetime.now(timezone.utc))
+    sh6_gr2.set("deleted", None)
+    sh6_gr2.add_entry("Visa", "tourist", False)
+    sh7 = HerePass()
+    sh7.from_encrypted_json(passphrase_1, sh1_ej1 + sh6.to_journal_record())
+    assert labels(sh7, "monthly") == [["New", "Banking", "Statement"]]
+    assert labels(sh7, "tourist") == [["New", "Travel", "Visa"]]
+    sh8 = HerePass()
+    sh8.from_encrypted_json(passphrase_1, sh7.to_encrypted_json())
+    assert labels(sh8, "monthly") == [["New", "Banking", "Statement"]]
+
+
+def test_index_steps(passphrase_1):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    for i in range(3):
+        sh1_gr1 = sh1.group.add_group("Group " + str(i), None)
+        for j in range(3):
+            sh1_gr1.add_entry("Entry " + str(j), "content", False)
+    sh1.search("entry")
+    sh1_ej1 = sh1.to_encrypted_json()
+    sh1_file = ujson.loads(sh1_ej1)
+    del sh1_file["index"]
+    search_phrases = ("entry", "late", "renamed", "group is:deleted", "content")
+
+    def labels(index, search_phrase):
+        return [i.label for i in index.find(search_phrase)]
+
+    # Built or opened a few nodes at a time, while the vault changes:
+    for sh1_file in (ujson.dumps(sh1_file), sh1_ej1):
+        sh2 = HerePass()
+        sh2.from_encrypted_json(passphrase_1, sh1_file, lazy=True)
+        sh2.indexing = sh2.index_steps(chunk=2)
+        assert sh2.index_step()
+        sh2.group.get("entries")[0].set("label", "Renamed")
+        sh2.group.get("entries")[-1].add_entry("Late", "entry", False)
+        assert sh2.index_step()
+        sh2.group.get("entries")[1].set("deleted", datetime.now(timezone.utc))
+        assert sh2.index is None
+        # Every caller takes the same steps, never starting them over:
+        assert sh2.index_step(False)
+        sh2.open_index()
+        assert sh2.index is not None and sh2.indexing is None
+        sh2_index = SearchIndex()
+        sh2_index.build(sh2.group)
+        for search_phrase in search_phrases:
+            assert labels(sh2.index, search_phrase) == labels(sh2_index, search_phrase)
+        assert labels(sh2.index, "late") == ["Late"]
+
+
+def test_journal(passphrase_1):
+    sh1 = HerePass()
+    sh1.create(passphrase_1)
+    assert sh1.needs_compaction()
+    assert sh1.to_journal_record() == b""
+    sh1_file = sh1.to_encrypted_json()
+    assert not sh1.needs_compaction()
+    sh1_gr1 = sh1.group.add_group("grl1", "gro1")
+    sh1_gr2 = sh1_gr1.add_group("grl2", None)
+    sh1_en1 = sh1_gr2.add_entry("enl1", "ens1", True)
+    sh1_gr1.add_entry("enl2", "ens2", False)
+    sh1_record1 = sh1.to_journal_record()
+    assert sh1_record1.startswith(b"\n")
+    assert sh1.to_journal_record() == b""
+    sh1_file += sh1_record1
+    # Renaming resorts, so later changes must follow the new positions:
+    sh1.group.add_group("grl3", None).add_entry("enl3", "ens3", False)
+    sh1_gr1.set("label", "grl4")
+    sh1_en1.set("content", "ens1_s")
+    sh1_en1.set("secret", False)
+    sh1.group.entries[0].set("deleted", True)
+    sh1_gr1.set("description", None)
+    sh1_file += sh1.to_journal_record()
+    sh1_g1 = ujson.dumps(sh1.group.portable_dict())
+    sh2 = HerePass()
+    sh2.from_encrypted_json(passphrase_1, sh1_file)
+    assert ujson.dumps(sh2.group.portable_dict()) == sh1_g1
+    assert sh2.group.entries[0].get("label") == "grl4"
+    assert sh2.group.entries[1].get("deleted")
+    assert sh2.group.entries[1].entries[0].get("deleted")
+    sh3 = HerePass()
+    sh3.from_encrypted_json(passphrase_1, sh1_file, lazy=True)
+    assert ujson.dumps(sh3.group.portable_dict()) == sh1_g1
+    # Parsed once, an envelope serves every passphrase tried:
+    sh1_envelope = parse_envelope(sh1_file)
+    with pytest.raises(ValueError):
+        HerePass().from_encrypted_json(passphrase_1 + "x", sh1_envelope)
+    sh4 = HerePass()
+    sh4.from_encrypted_json(passphrase_1, sh1_envelope)
+    assert ujson.dumps(sh4.group.portable_dict()) == sh1_g1
+    # Records are chained, so one can't be dropped:
+    records = sh1_file.split(b"\n")
+    with pytest.raises(ValueError):
+        HerePass().from_encrypted_json(
+            passphrase_1, b"\n".join([records[0], records[2]])
+        )
+    # A torn final record is ignored, then overwritten by the next save:
+    sh4 = HerePass()
+    sh4.from_encrypted_json(passphrase_1, sh1_file[:-10])
+    sh4_gr1 = sh4.group.entries[0]
+    assert sh4_gr1.get("label") == "grl1"
+    assert sh4_gr1.get("entries")[1].get("entries")[0].get("content") == "ens1"
+    assert sh4.needs_compaction()
+    sh4_file = sh4.to_encrypted_json()
+    assert not sh4.needs_compaction()
+    # Compaction is due once the journal outgrows the snapshot:
+    while not sh4.needs_compaction():
+        sh4.group.add_entry("enl5", "ens5", False)
+        sh4_file += sh4.to_journal_record()
+    assert sh4.journal_size > len(sh4_file.split(b"\n")[0]) * sh4.journal_ratio
+    sh4_g1 = ujson.dumps(sh4.group.portable_dict())
+    sh5 = HerePass()
+    sh5.from_encrypted_json(passphrase_1, sh4.to_encrypted_json())
+    assert ujson.dumps(sh5.group.portable_dict()) == sh4_g1
+    # Changes made while a snapshot is sealed are journaled after it:
+    sh5_snapshot = sh5.take_snapshot()
+    sh5.group.add_entry("enl6", "ens6", False)
+    sh5_file = sh5.seal_snapshot(sh5_snapshot)
+    sh5.adopt_snapshot(sh5_snapshot)
+    assert not sh5.needs_compaction()
+    sh5_file += sh5.to_journal_record()
+    sh6 = HerePass()
+    sh6.from_encrypted_json(passphrase_1, sh5_file)
+    sh5_g1 = ujson.dumps(sh5.group.portable_dict())
+    assert ujson.dumps(sh6.group.portable_dict()) == sh5_g1
+    # Or once the file nears the largest that's opened, however small the
+    # journal:
+    sh6.file_size_limit = sh6.snapshot_size + sh6.journal_size + 1
+    assert not sh6.needs_compaction()
+    sh6.group.add_entry("enl7", "ens7", False)
+    sh6.to_journal_record()
+    assert sh6.needs_compaction()
+    assert sh6.journal_size < sh6.snapshot_size * sh6.journal_ratio
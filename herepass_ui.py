@@ -19,19 +19,31 @@ along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
 
 import gc
 import math
+import os
 import re
 import secrets
+import stat
 import string
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from heapq import heapify, heappop, heappush
 from pathlib import Path
-from threading import Thread
+from threading import RLock
+from weakref import ref
 
+import ujson
+from kivy import __version__ as kivy_version
+from kivy import parse_kivy_version
 from kivy import require as kivy_require
 from kivy.app import App
 from kivy.clock import Clock
 from kivy.config import Config
 from kivy.core.clipboard import Clipboard
+from kivy.core.text import Label as CoreLabel
 from kivy.core.window import Window
 from kivy.graphics import Color, Rectangle
+from kivy.logger import Logger
 from kivy.metrics import dp
 from kivy.uix.anchorlayout import AnchorLayout
 from kivy.uix.boxlayout import BoxLayout
@@ -41,6 +53,7 @@ from kivy.uix.checkbox import CheckBox
 from kivy.uix.filechooser import FileChooserController, FileChooserIconView
 from kivy.uix.floatlayout import FloatLayout
 from kivy.uix.label import Label
+from kivy.uix.layout import Layout
 from kivy.uix.modalview import ModalView
 from kivy.uix.relativelayout import RelativeLayout
 from kivy.uix.scrollview import ScrollView
@@ -48,14 +61,29 @@ from kivy.uix.textinput import TextInput
 from kivy.uix.widget import Widget
 from kivy.utils import escape_markup
 
-from herepass import Group, HerePass, herepass_version
+from herepass import (
+    Group,
+    HerePass,
+    herepass_version,
+    max_file_size,
+    parse_envelope,
+    vault_header,
+)
+from herepass_jobs import JobCancelled, JobPool
+from herepass_writer import DebouncedWriter, VaultFile
 
 kivy_require("2.1.0")
+# HerePassFileChooser lists directories through private parts of Kivy's
+# FileChooserController, as they are in the versions it was tested with:
+chooser_kivy_versions = ([2, 1, 0], [2, 3, 1])
+chooser_kivy_methods = ("_update_files", "_create_entry_widget")
 Config.set("input", "mouse", "mouse,disable_multitouch")
 
 
 class HerePassUI(App):
     def build(self):
+        build_started = time.perf_counter()
+
         class HerePassFileChooser(FileChooserIconView):
             def on_selection(widget_1, widget_2, selections):
                 if len(selections):
@@ -84,6 +112,62 @@ class HerePassUI(App):
                     widget_1.target_label.text = str(selected)
                     widget_1.has_errors = False
 
+            def lists_own_directories(widget_1):
+                """
+                Whether the chooser lists directories itself, only on the
+                Kivy versions it was tested against. Others list them their
+                own way, all at once, with Kivy's filters sorting out vaults.
+                """
+                if not hasattr(widget_1, "herepass_own_listing"):
+                    layout = widget_1.layout
+                    widget_1.herepass_own_listing = (
+                        chooser_kivy_versions[0]
+                        <= parse_kivy_version(kivy_version)[0]
+                        <= chooser_kivy_versions[1]
+                        and all(
+                            callable(getattr(FileChooserController, i, None))
+                            for i in chooser_kivy_methods
+                        )
+                        and isinstance(getattr(widget_1, "_items", None), list)
+                        and layout is not None
+                        and "scrollview" in layout.ids
+                        and "stacklayout" in layout.ids
+                    )
+                    if not widget_1.herepass_own_listing:
+                        Logger.warning(
+                            "HerePass: Untested with Kivy {}, which lists "
+                            "directories instead.".format(kivy_version)
+                        )
+                return widget_1.herepass_own_listing
+
+            def refresh_listing(widget_1):
+                if widget_1.lists_own_directories() or hasattr(
+                    FileChooserController, "_update_files"
+                ):
+                    widget_1._update_files()
+                else:
+                    # Relisted by Kivy whenever they change:
+                    widget_1.filters = vault_filters(widget_1)
+
+            def _update_files(widget_1, *args, **kwargs):
+                if widget_1.lists_own_directories():
+                    # Listed on a worker thread rather than all at once here:
+                    list_chooser_directory(widget_1)
+                    return
+                widget_1.filters = vault_filters(widget_1)
+                FileChooserIconView._update_files(widget_1, *args, **kwargs)
+
+            def open_entry(widget_1, entry):
+                # Opening the directory is enough to know it can be listed:
+                path = os.path.abspath(os.path.join(widget_1.path, entry.path))
+                try:
+                    os.scandir(path).close()
+                except OSError:
+                    entry.locked = True
+                    return
+                widget_1.path = path
+                widget_1.selection = [path] if widget_1.dirselect else []
+
         class ClosureData:
             pass
 
@@ -111,48 +195,100 @@ class HerePassUI(App):
                 pos=update_background_rectangle, size=update_background_rectangle
             )
 
-        def rectify_height(widget):
-            min_height = widget.size_hint_min_y
-            widget.target_height = dp(0)
-            if (
-                len(widget.children)
-                and not isinstance(widget, FileChooserController)
-                and not (
-                    isinstance(widget, BoxLayout) and widget.orientation == "horizontal"
-                )
-                and not hasattr(widget, "target_height_disabled")
+        def sums_children(widget):
+            # Vertical layouts are as tall as their children, anything else
+            # (rows, file choosers, virtual lists, plain widgets) keeps its own
+            # minimum height:
+            if isinstance(widget, FileChooserController) or hasattr(
+                widget, "target_height_disabled"
             ):
+                return False
+            if isinstance(widget, BoxLayout) and widget.orientation == "horizontal":
+                return False
+            return isinstance(widget, Layout) or len(widget.children) > 0
+
+        def measure_height(widget):
+            """
+            Children already measured contribute their last height, so only
+            new subtrees are walked.
+            """
+            if sums_children(widget):
+                height = dp(0)
                 for child in widget.children:
-                    rectify_height(child)
-                    widget.target_height += child.target_height
+                    if getattr(
+                        child, "target_height", None
+                    ) is not None and sums_children(child):
+                        height += child.target_height
+                    else:
+                        height += measure_height(child)
             else:
-                widget.target_height += min_height
+                height = widget.size_hint_min_y or dp(0)
             if hasattr(widget, "padding") and not isinstance(widget, TextInput):
                 if len(widget.padding) == 1:
-                    widget.target_height += widget.padding * 2
+                    height += widget.padding * 2
                 elif len(widget.padding) == 2:
-                    widget.target_height += widget.padding[1] * 2
+                    height += widget.padding[1] * 2
                 else:
-                    widget.target_height += widget.padding[1] + widget.padding[3]
-            widget.size_hint_min_y = widget.target_height
+                    height += widget.padding[1] + widget.padding[3]
+            widget.target_height = height
+            if sums_children(widget):
+                widget.size_hint_min_y = height
             if hasattr(widget, "target_height_as_max") and widget.target_height_as_max:
-                widget.size_hint_max_y = widget.target_height
+                widget.size_hint_max_y = height
+            return height
+
+        def widget_depth(widget):
+            # The window is its own parent:
+            depth = 0
+            while widget.parent and widget.parent is not widget:
+                widget = widget.parent
+                depth += 1
+            return depth
+
+        def run_layout_pass(delta=None):
+            """
+            Remeasures every widget invalidated since the last pass, deepest
+            first, then each ancestor whose child's height changed. Ancestors
+            are visited once however many of their children changed.
+            """
+            data.layout_passes += 1
+            if data.layout_page and data.layout_page.parent:
+                data.layout_page.layout_passes += 1
+            pending = [
+                (-widget_depth(widget), i, widget)
+                for i, widget in enumerate(data.layout_invalid.values())
+            ]
+            queued = set(data.layout_invalid)
+            data.layout_invalid = {}
+            heapify(pending)
+            order = len(pending)
+            while pending:
+                depth, i, widget = heappop(pending)
+                previous = getattr(widget, "target_height", None)
+                parent = widget.parent
+                if (
+                    measure_height(widget) != previous
+                    and parent
+                    and hasattr(parent, "target_height")
+                    and id(parent) not in queued
+                ):
+                    queued.add(id(parent))
+                    heappush(pending, (depth + 1, order, parent))
+                    order += 1
 
         def sync_height(widget, moment=-1):
-            target_widget = widget
-            while target_widget.parent and hasattr(
-                target_widget.parent, "target_height"
-            ):
-                target_widget = target_widget.parent
-            widget_id = str(id(target_widget)) + " " + str(moment)
-            if widget_id not in data.sync_height_tracker:
-                data.sync_height_tracker[widget_id] = True
-
-                def trigger_rectify_height(delta):
-                    rectify_height(target_widget)
-                    del data.sync_height_tracker[widget_id]
+            # Invalidations coalesce into one pass per moment:
+            data.layout_invalid[id(widget)] = widget
+            if moment not in data.layout_triggers:
+                data.layout_triggers[moment] = Clock.create_trigger(
+                    run_layout_pass, moment
+                )
+            data.layout_triggers[moment]()
 
-                Clock.schedule_once(trigger_rectify_height, moment)
+        def track_layout_passes(page):
+            # Counts the passes a page triggers while it's shown:
+            page.layout_passes = 0
+            data.layout_page = page
 
         def generate_v_spacer(dp_height):
             return Widget(size_hint_min_y=dp(dp_height), size_hint_max_y=dp(dp_height))
@@ -232,6 +368,180 @@ class HerePassUI(App):
             entry_widget.children[0].color = data.font_color
             entry_widget.children[1].color = data.font_color
 
+        def is_vault_file(path):
+            if path.endswith(data.file_suffix):
+                return True
+            try:
+                with open(path, "rb") as file_handle:
+                    return file_handle.read(len(vault_header)) == vault_header
+            except OSError:
+                return False
+
+        def is_listed_vault(folder, path):
+            return is_vault_file(os.path.join(folder, path))
+
+        def vault_filters(chooser):
+            # The same filter each time, so Kivy only relists when it changes:
+            return [is_listed_vault] if getattr(chooser, "vaults_only", False) else []
+
+        def list_directory(job, path, is_hidden, vaults_only, cached):
+            """
+            Lists a directory on a worker thread, folders then files, each
+            sorted. With "vaults_only", only files named like a vault or
+            starting with its header are kept. A cached listing is returned as
+            is while the directory's mtime stays the same.
+            """
+            mtime = os.stat(path).st_mtime_ns
+            if cached is not None and cached["mtime"] == mtime:
+                return cached
+            folders = []
+            files = []
+            with os.scandir(path) as scanned:
+                for i, entry in enumerate(scanned):
+                    if not i % 256:
+                        job.check()
+                    if is_hidden is not None and is_hidden(entry.path):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            folders.append(entry.path)
+                        elif not vaults_only or is_vault_file(entry.path):
+                            files.append(entry.path)
+                    except OSError:
+                        continue
+            folders.sort()
+            files.sort()
+            return {"mtime": mtime, "folders": folders, "files": files}
+
+        def list_chooser_directory(chooser):
+            path = os.path.abspath(os.path.expanduser(chooser.path))
+            chooser.path = path
+            vaults_only = getattr(chooser, "vaults_only", False)
+            is_hidden = None if chooser.show_hidden else chooser.file_system.is_hidden
+            key = (path, vaults_only, chooser.show_hidden)
+            cached = data.directory_listings.get(key)
+            previous_job = getattr(chooser, "herepass_listing_job", None)
+            if previous_job is not None:
+                previous_job.cancel()
+
+            def run_listing(job):
+                return list_directory(job, path, is_hidden, vaults_only, cached)
+
+            def end_listing(job):
+                if chooser.herepass_listing_job is not job:
+                    return
+                chooser.herepass_listing_job = None
+                if isinstance(job.error, JobCancelled):
+                    return
+                listing = job.result
+                if job.error is not None:
+                    Logger.warning(
+                        "HerePass: Unable to list {}: {}".format(path, job.error)
+                    )
+                    listing = {"mtime": None, "folders": [], "files": []}
+                else:
+                    # Most recently used last, the oldest dropped first:
+                    data.directory_listings.pop(key, None)
+                    data.directory_listings[key] = listing
+                    while len(data.directory_listings) > data.directory_listing_limit:
+                        del data.directory_listings[next(iter(data.directory_listings))]
+                show_chooser_listing(chooser, path, listing)
+
+            chooser.herepass_listing_job = data.jobs.submit(
+                "list", run_listing, end_listing
+            )
+
+        def show_chooser_listing(chooser, path, listing):
+            paths = []
+            if os.path.dirname(path) != path:
+                paths.append((os.path.dirname(path), True))
+            paths.extend((i, True) for i in listing["folders"])
+            paths.extend((i, False) for i in listing["files"])
+            chooser.herepass_paths = paths
+            chooser.herepass_entries = {}
+            chooser.herepass_window = None
+            chooser.files[:] = [i[0] for i in paths]
+            chooser.dispatch("on_entries_cleared")
+            if not hasattr(chooser, "herepass_spacers"):
+                chooser.herepass_spacers = (
+                    Widget(size_hint=(1, None)),
+                    Widget(size_hint=(1, None)),
+                )
+                scroll_view = chooser.layout.ids.scrollview
+                stack = chooser.layout.ids.stacklayout
+                chooser_ref = ref(chooser)
+
+                def refresh_entries(widget=None, value=None):
+                    refresh_chooser_entries(chooser_ref())
+
+                scroll_view.bind(scroll_y=refresh_entries, height=refresh_entries)
+                stack.bind(width=refresh_entries)
+            refresh_chooser_entries(chooser)
+
+        def refresh_chooser_entries(chooser):
+            """
+            Only keeps entries for the rows around the chooser's view, the rows
+            above and below them stood in for by spacers, so that a directory
+            takes as long to show whatever number of files it has.
+            """
+            scroll_view = chooser.layout.ids.scrollview
+            stack = chooser.layout.ids.stacklayout
+            paths = chooser.herepass_paths
+            cell = dp(100)
+            gap = dp(10)
+            row_height = cell + gap
+            columns = max(1, int((stack.width - gap) // row_height))
+            rows = math.ceil(len(paths) / columns)
+            content_height = 2 * gap + max(0, rows * row_height - gap)
+            hidden_height = max(0, content_height - scroll_view.height)
+            view_top = (1 - scroll_view.scroll_y) * hidden_height
+            first = max(0, int((view_top - gap) // row_height) - 1)
+            last = min(rows, int((view_top + scroll_view.height) // row_height) + 2)
+            window = (columns, first, last)
+            if chooser.herepass_window == window:
+                return
+            chooser.herepass_window = window
+            entries = chooser.herepass_entries
+            start = first * columns
+            end = min(len(paths), last * columns)
+            for i in [i for i in entries if not start <= i < end]:
+                del entries[i]
+            top_spacer, bottom_spacer = chooser.herepass_spacers
+            stack.clear_widgets()
+            # Spacing follows each spacer as it would a row:
+            if first:
+                top_spacer.height = first * row_height - gap
+                stack.add_widget(top_spacer)
+            controller = ref(chooser)
+            visible = []
+            for i in range(start, end):
+                if i not in entries:
+                    path, is_dir = paths[i]
+                    parent_entry = i == 0 and os.path.dirname(chooser.path) == path
+                    entries[i] = chooser._create_entry_widget(
+                        {
+                            "name": "..{}".format(os.sep)
+                            if parent_entry
+                            else os.path.basename(path),
+                            "get_nice_size": (
+                                lambda path=path: chooser.get_nice_size(path)
+                            )
+                            if not parent_entry
+                            else lambda: "",
+                            "path": path,
+                            "controller": controller,
+                            "isdir": is_dir,
+                            "parent": None,
+                            "sep": os.sep,
+                        }
+                    )
+                visible.append(entries[i])
+                chooser.dispatch("on_entry_added", entries[i], None)
+            chooser._items = visible
+            if last < rows:
+                bottom_spacer.height = (rows - last) * row_height - gap
+                stack.add_widget(bottom_spacer)
+
         def generate_button(text, height, font_size):
             button = Button(
                 text=text,
@@ -246,11 +556,94 @@ class HerePassUI(App):
             button.bind(size=button.setter("text_size"))
             return button
 
+        def write_encrypted():
+            # The tree is only read while the lock is held, not while
+            # encrypting or writing:
+            with data.herepass_lock:
+                compacting = data.herepass.needs_compaction()
+            if compacting:
+                # The index saved is opened first, to be saved again, a step
+                # at a time like searches do:
+                while True:
+                    with data.herepass_lock:
+                        if not data.herepass.index_step(False):
+                            break
+                with data.herepass_lock:
+                    snapshot = data.herepass.take_snapshot()
+                output = data.herepass.seal_snapshot(snapshot)
+                with data.herepass_lock:
+                    data.herepass.adopt_snapshot(snapshot)
+            else:
+                with data.herepass_lock:
+                    # Only append what changed since the last save:
+                    output = data.herepass.to_journal_record()
+                if not output:
+                    return
+            try:
+                if compacting:
+                    data.vault_file.rewrite(output)
+                else:
+                    data.vault_file.append(output)
+            except Exception:
+                # The file no longer matches the journal, so rewrite it next:
+                with data.herepass_lock:
+                    data.herepass.compaction_due = True
+                raise
+
+        def report_written(error):
+            """
+            Called from the writer's thread after every write. Failures are
+            shown, and written again by the next save or when closing, see
+            DebouncedWriter. The first save to succeed after them takes their
+            error down.
+            """
+            failed_before = data.save_error is not None
+            data.save_error = error
+
+            def show_write_error(delta):
+                if data.current_page:
+                    show_error_bubble(
+                        data.current_page, "Unable to save: " + str(error), True
+                    )
+
+            def hide_write_error(delta):
+                if data.error_bubble and data.error_bubble_label.text.startswith(
+                    "Unable to save: "
+                ):
+                    destroy_error_bubble()
+
+            if error is not None:
+                Clock.schedule_once(show_write_error, 0)
+            elif failed_before:
+                Logger.info("HerePass: Saved after failing to.")
+                Clock.schedule_once(hide_write_error, 0)
+
+        def open_vault_file():
+            # It takes over the handle, which every rewrite replaces:
+            data.vault_file = VaultFile(
+                data.current_file, data.current_file_handle, data.fsync_policy
+            )
+            data.current_file_handle = None
+
+        def post_to_ui(callback):
+            # For the job pool, whose callbacks come from its threads:
+            def run_posted(delta):
+                callback()
+
+            Clock.schedule_once(run_posted, 0)
+
+        def sync_vault_file():
+            # Saves the batched policy put off get synced once they're due:
+            return data.vault_file.sync()
+
+        def start_writer():
+            data.writer = DebouncedWriter(
+                write_encrypted, report_written, idle=sync_vault_file
+            )
+            data.writer.start()
+
         def flush_encrypted():
-            data.current_file_handle.seek(0)
-            data.current_file_handle.write(data.herepass.to_encrypted_json())
-            data.current_file_handle.truncate()
-            data.current_file_handle.flush()
+            data.writer.request()
 
         def adjust_text_size_width(widget, value):
             widget.text_size[0] = value
@@ -324,6 +717,8 @@ class HerePassUI(App):
 
             if label:
                 output.herepass_labeled = False
+                # Pooled inputs are relabeled, see reset_text_input:
+                output.herepass_label = label
 
                 def adjust_text_input_label(widget, focussed):
                     if focussed:
@@ -337,10 +732,11 @@ class HerePassUI(App):
                             output.herepass_labeled = True
                             output.font_name = "Roboto-Italic.ttf"
                             output.foreground_color = label_font_color
-                            output.text = label
+                            output.text = output.herepass_label
 
                 adjust_text_input_label(output, False)
                 output.bind(focus=adjust_text_input_label)
+                output.herepass_adjust_label = adjust_text_input_label
 
             def adjust_text_input_height(first=None, second=None):
                 height = (
@@ -355,11 +751,23 @@ class HerePassUI(App):
                 adjust_text_input_height(first, second)
                 sync_height(output)
 
-            Clock.schedule_once(adjust_text_input_height, 0)
-            sync_height(output, 0)
+            Clock.schedule_once(adjust_text_input_height_and_sync, 0)
             output.bind(minimum_height=adjust_text_input_height_and_sync)
             return output
 
+        def reset_text_input(text_input, text, font_color):
+            # Rebinds a pooled input, forgetting what was typed in it:
+            text_input.focus = False
+            text_input.cancel_selection()
+            text_input.font_name = "Roboto-Regular.ttf"
+            text_input.foreground_color = font_color
+            text_input.text = text
+            text_input.cursor = (0, 0)
+            text_input.reset_undo()
+            if hasattr(text_input, "herepass_adjust_label"):
+                text_input.herepass_labeled = False
+                text_input.herepass_adjust_label(text_input, False)
+
         def flash_popup(text, confirm_label, cancel_label, confirm_action):
             space_width = 20
             font_size = dp(18)
@@ -413,18 +821,116 @@ class HerePassUI(App):
             popup.open(animation=False)
             sync_height(popup_frame)
 
-        def build_entry_view(group_entry, parent_widget):
+        def acquire_widget(kind, build):
+            """
+            Takes a widget of the given kind from its pool, building one only
+            if the pool is empty. Pages return theirs through release_widgets
+            once replaced, so that navigating mostly rebinds widgets.
+            """
+            pool = data.widget_pools.setdefault(kind, [])
+            widget = pool.pop() if pool else build()
+            widget.herepass_pool = kind
+            in_use = data.widget_pool_use.get(kind, 0) + 1
+            data.widget_pool_use[kind] = in_use
+            if in_use > data.widget_pool_peaks.get(kind, 0):
+                data.widget_pool_peaks[kind] = in_use
+            return widget
+
+        def release_widget(widget):
+            if widget.parent is not None:
+                widget.parent.remove_widget(widget)
+            # Forms come with a spacer, added after them:
+            spacer = getattr(widget, "herepass_spacer", None)
+            if spacer is not None and spacer.parent is not None:
+                spacer.parent.remove_widget(spacer)
+            # Pooled widgets keep nothing of what they showed, secrets above all:
+            clear = getattr(widget, "herepass_clear", None)
+            if clear is not None:
+                clear(widget)
+            data.widget_pool_use[widget.herepass_pool] -= 1
+            data.widget_pools[widget.herepass_pool].append(widget)
+
+        def release_widgets(widget):
+            # Returns every pooled widget under the given one:
+            pooled = []
+            widgets = [widget]
+            while widgets:
+                current_widget = widgets.pop()
+                if hasattr(current_widget, "herepass_pool"):
+                    pooled.append(current_widget)
+                    continue
+                if hasattr(current_widget, "herepass_rows"):
+                    current_widget.herepass_rows.clear()
+                    data.main_layout.unbind(
+                        scroll_y=current_widget.herepass_refresh_rows,
+                        height=current_widget.herepass_refresh_rows,
+                    )
+                widgets.extend(current_widget.children)
+            for current_widget in pooled:
+                release_widget(current_widget)
+
+        def trim_widget_pools():
+            # Only as many widgets are kept as the busier of the last two pages
+            # used, so going back and forth between them stays warm:
+            history = data.widget_pool_history
+            history.append(data.widget_pool_peaks)
+            del history[:-2]
+            data.widget_pool_peaks = data.widget_pool_use.copy()
+            for kind, pool in data.widget_pools.items():
+                limit = max(peaks.get(kind, 0) for peaks in history)
+                kept = max(0, limit - data.widget_pool_use.get(kind, 0))
+                del pool[kept:]
+
+        def collect_garbage(delta=None):
+            gc.collect()
+
+        def schedule_collection():
+            """
+            Collects once navigating pauses for data.collection_delay seconds,
+            rather than on every page swap. Kivy widgets hold cycles of their
+            own, so replaced pages, and what they showed, wait for it.
+            """
+            data.collection_trigger.cancel()
+            data.collection_trigger()
+
+        def time_collection(phase, info):
+            # Collection pauses, summed per navigation, see count_collections:
+            if phase == "start":
+                data.collection_started = time.perf_counter()
+            else:
+                pause = time.perf_counter() - data.collection_started
+                data.collection_pauses.append((info["generation"], pause))
+
+        def count_collections():
+            pauses = data.collection_pauses
+            data.collection_stats.append(
+                {
+                    "collections": len(pauses),
+                    "full_collections": sum(1 for i in pauses if i[0] == 2),
+                    "pause_ms": sum(i[1] for i in pauses) * 1000,
+                    "max_pause_ms": max((i[1] for i in pauses), default=0) * 1000,
+                }
+            )
+            del data.collection_stats[:-100]
+            data.collection_pauses = []
+
+        def drop_widget_pools(widget=None):
+            for pool in data.widget_pools.values():
+                pool.clear()
+
+        def build_entry_view():
             entry_view = BoxLayout(
                 orientation="horizontal",
+                size_hint_y=None,
+                height=dp(40),
                 size_hint_min_y=dp(40),
                 size_hint_max_y=dp(40),
             )
-            entry_view_spacer = generate_v_spacer(20)
 
             entry_label_scroller = ScrollView()
             entry_label_frame = AnchorLayout(anchor_x="right", anchor_y="top")
             entry_label = generate_sized_text_input(
-                group_entry.get("label"),
+                "",
                 dp(18),
                 data.font_color,
                 False,
@@ -444,12 +950,11 @@ class HerePassUI(App):
 
             entry_view.add_widget(generate_h_spacer(6))
 
-            secret_input = group_entry.get("secret")
             entry_content = generate_sized_text_input(
-                "******" if secret_input else group_entry.get("content"),
+                "",
                 dp(18),
                 data.font_color,
-                secret_input,
+                False,
                 False,
                 False,
                 True,
@@ -462,55 +967,194 @@ class HerePassUI(App):
             entry_copy_button.size_hint_max_x = dp(60)
 
             def copy_entry_content(widget):
-                Clipboard.copy(group_entry.get("content"))
+                Clipboard.copy(entry_view.herepass_entry.get("content"))
 
             entry_copy_button.bind(on_release=copy_entry_content)
             entry_view.add_widget(entry_copy_button)
 
             entry_view.add_widget(generate_h_spacer(6))
 
-            if secret_input:
-                entry_reveal_button = generate_button("Show", dp(40), dp(18))
-                entry_reveal_button.size_hint_min_x = dp(60)
-                entry_reveal_button.size_hint_max_x = dp(60)
-                entry_reveal_button.herepass_revealed = False
-
-                def reveal_entry_secret(widget):
-                    if widget.herepass_revealed:
-                        widget.herepass_revealed = False
-                        widget.text = "Show"
-                        entry_content.text = "******"
-                        entry_content.cursor = (0, 0)
-                        entry_content.password = True
-                        entry_content.disabled = True
-                    else:
-                        widget.herepass_revealed = True
-                        widget.text = "Hide"
-                        entry_content.disabled = False
-                        entry_content.password = False
-                        entry_content.text = group_entry.get("content")
-                        entry_content.cursor = (0, 0)
-
-                entry_reveal_button.bind(on_release=reveal_entry_secret)
-                entry_view.add_widget(entry_reveal_button)
-            else:
-                entry_view.add_widget(generate_h_spacer(60))
-
-            parent_widget.add_widget(entry_view)
-            parent_widget.add_widget(entry_view_spacer)
-            # Don't forget to sync height later!
-            return {"label_scroller": entry_label_scroller, "label": entry_label}
-
-        def build_entry_form(group_entry, secret, parent_widget, rendered):
+            # Hidden for entries that aren't secret:
+            entry_reveal_button = generate_button("Show", dp(40), dp(18))
+            entry_reveal_button.size_hint_min_x = dp(60)
+            entry_reveal_button.size_hint_max_x = dp(60)
+
+            def reveal_entry_secret(widget):
+                if widget.herepass_revealed:
+                    widget.herepass_revealed = False
+                    widget.text = "Show"
+                    entry_content.text = "******"
+                    entry_content.cursor = (0, 0)
+                    entry_content.password = True
+                    entry_content.disabled = True
+                else:
+                    widget.herepass_revealed = True
+                    widget.text = "Hide"
+                    entry_content.disabled = False
+                    entry_content.password = False
+                    entry_content.text = entry_view.herepass_entry.get("content")
+                    entry_content.cursor = (0, 0)
+
+            entry_reveal_button.bind(on_release=reveal_entry_secret)
+            entry_view.add_widget(entry_reveal_button)
+
+            entry_view.herepass_label_scroller = entry_label_scroller
+            entry_view.herepass_label = entry_label
+            entry_view.herepass_content = entry_content
+            entry_view.herepass_reveal_button = entry_reveal_button
+            entry_view.herepass_clear = clear_entry_view
+            return entry_view
+
+        def clear_entry_view(entry_view):
+            # Hides a revealed secret, along with its undo history:
+            entry_view.herepass_entry = None
+            reset_text_input(entry_view.herepass_label, "", data.font_color)
+            reset_text_input(entry_view.herepass_content, "", data.font_color)
+            entry_view.herepass_reveal_button.herepass_revealed = False
+            entry_view.herepass_reveal_button.text = "Show"
+
+        def bind_entry_view(entry_view, group_entry, label_width):
+            entry_view.herepass_entry = group_entry
+            entry_view.herepass_label_scroller.size_hint_max_x = label_width
+            entry_view.herepass_label_scroller.scroll_x = 0
+            entry_view.herepass_label.text = group_entry.get("label")
+            secret_input = group_entry.get("secret")
+            entry_content = entry_view.herepass_content
+            entry_content.disabled = False
+            entry_content.password = secret_input
+            reset_text_input(
+                entry_content,
+                "******" if secret_input else group_entry.get("content"),
+                data.font_color,
+            )
+            entry_content.disabled = secret_input
+            entry_reveal_button = entry_view.herepass_reveal_button
+            entry_reveal_button.herepass_revealed = False
+            entry_reveal_button.text = "Show"
+            entry_reveal_button.disabled = not secret_input
+            entry_reveal_button.opacity = 1 if secret_input else 0
+
+        def acquire_entry_view(group_entry, label_width):
+            entry_view = acquire_widget("entry_view", build_entry_view)
+            bind_entry_view(entry_view, group_entry, label_width)
+            return entry_view
+
+        def measure_label_column(group_entries):
+            # Measured without widgets, since most entries' are never built:
+            measure = CoreLabel(font_name="Roboto-Regular.ttf", font_size=dp(18))
+            max_width = 0
+            for group_entry in group_entries:
+                current_width = measure.get_extents(group_entry.get("label"))[0]
+                if current_width > max_width:
+                    max_width = current_width
+            return max_width + dp(4)
+
+        def build_virtual_list(heights, acquire_row):
+            """
+            Lists rows, each at the bottom of its given height, but only
+            acquires those around the main layout's view, acquiring and
+            releasing rows as it scrolls. A page then takes as long to build
+            whatever number of rows it has.
+            """
+            offsets = [0]
+            for height in heights:
+                offsets.append(offsets[-1] + height)
+            virtual_list = RelativeLayout(
+                size_hint_min_y=offsets[-1], size_hint_max_y=offsets[-1]
+            )
+            virtual_list.target_height_disabled = True
+            virtual_list.herepass_rows = {}
+            # Held weakly by its callbacks, which the main layout may still
+            # hold once the list is released:
+            list_proxy = virtual_list.proxy_ref
+
+            def refresh_rows(widget=None, value=None):
+                rows = list_proxy.herepass_rows
+                view = data.main_layout
+                frame = data.main_frame
+                page = list_proxy
+                while page.parent is not None and page.parent is not frame:
+                    page = page.parent
+                if page.parent is None:
+                    # Its page was replaced or its results cleared:
+                    view.unbind(scroll_y=refresh_rows, height=refresh_rows)
+                    return
+                # Scrolling moves the frame's drawing, not its widgets:
+                if frame.height > view.height:
+                    bottom = view.scroll_y * (frame.height - view.height)
+                else:
+                    bottom = frame.height - view.height
+                # Half a view above and below is built ahead of scrolling:
+                margin = view.height / 2
+                start = list_proxy.top - bottom - view.height - margin
+                end = list_proxy.top - bottom + margin
+                first = max(0, bisect_right(offsets, start) - 1)
+                last = min(len(heights), bisect_left(offsets, end))
+                for i in [i for i in rows if not first <= i < last]:
+                    release_widget(rows.pop(i))
+                for i in range(first, last):
+                    if i not in rows:
+                        row = acquire_row(i)
+                        row.y = offsets[-1] - offsets[i + 1]
+                        rows[i] = row
+                        list_proxy.add_widget(row)
+
+            virtual_list.bind(pos=refresh_rows, size=refresh_rows)
+            data.main_layout.bind(scroll_y=refresh_rows, height=refresh_rows)
+            virtual_list.herepass_refresh_rows = refresh_rows
+            return virtual_list
+
+        def build_in_slices(page, count, build_item, progress, finished):
+            """
+            Calls build_item for each of "count" items, as many per frame as
+            fit in data.frame_budget, then reports progress. Stops for good
+            once the page is no longer shown, its widgets already released.
+            """
+            built = 0
+
+            def build_slice(delta):
+                nonlocal built
+                if page.parent is not data.main_frame:
+                    return False
+                started = time.perf_counter()
+                while built < count:
+                    build_item(built)
+                    built += 1
+                    if time.perf_counter() - started >= data.frame_budget:
+                        break
+                progress(built, count)
+                if built == count:
+                    finished()
+                    return False
+
+            Clock.schedule_interval(build_slice, 0)
+
+        def delete_form(widget):
+            form = widget.parent
+            parent_widget = form.parent
+            parent_widget.remove_widget(form)
+            parent_widget.remove_widget(form.herepass_spacer)
+            sync_height(parent_widget)
+            form.herepass_deleted = True
+
+        def generate_form_chunk(forms):
+            # Its forms keep their place relative to it as it moves:
+            chunk = RelativeLayout()
+            chunk_forms = BoxLayout(orientation="vertical")
+            chunk_forms.target_height_as_max = True
+            chunk.add_widget(chunk_forms)
+            forms.add_widget(chunk)
+            return chunk_forms
+
+        def build_entry_form():
             entry_form = BoxLayout(
                 orientation="horizontal",
                 size_hint_min_y=dp(40),
                 size_hint_max_y=dp(40),
             )
-            entry_form.herepass_deleted = False
-            entry_form_spacer = generate_v_spacer(20)
+            entry_form.herepass_spacer = generate_v_spacer(20)
             entry_label = generate_sized_text_input(
-                group_entry.get("label") if group_entry else "",
+                "",
                 dp(18),
                 data.font_color,
                 False,
@@ -522,46 +1166,58 @@ class HerePassUI(App):
             )
             entry_form.add_widget(entry_label)
             entry_form.add_widget(generate_h_spacer(6))
-
-            secret_input = group_entry.get("secret") if group_entry else secret
-            if group_entry:
-                initial_value = group_entry.get("content")
-            else:
-                if secret_input:
-                    initial_value = "".join(
-                        secrets.choice(data.alphanumeric) for i in range(16)
-                    )
-                else:
-                    initial_value = ""
-
             entry_content = generate_sized_text_input(
-                initial_value,
+                "",
                 dp(18),
                 data.font_color,
-                secret_input,
+                False,
                 False,
                 True,
                 True,
-                "******" if secret_input else "Detail",
+                "Detail",
                 data.font_color_gray,
             )
-
             entry_form.add_widget(entry_content)
             entry_form.add_widget(generate_h_spacer(6))
             entry_delete_button = generate_button("Delete", dp(40), dp(18))
             entry_delete_button.size_hint_min_x = dp(90)
             entry_delete_button.size_hint_max_x = dp(90)
+            entry_delete_button.bind(on_release=delete_form)
+            entry_form.add_widget(entry_delete_button)
+            entry_form.herepass_label = entry_label
+            entry_form.herepass_content = entry_content
+            entry_form.herepass_clear = clear_entry_form
+            return entry_form
 
-            def delete_entry_form(widget):
-                parent_widget.remove_widget(entry_form)
-                parent_widget.remove_widget(entry_form_spacer)
-                sync_height(parent_widget)
-                entry_form.herepass_deleted = True
+        def clear_entry_form(entry_form):
+            reset_text_input(entry_form.herepass_label, "", data.font_color)
+            reset_text_input(entry_form.herepass_content, "", data.font_color)
 
-            entry_delete_button.bind(on_release=delete_entry_form)
-            entry_form.add_widget(entry_delete_button)
+        def acquire_entry_form(group_entry, secret, parent_widget, rendered):
+            entry_form = acquire_widget("entry_form", build_entry_form)
+            entry_form.herepass_deleted = False
+            entry_label = entry_form.herepass_label
+            reset_text_input(
+                entry_label,
+                group_entry.get("label") if group_entry else "",
+                data.font_color,
+            )
+            secret_input = group_entry.get("secret") if group_entry else secret
+            if group_entry:
+                initial_value = group_entry.get("content")
+            else:
+                if secret_input:
+                    initial_value = "".join(
+                        secrets.choice(data.alphanumeric) for i in range(16)
+                    )
+                else:
+                    initial_value = ""
+            entry_content = entry_form.herepass_content
+            entry_content.password = secret_input
+            entry_content.herepass_label = "******" if secret_input else "Detail"
+            reset_text_input(entry_content, initial_value, data.font_color)
             parent_widget.add_widget(entry_form)
-            parent_widget.add_widget(entry_form_spacer)
+            parent_widget.add_widget(entry_form.herepass_spacer)
             if rendered:
                 sync_height(parent_widget)
             return (
@@ -573,24 +1229,34 @@ class HerePassUI(App):
                 },
             )
 
-        def build_subgroup_view(subgroup, subgroup_parent_groups, parent_widget):
+        def build_subgroup_view():
             def view_subgroup(widget):
-                rebuild_group_page(subgroup, subgroup_parent_groups, False)
+                rebuild_group_page(
+                    widget.herepass_subgroup, widget.herepass_parent_groups, False
+                )
 
-            subgroup_button = generate_button(subgroup.get("label"), dp(40), dp(18))
+            subgroup_button = generate_button("", dp(40), dp(18))
+            subgroup_button.size_hint_y = None
+            subgroup_button.height = dp(40)
             subgroup_button.bind(on_release=view_subgroup)
-            parent_widget.add_widget(subgroup_button)
+            return subgroup_button
+
+        def acquire_subgroup_view(subgroup, subgroup_parent_groups):
+            subgroup_button = acquire_widget("subgroup_view", build_subgroup_view)
+            subgroup_button.text = subgroup.get("label")
+            subgroup_button.herepass_subgroup = subgroup
+            subgroup_button.herepass_parent_groups = subgroup_parent_groups
+            return subgroup_button
 
-        def build_subgroup_form(subgroup, parent_widget, rendered):
+        def build_subgroup_form():
             subgroup_form = BoxLayout(
                 orientation="horizontal",
                 size_hint_min_y=dp(40),
                 size_hint_max_y=dp(40),
             )
-            subgroup_form.herepass_deleted = False
-            subgroup_form_spacer = generate_v_spacer(20)
+            subgroup_form.herepass_spacer = generate_v_spacer(20)
             subgroup_label = generate_sized_text_input(
-                subgroup.get("label") if subgroup else "",
+                "",
                 dp(18),
                 data.font_color,
                 False,
@@ -605,17 +1271,22 @@ class HerePassUI(App):
             subgroup_delete_button = generate_button("Delete", dp(40), dp(18))
             subgroup_delete_button.size_hint_min_x = dp(90)
             subgroup_delete_button.size_hint_max_x = dp(90)
-
-            def delete_subgroup_form(widget):
-                parent_widget.remove_widget(subgroup_form)
-                parent_widget.remove_widget(subgroup_form_spacer)
-                sync_height(parent_widget)
-                subgroup_form.herepass_deleted = True
-
-            subgroup_delete_button.bind(on_release=delete_subgroup_form)
+            subgroup_delete_button.bind(on_release=delete_form)
             subgroup_form.add_widget(subgroup_delete_button)
+            subgroup_form.herepass_label = subgroup_label
+            return subgroup_form
+
+        def acquire_subgroup_form(subgroup, parent_widget, rendered):
+            subgroup_form = acquire_widget("subgroup_form", build_subgroup_form)
+            subgroup_form.herepass_deleted = False
+            subgroup_label = subgroup_form.herepass_label
+            reset_text_input(
+                subgroup_label,
+                subgroup.get("label") if subgroup else "",
+                data.font_color,
+            )
             parent_widget.add_widget(subgroup_form)
-            parent_widget.add_widget(subgroup_form_spacer)
+            parent_widget.add_widget(subgroup_form.herepass_spacer)
             if rendered:
                 sync_height(parent_widget)
             return (
@@ -626,31 +1297,10 @@ class HerePassUI(App):
                 },
             )
 
-        def build_breadcrumbs(parent_groups):
+        def build_breadcrumbs_bar():
             height = 22
             sep_height = 2
-            if not len(parent_groups):
-                placeholder = generate_v_spacer(height + (2 * sep_height))
-                set_background_color(placeholder, data.bar_bg_color)
-                return placeholder
-
-            breadcrumb_list = []
-            i = 0
-            text = ""
-            current_groups = []
-            for parent_group in parent_groups:
-                label = escape_markup(parent_group.get("label"))
-                label = "[ref=" + str(i) + "][u]" + label + "[/u][/ref]"
-                text += label + "  /  "
-                breadcrumb = ClosureData()
-                breadcrumb.target_group = parent_group
-                breadcrumb.parent_groups = current_groups.copy()
-                breadcrumb_list.append(breadcrumb)
-                i += 1
-                current_groups.append(parent_group)
-            text = text[0:-5]
             breadcrumbs = Label(
-                text=text,
                 halign="left",
                 size_hint_min_y=dp(height),
                 size_hint_max_y=dp(height),
@@ -663,7 +1313,7 @@ class HerePassUI(App):
             breadcrumbs.bind(size=breadcrumbs.setter("text_size"))
 
             def trigger_rebuild(widget, ref):
-                breadcrumb = breadcrumb_list[int(ref)]
+                breadcrumb = widget.herepass_breadcrumbs[int(ref)]
                 rebuild_group_page(
                     breadcrumb.target_group, breadcrumb.parent_groups, False
                 )
@@ -685,8 +1335,60 @@ class HerePassUI(App):
             set_background_color(separator, data.bar_bg_color)
             breadcrumbs_wrapper.add_widget(separator)
 
+            breadcrumbs_wrapper.herepass_breadcrumbs = breadcrumbs
+            return breadcrumbs_wrapper
+
+        def bind_breadcrumbs(breadcrumbs_wrapper, parent_groups):
+            breadcrumb_list = []
+            i = 0
+            text = ""
+            current_groups = []
+            for parent_group in parent_groups:
+                label = escape_markup(parent_group.get("label"))
+                label = "[ref=" + str(i) + "][u]" + label + "[/u][/ref]"
+                text += label + "  /  "
+                breadcrumb = ClosureData()
+                breadcrumb.target_group = parent_group
+                breadcrumb.parent_groups = current_groups.copy()
+                breadcrumb_list.append(breadcrumb)
+                i += 1
+                current_groups.append(parent_group)
+            text = text[0:-5]
+            breadcrumbs = breadcrumbs_wrapper.herepass_breadcrumbs
+            breadcrumbs.text = text
+            breadcrumbs.herepass_breadcrumbs = breadcrumb_list
+
+        def build_breadcrumbs(parent_groups):
+            height = 22
+            sep_height = 2
+            if not len(parent_groups):
+                placeholder = generate_v_spacer(height + (2 * sep_height))
+                set_background_color(placeholder, data.bar_bg_color)
+                return placeholder
+            breadcrumbs_wrapper = build_breadcrumbs_bar()
+            bind_breadcrumbs(breadcrumbs_wrapper, parent_groups)
             return breadcrumbs_wrapper
 
+        def build_result_entry_view():
+            # An entry under the path to its group:
+            result_view = BoxLayout(
+                orientation="vertical",
+                size_hint_y=None,
+                height=dp(26 + 10 + 40),
+            )
+            result_view.herepass_breadcrumbs = build_breadcrumbs_bar()
+            result_view.add_widget(result_view.herepass_breadcrumbs)
+            result_view.add_widget(generate_v_spacer(10))
+            result_view.herepass_entry_view = build_entry_view()
+            result_view.add_widget(result_view.herepass_entry_view)
+            return result_view
+
+        def acquire_result_entry_view(group_entry, parent_groups, label_width):
+            result_view = acquire_widget("result_entry_view", build_result_entry_view)
+            bind_breadcrumbs(result_view.herepass_breadcrumbs, parent_groups)
+            bind_entry_view(result_view.herepass_entry_view, group_entry, label_width)
+            return result_view
+
         def build_group_search_page(target_group):
             # The actual page:
             group_page = BoxLayout(
@@ -698,6 +1400,7 @@ class HerePassUI(App):
             )
             group_page.target_height = None
             group_page.target_height_as_max = True
+            track_layout_passes(group_page)
 
             search_bar = BoxLayout(
                 orientation="horizontal",
@@ -729,58 +1432,147 @@ class HerePassUI(App):
                 height=0,
             )
 
-            def trigger_search(widget):
-                search_phrase = search_input.text.strip()
-                search_input.text = search_phrase
+            search_results.herepass_job = None
+
+            def show_search_message(text, color):
+                message = Label(
+                    text=text,
+                    halign="left",
+                    size_hint_min_y=dp(22),
+                    size_hint_max_y=dp(22),
+                    color=color,
+                    font_size=dp(18),
+                    shorten=True,
+                )
+                message.bind(size=message.setter("text_size"))
+                search_results.add_widget(generate_v_spacer(20))
+                search_results.add_widget(message)
+
+            def clear_search_results():
+                release_widgets(search_results)
                 search_results.clear_widgets()
+
+            def show_search_results(matched):
+                clear_search_results()
                 search_results.size_hint_y = 1
-                if search_input.herepass_labeled or not search_phrase:
-                    message = Label(
-                        text="You must enter a search phrase.",
-                        halign="left",
-                        size_hint_min_y=dp(22),
-                        size_hint_max_y=dp(22),
-                        color=data.error_font_color,
-                        font_size=dp(18),
-                        shorten=True,
-                    )
-                    message.bind(size=message.setter("text_size"))
-                    search_results.add_widget(generate_v_spacer(20))
-                    search_results.add_widget(message)
-                    sync_height(search_results, -1)
-                    return
-                matched = target_group.search(search_phrase)
-                found = False
-                for lineage in matched:
-                    if not lineage[-1].get("deleted"):
-                        found = True
-                        break
-                if found:
+                if len(matched):
                     search_results.add_widget(generate_v_spacer(20))
                     search_results.add_widget(generate_separator(2))
+                    heights = []
                     for lineage in matched:
-                        subgroup = lineage.pop()
-                        if subgroup.get("deleted"):
-                            continue
-                        search_results.add_widget(generate_v_spacer(20))
-                        build_subgroup_view(subgroup, lineage, search_results)
+                        if isinstance(lineage[-1], Group):
+                            heights.append(dp(20 + 40))
+                        else:
+                            heights.append(dp(20 + 26 + 10 + 40))
+                    label_width = measure_label_column(
+                        lineage[-1] for lineage in matched
+                    )
+
+                    def acquire_result_row(i):
+                        lineage = matched[i].copy()
+                        node = lineage.pop()
+                        if isinstance(node, Group):
+                            return acquire_subgroup_view(node, lineage)
+                        return acquire_result_entry_view(node, lineage, label_width)
+
+                    search_results.add_widget(
+                        build_virtual_list(heights, acquire_result_row)
+                    )
                     search_results.add_widget(generate_v_spacer(20))
                     search_results.add_widget(generate_separator(2))
                 else:
-                    message = Label(
-                        text="Nothing found.",
-                        halign="left",
-                        size_hint_min_y=dp(22),
-                        size_hint_max_y=dp(22),
-                        color=data.font_color,
-                        font_size=dp(18),
-                        shorten=True,
-                    )
-                    message.bind(size=message.setter("text_size"))
-                    search_results.add_widget(generate_v_spacer(20))
-                    search_results.add_widget(message)
+                    show_search_message("Nothing found.", data.font_color)
                 sync_height(search_results, -1)
 
+            def cancel_searches():
+                search_trigger.cancel()
+                if search_results.herepass_job is not None:
+                    search_results.herepass_job.cancel()
+                    search_results.herepass_job = None
+
+            def start_search(search_phrase, typing):
+                # Each search outdates the ones before it, which stop early:
+                cancel_searches()
+
+                def run_search(job):
+                    if data.herepass.index is None:
+                        # The first search opens the index saved, or builds
+                        # one, letting go of the lock between chunks so that
+                        # pages never wait on it for long:
+                        job.progress(0, 1)
+                        while True:
+                            with data.herepass_lock:
+                                job.check()
+                                if not data.herepass.index_step():
+                                    break
+                    with data.herepass_lock:
+                        job.check()
+                        return data.herepass.search(
+                            search_phrase,
+                            data.search_limit,
+                            deleted=False,
+                            cancelled=job.cancel_event.is_set,
+                            typing=typing,
+                        )
+
+                def show_indexing(job, done, total):
+                    clear_search_results()
+                    search_results.size_hint_y = 1
+                    show_search_message("Indexing the vault...", data.font_color)
+                    sync_height(search_results, -1)
+
+                def end_search(job):
+                    if job.cancelled:
+                        return
+                    if job.error is None:
+                        show_search_results(job.result)
+                        return
+                    clear_search_results()
+                    search_results.size_hint_y = 1
+                    show_search_message(str(job.error), data.error_font_color)
+                    sync_height(search_results, -1)
+
+                search_results.herepass_job = data.jobs.submit(
+                    "search", run_search, end_search, show_indexing
+                )
+
+            def trigger_search(widget):
+                search_phrase = search_input.text.strip()
+                if search_input.text != search_phrase:
+                    search_input.text = search_phrase
+                if search_input.herepass_labeled or not search_phrase:
+                    cancel_searches()
+                    clear_search_results()
+                    search_results.size_hint_y = 1
+                    show_search_message(
+                        "You must enter a search phrase.", data.error_font_color
+                    )
+                    sync_height(search_results, -1)
+                    return
+                start_search(search_phrase, False)
+
+            def trigger_live_search(delta):
+                if search_input.herepass_labeled:
+                    return
+                search_phrase = search_input.text.strip()
+                # Searching as it's typed, its last word may be incomplete:
+                if search_phrase:
+                    start_search(search_phrase, True)
+                else:
+                    cancel_searches()
+                    clear_search_results()
+                    sync_height(search_results, -1)
+
+            search_trigger = Clock.create_trigger(
+                trigger_live_search, data.search_debounce
+            )
+
+            def schedule_live_search(widget, text):
+                # Every keystroke restarts the wait:
+                search_trigger.cancel()
+                search_trigger()
+
+            search_input.bind(text=schedule_live_search)
             search_button.bind(on_release=trigger_search)
             set_text_input_enter(search_input, trigger_search)
 
@@ -791,6 +1583,7 @@ class HerePassUI(App):
             cancel_button.size_hint_max_x = dp(80)
 
             def load_group(widget):
+                cancel_searches()
                 rebuild_group_page(target_group, [], False)
 
             cancel_button.bind(on_release=load_group)
@@ -806,8 +1599,11 @@ class HerePassUI(App):
                 sync_height doesn't cause flickering.
                 """
                 data.main_frame.remove_widget(data.current_page)
+                release_widgets(data.current_page)
+                trim_widget_pools()
                 data.current_page = group_page
-                gc.collect()
+                count_collections()
+                schedule_collection()
 
             show_main_layout(None)
             data.main_frame.add_widget(group_page)
@@ -815,25 +1611,27 @@ class HerePassUI(App):
             sync_height(group_page, 0)
 
         def rebuild_group_page(target_group, parent_groups, editable):
-            # The root group cannot be deleted:
-            if (
-                data.edit_allowed
-                and not len(parent_groups)
-                and target_group.get("deleted")
-            ):
-                target_group.set("deleted", False)
-                flush_encrypted()
-
-            # Separate groups and entries:
-            subgroups = []
-            entries = []
-            for subitem in target_group.get("entries"):
-                if subitem.get("deleted"):
-                    continue
-                if isinstance(subitem, Group):
-                    subgroups.append(subitem)
-                else:
-                    entries.append(subitem)
+            with data.herepass_lock:
+                # The root group cannot be deleted:
+                if (
+                    data.edit_allowed
+                    and not len(parent_groups)
+                    and target_group.get("deleted")
+                ):
+                    # False would be read as a timestamp, still deleted:
+                    target_group.set("deleted", None)
+                    flush_encrypted()
+
+                # Separate groups and entries:
+                subgroups = []
+                entries = []
+                for subitem in target_group.get("entries"):
+                    if subitem.get("deleted"):
+                        continue
+                    if isinstance(subitem, Group):
+                        subgroups.append(subitem)
+                    else:
+                        entries.append(subitem)
 
             # Pair elements:
             pairs = {
@@ -853,6 +1651,7 @@ class HerePassUI(App):
             )
             group_page.target_height = None
             group_page.target_height_as_max = True
+            track_layout_passes(group_page)
 
             if editable:
                 group_label = generate_sized_text_input(
@@ -969,11 +1768,16 @@ class HerePassUI(App):
                 entry_forms.target_height_as_max = True
                 group_page.add_widget(entry_forms)
 
-                for entry in entries:
-                    if not entry.get("deleted"):
-                        pairs["entries"].append(
-                            build_entry_form(entry, None, entry_forms, False)
-                        )
+                # Shown below the forms while they're added:
+                if entries or subgroups:
+                    form_progress = Label(
+                        size_hint_min_y=dp(40),
+                        size_hint_max_y=dp(40),
+                        color=data.font_color_gray,
+                        font_size=dp(18),
+                        italic=True,
+                    )
+                    group_page.add_widget(form_progress)
 
                 entry_add_buttons = BoxLayout(
                     orientation="horizontal",
@@ -983,7 +1787,7 @@ class HerePassUI(App):
 
                 def add_detail_form(widget):
                     pairs["entries"].append(
-                        build_entry_form(None, False, entry_forms, True)
+                        acquire_entry_form(None, False, entry_forms, True)
                     )
 
                 entry_detail_button = generate_button("Add Detail", dp(40), dp(18))
@@ -994,7 +1798,7 @@ class HerePassUI(App):
 
                 def add_secret_form(widget):
                     pairs["entries"].append(
-                        build_entry_form(None, True, entry_forms, True)
+                        acquire_entry_form(None, True, entry_forms, True)
                     )
 
                 entry_secret_button = generate_button("Add Secret", dp(40), dp(18))
@@ -1013,20 +1817,69 @@ class HerePassUI(App):
                 subgroup_forms.target_height_as_max = True
                 group_page.add_widget(subgroup_forms)
 
-                for subgroup in subgroups:
-                    if not subgroup.get("deleted"):
-                        pairs["subgroups"].append(
-                            build_subgroup_form(subgroup, subgroup_forms, False)
-                        )
-
                 def add_subgroup_form(widget):
                     pairs["subgroups"].append(
-                        build_subgroup_form(None, subgroup_forms, True)
+                        acquire_subgroup_form(None, subgroup_forms, True)
                     )
 
                 group_add_button = generate_button("Add Subgroup", dp(40), dp(18))
                 group_add_button.bind(on_release=add_subgroup_form)
                 group_page.add_widget(group_add_button)
+
+                # Existing entries' and subgroups' forms are built and added a
+                # slice per frame, new ones only once they're all there. Each
+                # form joins the page as soon as it's acquired, so leaving the
+                # page midway releases it along with the rest:
+                form_count = len(entries) + len(subgroups)
+                form_buttons = [
+                    entry_detail_button,
+                    entry_secret_button,
+                    group_add_button,
+                ]
+
+                # Each slice's forms share a chunk, so later slices move the
+                # chunk rather than laying out every form above them again:
+                slice_chunks = {}
+
+                def build_form(i):
+                    if i < len(entries):
+                        if "entries" not in slice_chunks:
+                            slice_chunks["entries"] = generate_form_chunk(entry_forms)
+                        pairs["entries"].append(
+                            acquire_entry_form(
+                                entries[i], None, slice_chunks["entries"], False
+                            )
+                        )
+                    else:
+                        if "subgroups" not in slice_chunks:
+                            slice_chunks["subgroups"] = generate_form_chunk(
+                                subgroup_forms
+                            )
+                        pairs["subgroups"].append(
+                            acquire_subgroup_form(
+                                subgroups[i - len(entries)],
+                                slice_chunks["subgroups"],
+                                False,
+                            )
+                        )
+
+                def show_form_progress(built, count):
+                    form_progress.text = "Loading {} of {}...".format(built, count)
+                    # One layout pass per slice, not per form:
+                    for chunk in slice_chunks.values():
+                        sync_height(chunk)
+                    slice_chunks.clear()
+
+                def show_forms():
+                    group_page.remove_widget(form_progress)
+                    sync_height(group_page)
+                    for button in form_buttons:
+                        button.disabled = False
+
+                if form_count:
+                    show_form_progress(0, form_count)
+                    for button in form_buttons:
+                        button.disabled = True
             else:
                 if not (len(subgroups) or len(entries)):
                     group_page.add_widget(generate_v_spacer(20))
@@ -1049,27 +1902,17 @@ class HerePassUI(App):
                 else:
                     if len(entries):
                         group_page.add_widget(generate_v_spacer(24))
-                        entry_views = []
-                        for entry in entries:
-                            if not entry.get("deleted"):
-                                entry_views.append(build_entry_view(entry, group_page))
-
-                        # Remove the last spacer:
-                        group_page.remove_widget(group_page.children[0])
-
-                        def justify_label_column(delta):
-                            max_width = 0
-                            for entry_view in entry_views:
-                                current_width = (
-                                    entry_view["label"]._lines_labels[0].width
-                                )
-                                current_width += dp(4)
-                                if current_width > max_width:
-                                    max_width = current_width
-                            for entry_view in entry_views:
-                                entry_view["label_scroller"].size_hint_max_x = max_width
+                        label_width = measure_label_column(entries)
+
+                        def acquire_entry_row(i):
+                            return acquire_entry_view(entries[i], label_width)
 
-                        Clock.schedule_once(justify_label_column, 0)
+                        # Rows are spaced apart:
+                        heights = [dp(20 + 40)] * len(entries)
+                        heights[0] = dp(40)
+                        group_page.add_widget(
+                            build_virtual_list(heights, acquire_entry_row)
+                        )
                     if len(subgroups):
                         if len(entries):
                             group_page.add_widget(generate_separator(42))
@@ -1078,14 +1921,17 @@ class HerePassUI(App):
                             group_page.add_widget(generate_v_spacer(6))
                         subgroup_parent_groups = parent_groups.copy()
                         subgroup_parent_groups.append(target_group)
-                        for subgroup in subgroups:
-                            if not subgroup.get("deleted"):
-                                build_subgroup_view(
-                                    subgroup, subgroup_parent_groups, group_page
-                                )
-                                group_page.add_widget(generate_v_spacer(20))
-                        # Remove the last spacer:
-                        group_page.remove_widget(group_page.children[0])
+
+                        def acquire_subgroup_row(i):
+                            return acquire_subgroup_view(
+                                subgroups[i], subgroup_parent_groups
+                            )
+
+                        heights = [dp(20 + 40)] * len(subgroups)
+                        heights[0] = dp(40)
+                        group_page.add_widget(
+                            build_virtual_list(heights, acquire_subgroup_row)
+                        )
 
             if editable:
                 group_page.add_widget(generate_separator(42))
@@ -1209,50 +2055,66 @@ class HerePassUI(App):
                         popup_msg += "[i]No changes were made.[/i]\n\n"
 
                     def save_and_load_group():
-                        # Save label:
-                        if pairs["label"][0].get("label") != label:
-                            pairs["label"][0].set("label", label)
-                        # Save description:
-                        if pairs["description"][0].get("description") != description:
-                            pairs["description"][0].set("description", description)
-                        # Save entries:
-                        for pair in pairs["entries"]:
-                            if pair[0]:
-                                if pair[1]["form"].herepass_deleted:
-                                    pair[0].set("deleted", True)
+                        # Whatever this save deletes is deleted as of now:
+                        deleted_at = datetime.now(timezone.utc)
+                        with data.herepass_lock:
+                            # Save label:
+                            if pairs["label"][0].get("label") != label:
+                                pairs["label"][0].set("label", label)
+                            # Save description:
+                            if (
+                                pairs["description"][0].get("description")
+                                != description
+                            ):
+                                pairs["description"][0].set("description", description)
+                            # Save entries:
+                            for pair in pairs["entries"]:
+                                if pair[0]:
+                                    if pair[1]["form"].herepass_deleted:
+                                        pair[0].set("deleted", deleted_at)
+                                    else:
+                                        if (
+                                            pair[0].get("label")
+                                            != pair[1]["label"].text
+                                        ):
+                                            pair[0].set("label", pair[1]["label"].text)
+                                        if (
+                                            pair[0].get("content")
+                                            != pair[1]["content"].text
+                                        ):
+                                            pair[0].set(
+                                                "content", pair[1]["content"].text
+                                            )
+                                        if (
+                                            pair[0].get("secret")
+                                            != pair[1]["content"].password
+                                        ):
+                                            pair[0].set(
+                                                "secret", pair[1]["content"].password
+                                            )
                                 else:
-                                    if pair[0].get("label") != pair[1]["label"].text:
-                                        pair[0].set("label", pair[1]["label"].text)
-                                    if (
-                                        pair[0].get("content")
-                                        != pair[1]["content"].text
-                                    ):
-                                        pair[0].set("content", pair[1]["content"].text)
-                                    if (
-                                        pair[0].get("secret")
-                                        != pair[1]["content"].password
-                                    ):
-                                        pair[0].set(
-                                            "secret", pair[1]["content"].password
+                                    if not pair[1]["form"].herepass_deleted:
+                                        target_group.add_entry(
+                                            pair[1]["label"].text,
+                                            pair[1]["content"].text,
+                                            pair[1]["content"].password,
                                         )
-                            else:
-                                if not pair[1]["form"].herepass_deleted:
-                                    target_group.add_entry(
-                                        pair[1]["label"].text,
-                                        pair[1]["content"].text,
-                                        pair[1]["content"].password,
-                                    )
-                        # Save subgroups:
-                        for pair in pairs["subgroups"]:
-                            if pair[0]:
-                                if pair[1]["form"].herepass_deleted:
-                                    pair[0].set("deleted", True)
+                            # Save subgroups:
+                            for pair in pairs["subgroups"]:
+                                if pair[0]:
+                                    if pair[1]["form"].herepass_deleted:
+                                        pair[0].set("deleted", deleted_at)
+                                    else:
+                                        if (
+                                            pair[0].get("label")
+                                            != pair[1]["label"].text
+                                        ):
+                                            pair[0].set("label", pair[1]["label"].text)
                                 else:
-                                    if pair[0].get("label") != pair[1]["label"].text:
-                                        pair[0].set("label", pair[1]["label"].text)
-                            else:
-                                if not pair[1]["form"].herepass_deleted:
-                                    target_group.add_group(pair[1]["label"].text, None)
+                                    if not pair[1]["form"].herepass_deleted:
+                                        target_group.add_group(
+                                            pair[1]["label"].text, None
+                                        )
                         #
                         flush_encrypted()
                         rebuild_group_page(target_group, parent_groups, False)
@@ -1262,6 +2124,9 @@ class HerePassUI(App):
 
                 save_button = generate_button("Save", dp(40), dp(18))
                 group_page.add_widget(save_button)
+                form_buttons.append(save_button)
+                if form_count:
+                    save_button.disabled = True
                 save_button.bind(on_release=validate_input)
                 group_page.add_widget(generate_v_spacer(20))
 
@@ -1285,13 +2150,20 @@ class HerePassUI(App):
                 sync_height doesn't cause flickering.
                 """
                 data.main_frame.remove_widget(data.current_page)
+                release_widgets(data.current_page)
+                trim_widget_pools()
                 data.current_page = group_page
-                gc.collect()
+                count_collections()
+                schedule_collection()
 
             show_main_layout(None)
             data.main_frame.add_widget(group_page)
             Clock.schedule_once(replace_widgets, 0)
             sync_height(group_page, 0)
+            if editable and form_count:
+                build_in_slices(
+                    group_page, form_count, build_form, show_form_progress, show_forms
+                )
 
         def generate_checkbox(text, dp_font_size, checked):
             font_size = dp(dp_font_size)
@@ -1557,9 +2429,19 @@ class HerePassUI(App):
             sync_height(data.choose_password_page)
 
         def clear_password_fields():
-            data.choose_password_first_input.text = ""
-            data.choose_password_second_input.text = ""
-            data.enter_password_text_input.text = ""
+            if "choose_password_page" in data.built_pages:
+                data.choose_password_first_input.text = ""
+                data.choose_password_second_input.text = ""
+            if "enter_password_page" in data.built_pages:
+                data.enter_password_text_input.text = ""
+
+        def require_page(name):
+            # Pages other than the start page are built when first shown:
+            if name not in data.built_pages:
+                data.page_builders[name]()
+                data.built_pages.add(name)
+                return True
+            return False
 
         def build_file_load_layout():
             data.file_load_layout = AnchorLayout(
@@ -1605,6 +2487,18 @@ class HerePassUI(App):
 
             data.file_load_page.add_widget(generate_v_spacer(20))
 
+            checkbox = generate_checkbox("Only show vaults", 18, True)
+            data.file_load_page.add_widget(checkbox["row"])
+            data.file_load_chooser.vaults_only = True
+
+            def toggle_vaults_only(widget, active):
+                data.file_load_chooser.vaults_only = active
+                data.file_load_chooser.refresh_listing()
+
+            checkbox["checkbox"].bind(active=toggle_vaults_only)
+
+            data.file_load_page.add_widget(generate_v_spacer(20))
+
             height = dp(24)
             data.file_load_path_label = Label(
                 text="Select an encrypted file.",
@@ -1680,6 +2574,8 @@ class HerePassUI(App):
             )
             data.file_create_page.add_widget(data.file_create_chooser)
             data.file_create_chooser.bind(on_entry_added=adjust_file_chooser_elements)
+            # Only folders and the vaults already in them are of use here:
+            data.file_create_chooser.vaults_only = True
 
             data.file_create_page.add_widget(generate_v_spacer(20))
 
@@ -1794,6 +2690,11 @@ class HerePassUI(App):
             data.start_page.add_widget(data.load_file_button)
             data.load_file_button.bind(on_release=show_file_load_layout)
 
+            data.recent_vaults_list = BoxLayout(orientation="vertical")
+            data.recent_vaults_list.target_height = None
+            data.start_page.add_widget(data.recent_vaults_list)
+            show_recent_vaults()
+
             # Don't forget to rectify heights!
             sync_height(data.start_page)
 
@@ -1887,55 +2788,50 @@ class HerePassUI(App):
             data.enter_password_load.disabled = False
             data.enter_password_load.bind(on_release=load_for_group_page)
 
-        def load_and_decrypt():
-            data.herepass = HerePass()
-            data.current_file_handle.seek(0)
-            try:
-                data.herepass.from_encrypted_json(
-                    data.passphrase, data.current_file_handle.read()
-                )
-                data.herepass_error = None
-            except Exception as error:
-                del data.herepass
-                data.herepass_error = str(error).strip()
-            del data.passphrase
-
-        def end_load_and_decrypt(delta):
-            if not data.load_thread.is_alive():
-                Clock.unschedule(data.load_thread_monitor)
-                del data.load_thread_monitor
-                del data.load_thread
-                # Sync with group page:
-                Clock.schedule_once(enable_load_button, 0)
-                #
-                if data.herepass_error is None:
-                    data.edit_allowed = data.edit_allowed_checkbox.active
-                    if data.edit_allowed:
-                        try:
-                            new_file_handle = open(data.current_file, "rb+")
-                        except OSError:
-                            show_error_bubble(
-                                data.enter_password_load,
-                                "Unable to edit the selected file!",
-                                False,
-                            )
-                            return
-                        data.current_file_handle.close()
-                        data.current_file_handle = new_file_handle
-                    data.edit_allowed_checkbox.active = False
-                    rebuild_group_page(data.herepass.group, [], False)
-                    return
-                show_error_bubble(
-                    data.enter_password_load,
-                    "Decryption error: " + data.herepass_error,
-                    False,
-                )
-
-        def begin_load_and_decrypt(delta):
-            data.load_thread = Thread(target=load_and_decrypt)
-            data.load_thread.start()
-            data.load_thread_monitor = Clock.schedule_interval(
-                end_load_and_decrypt, 0.125
+        def freeze_vault():
+            """
+            An open vault's tree is long-lived, so collections needn't walk
+            it. Freezing takes the whole heap though, so garbage, the pages
+            left behind included, is collected first rather than kept for as
+            long as the vault is open.
+            """
+            gc.collect()
+            gc.freeze()
+
+        def end_load_and_decrypt(job):
+            # Sync with group page:
+            Clock.schedule_once(enable_load_button, 0)
+            # Unless the file was closed since, or another load started:
+            if job is not data.decrypt_job:
+                return
+            data.decrypt_job = None
+            if job.error is None:
+                data.herepass = job.result
+                data.read_ahead = None
+                remember_recent_vault()
+                data.edit_allowed = data.edit_allowed_checkbox.active
+                if data.edit_allowed:
+                    try:
+                        new_file_handle = open(data.current_file, "rb+")
+                    except OSError:
+                        show_error_bubble(
+                            data.enter_password_load,
+                            "Unable to edit the selected file!",
+                            False,
+                        )
+                        return
+                    data.current_file_handle.close()
+                    data.current_file_handle = new_file_handle
+                    open_vault_file()
+                    start_writer()
+                data.edit_allowed_checkbox.active = False
+                freeze_vault()
+                rebuild_group_page(data.herepass.group, [], False)
+                return
+            show_error_bubble(
+                data.enter_password_load,
+                "Decryption error: " + str(job.error).strip(),
+                False,
             )
 
         def load_for_group_page(widget):
@@ -1946,46 +2842,47 @@ class HerePassUI(App):
                     False,
                 )
                 return
-            data.passphrase = data.enter_password_text_input.text
+            passphrase = data.enter_password_text_input.text
             clear_password_fields()
             disable_load_button()
-            Clock.schedule_once(begin_load_and_decrypt)
-
-        def create_and_encrypt():
-            data.herepass = HerePass()
-            try:
-                data.herepass.create(data.passphrase)
-                data.herepass_error = None
-            except Exception as error:
-                del data.herepass
-                data.herepass_error = str(error).strip()
-            del data.passphrase
-            if data.herepass_error is None:
-                flush_encrypted()
-
-        def end_create_and_encrypt(delta):
-            if not data.create_thread.is_alive():
-                Clock.unschedule(data.create_thread_monitor)
-                del data.create_thread_monitor
-                del data.create_thread
-                # Sync with group page:
-                Clock.schedule_once(enable_create_button, 0)
-                #
-                if data.herepass_error is None:
-                    data.edit_allowed = True
-                    rebuild_group_page(data.herepass.group, [], False)
-                    return
-                show_error_bubble(
-                    data.choose_password_create,
-                    "Encryption error: " + data.herepass_error,
-                    False,
-                )
-
-        def begin_create_and_encrypt(delta):
-            data.create_thread = Thread(target=create_and_encrypt)
-            data.create_thread.start()
-            data.create_thread_monitor = Clock.schedule_interval(
-                end_create_and_encrypt, 0.125
+            read_ahead = data.read_ahead
+
+            def load_and_decrypt(job):
+                herepass = HerePass()
+                # Submitted earlier, the read ahead already ran or is running.
+                # Only the key derivation and decryption are left, unless it
+                # failed, in which case its error is raised again here:
+                if read_ahead is not None and read_ahead.wait():
+                    contents = read_ahead.result
+                if read_ahead is None or read_ahead.error is not None:
+                    data.current_file_handle.seek(0)
+                    contents = data.current_file_handle.read()
+                # Closing the file cancels it, before or after the key
+                # derivation, which can't be interrupted:
+                job.check()
+                herepass.from_encrypted_json(passphrase, contents, True)
+                job.check()
+                return herepass
+
+            data.decrypt_job = data.jobs.submit(
+                "decrypt", load_and_decrypt, end_load_and_decrypt
+            )
+
+        def end_create_and_encrypt(job):
+            # Sync with group page:
+            Clock.schedule_once(enable_create_button, 0)
+            #
+            if job.error is None:
+                remember_recent_vault()
+                data.edit_allowed = True
+                start_writer()
+                freeze_vault()
+                rebuild_group_page(data.herepass.group, [], False)
+                return
+            show_error_bubble(
+                data.choose_password_create,
+                "Encryption error: " + str(job.error).strip(),
+                False,
             )
 
         def create_for_group_page(widget):
@@ -2006,12 +2903,167 @@ class HerePassUI(App):
                     False,
                 )
                 return
-            data.passphrase = data.choose_password_first_input.text
+            passphrase = data.choose_password_first_input.text
             clear_password_fields()
             disable_create_button()
-            Clock.schedule_once(begin_create_and_encrypt)
+
+            def create_and_encrypt(job):
+                herepass = HerePass()
+                herepass.create(passphrase)
+                data.herepass = herepass
+                open_vault_file()
+                write_encrypted()
+
+            data.jobs.submit("encrypt", create_and_encrypt, end_create_and_encrypt)
+
+        def read_ahead_current_file():
+            # Read and parsed while the passphrase is typed, see
+            # load_for_group_page:
+            file_handle = data.current_file_handle
+
+            def read_file(job):
+                file_handle.seek(0)
+                contents = file_handle.read()
+                job.check()
+                return parse_envelope(contents)
+
+            data.read_ahead = data.jobs.submit("read", read_file)
+
+        def load_recent_vaults():
+            if data.recent_vaults_path is None:
+                return
+            try:
+                with open(data.recent_vaults_path, "rb") as file_handle:
+                    recent_vaults = ujson.loads(file_handle.read())
+            except (OSError, ValueError):
+                return
+            if isinstance(recent_vaults, list):
+                data.recent_vaults = recent_vaults[: data.recent_vaults_limit]
+
+        def save_recent_vaults():
+            if data.recent_vaults_path is None:
+                return
+            # Replaced whole, so that it's never left half written:
+            temporary_path = data.recent_vaults_path.with_suffix(".tmp")
+            try:
+                with open(temporary_path, "wb") as file_handle:
+                    file_handle.write(ujson.dumps(data.recent_vaults).encode())
+                os.replace(temporary_path, data.recent_vaults_path)
+            except OSError as error:
+                Logger.warning(
+                    "HerePass: Unable to save recent vaults: {}".format(error)
+                )
+
+        def remember_recent_vault():
+            """
+            Puts the current file first among the recent vaults, along with
+            the non-secret parts of its header.
+            """
+            path = str(data.current_file.resolve())
+            encrypter = data.herepass.encrypter
+            key_derivation = encrypter.get("key_derivation")
+            header = {
+                "encrypter": type(encrypter).__name__,
+                "key_derivation": type(key_derivation).__name__,
+            }
+            if key_derivation.has("cost"):
+                header["cost"] = key_derivation.get("cost")
+            file_stat = data.current_file.stat()
+            recent_vault = {
+                "path": path,
+                "size": file_stat.st_size,
+                "mtime": file_stat.st_mtime,
+                "header": header,
+            }
+            data.recent_vaults = [recent_vault] + [
+                i for i in data.recent_vaults if i.get("path") != path
+            ][: data.recent_vaults_limit - 1]
+            save_recent_vaults()
+
+        def check_recent_vaults():
+            """
+            Keeps the recent vaults that are still non-empty files, with the
+            size and mtime of a fresh stat, saving the list if that changed.
+            """
+            checked = []
+            for recent_vault in data.recent_vaults:
+                try:
+                    file_stat = os.stat(recent_vault["path"])
+                except (OSError, KeyError, TypeError):
+                    continue
+                if not stat.S_ISREG(file_stat.st_mode) or not file_stat.st_size:
+                    continue
+                checked.append(
+                    dict(
+                        recent_vault,
+                        size=file_stat.st_size,
+                        mtime=file_stat.st_mtime,
+                    )
+                )
+            if checked != data.recent_vaults:
+                data.recent_vaults = checked
+                save_recent_vaults()
+
+        def show_recent_vaults():
+            check_recent_vaults()
+            recent_list = data.recent_vaults_list
+            recent_list.clear_widgets()
+            if data.recent_vaults:
+                recent_list.add_widget(generate_v_spacer(10))
+                recent_list.add_widget(generate_titled_separator("Recent Vaults", 60))
+            for recent_vault in data.recent_vaults:
+                path = Path(recent_vault["path"])
+                button = generate_button(path.name, dp(40), dp(18))
+                recent_list.add_widget(button)
+
+                def open_recent_vault(widget, path=path):
+                    open_for_password_page(path, widget, widget)
+
+                button.bind(on_release=open_recent_vault)
+                header = recent_vault.get("header", {})
+                details = [
+                    str(path.parent),
+                    "{:.1f} KB".format(recent_vault["size"] / 1024),
+                ]
+                if header.get("key_derivation"):
+                    details.append(header["key_derivation"])
+                height = dp(22)
+                label = Label(
+                    text="  |  ".join(details),
+                    halign="center",
+                    size_hint_min_y=height,
+                    size_hint_max_y=height,
+                    color=data.font_color_gray,
+                    font_size=dp(14),
+                    shorten=True,
+                )
+                label.bind(size=label.setter("text_size"))
+                recent_list.add_widget(label)
+                recent_list.add_widget(generate_v_spacer(10))
+            sync_height(recent_list)
 
         def clean_up_current_file():
+            if data.read_ahead:
+                data.read_ahead.cancel()
+                data.read_ahead = None
+            # Whatever it decrypts is dropped, see end_load_and_decrypt:
+            if data.decrypt_job:
+                data.decrypt_job.cancel()
+                data.decrypt_job = None
+            if data.writer:
+                # The final flush, which also writes again what failed to:
+                data.writer.stop()
+                data.writer = None
+                if data.save_error is not None:
+                    Logger.warning(
+                        "HerePass: Closed with changes unsaved: {}".format(
+                            data.save_error
+                        )
+                    )
+            data.save_error = None
+            if data.vault_file:
+                data.vault_file.close()
+                data.vault_file = None
             if data.current_file_handle:
                 data.current_file_handle.close()
                 data.current_file_handle = None
@@ -2019,16 +3071,30 @@ class HerePassUI(App):
                 if not data.current_file.stat().st_size:
                     data.current_file.unlink()
                 data.current_file = None
+            # Unfreezing only moves what was frozen, the closed vault and
+            # anything else alive then, to the oldest generation. It's freed by
+            # the next full collection, which schedule_collection runs once
+            # navigating pauses:
+            gc.unfreeze()
 
         def show_enter_password_page(widget):
             if data.file_load_chooser.has_errors:
                 return
-            target_file = Path(data.file_load_path_label.text)
-            file_size = target_file.stat().st_size
-            three_mb = 3145728
-            if file_size > three_mb:
+            open_for_password_page(
+                Path(data.file_load_path_label.text), data.file_load_path_label, widget
+            )
+
+        def open_for_password_page(target_file, error_widget, widget):
+            try:
+                file_size = target_file.stat().st_size
+            except OSError:
+                show_error_bubble(
+                    error_widget, "Unable to open the selected file!", False
+                )
+                return
+            if file_size > max_file_size:
                 show_error_bubble(
-                    data.file_load_path_label, "The selected file is too large!", False
+                    error_widget, "The selected file is too large!", False
                 )
                 return
             clean_up_current_file()
@@ -2037,13 +3103,15 @@ class HerePassUI(App):
                 data.current_file_handle = open(data.current_file, "rb")
             except OSError:
                 show_error_bubble(
-                    data.file_load_path_label,
+                    error_widget,
                     "Unable to open the selected file!",
                     False,
                 )
                 data.current_file = None
                 data.current_file_handle = None
                 return
+            read_ahead_current_file()
+            require_page("enter_password_page")
             data.enter_password_path_label.text = str(data.current_file)
             show_main_layout(widget)
             if data.current_page != data.enter_password_page:
@@ -2080,6 +3148,7 @@ class HerePassUI(App):
                 data.current_file = None
                 data.current_file_handle = None
                 return
+            require_page("choose_password_page")
             data.choose_password_path_label.text = str(data.current_file)
             show_main_layout(widget)
             if data.current_page != data.choose_password_page:
@@ -2089,15 +3158,20 @@ class HerePassUI(App):
                 sync_height(data.choose_password_page)
 
         def show_file_load_layout(widget):
+            just_built = require_page("file_load_layout")
             if data.current_layout != data.file_load_layout:
-                data.file_load_chooser._update_files()
+                # Just built, its chooser has already listed the files:
+                if not just_built:
+                    data.file_load_chooser.refresh_listing()
                 data.window.remove_widget(data.main_layout)
                 data.window.add_widget(data.file_load_layout)
                 data.current_layout = data.file_load_layout
 
         def show_file_create_layout(widget):
+            just_built = require_page("file_create_layout")
             if data.current_layout != data.file_create_layout:
-                data.file_create_chooser._update_files()
+                if not just_built:
+                    data.file_create_chooser.refresh_listing()
                 data.window.remove_widget(data.main_layout)
                 data.window.add_widget(data.file_create_layout)
                 data.current_layout = data.file_create_layout
@@ -2108,8 +3182,14 @@ class HerePassUI(App):
                 clear_password_fields()
                 clean_up_current_file()
                 data.main_frame.remove_widget(data.current_page)
+                # Nothing shown from a closed file is kept:
+                release_widgets(data.current_page)
+                drop_widget_pools()
+                show_recent_vaults()
                 data.main_frame.add_widget(data.start_page)
                 data.current_page = data.start_page
+                count_collections()
+                schedule_collection()
                 sync_height(data.start_page)
 
         def show_main_layout(widget):
@@ -2118,8 +3198,18 @@ class HerePassUI(App):
                 data.window.add_widget(data.main_layout)
                 data.current_layout = data.main_layout
 
+        def time_first_frame(window):
+            # From build being called to the first frame shown, cold starts
+            # included:
+            Window.unbind(on_flip=time_first_frame)
+            first_frame_ms = (time.perf_counter() - build_started) * 1000
+            data.startup["first_frame_ms"] = first_frame_ms
+            Logger.info("HerePass: First frame in {:.0f} ms".format(first_frame_ms))
+
         self.title = "HerePass"
         self.clean_up_current_file = clean_up_current_file
+        # For instrumentation, see herepass_benchmark.py:
+        self.data = data
         data.background_color = (0.98, 0.98, 0.98, 1)
         data.font_color = (0, 0, 0, 1)
         data.font_color_gray = (0.4, 0.4, 0.4, 1)
@@ -2136,17 +3226,72 @@ class HerePassUI(App):
         data.error_bubble_label = None
         data.current_file = None
         data.current_file_handle = None
-        data.sync_height_tracker = {}
+        data.herepass_lock = RLock()
+        data.writer = None
+        data.vault_file = None
+        # One of "always", "batched" or "on-close", see VaultFile:
+        data.fsync_policy = os.environ.get("HEREPASS_FSYNC_POLICY", "batched")
+        # Only the best matches are shown, searching as soon as typing pauses:
+        data.search_limit = 50
+        data.search_debounce = 0.2
+        # Decrypting, encrypting and searching, see JobPool:
+        data.jobs = JobPool(post_to_ui)
+        # Seconds without navigating before garbage is collected:
+        data.collection_delay = 2.0
+        data.collection_trigger = Clock.create_trigger(
+            collect_garbage, data.collection_delay
+        )
+        # Collection pauses per navigation, the last hundred:
+        data.collection_pauses = []
+        data.collection_stats = []
+        gc.callbacks.append(time_collection)
+        # Seconds of each frame spent building long pages, see build_in_slices:
+        data.frame_budget = 0.008
+        # Widgets whose height changed since the last layout pass, see
+        # sync_height:
+        data.layout_invalid = {}
+        data.layout_triggers = {}
+        data.layout_passes = 0
+        data.layout_page = None
+        # Widgets kept for reuse by kind, see acquire_widget:
+        data.widget_pools = {}
+        data.widget_pool_use = {}
+        data.widget_pool_peaks = {}
+        data.widget_pool_history = []
         data.edit_allowed = False
         data.alphanumeric = string.ascii_letters + string.digits
+        # Directory listings by path and filter, see list_directory:
+        data.directory_listings = {}
+        data.directory_listing_limit = 16
+        # Most recently opened first, see remember_recent_vault:
+        try:
+            data.recent_vaults_path = Path(self.user_data_dir) / "recent_vaults.json"
+        except OSError:
+            # Without a data directory, they're only kept for the session:
+            data.recent_vaults_path = None
+        data.recent_vaults = []
+        data.recent_vaults_limit = 5
+        # Parsing the current file while its passphrase is typed:
+        data.read_ahead = None
+        # Deriving the key and decrypting, see load_for_group_page:
+        data.decrypt_job = None
+        # The last write's error, if it failed, see report_written:
+        data.save_error = None
+        # Milliseconds spent building and until the first frame:
+        data.startup = {"build_ms": None, "first_frame_ms": None}
 
         data.window = FloatLayout()
+        Window.bind(on_memorywarning=drop_widget_pools)
         set_background_color(data.window, data.background_color)
 
-        build_enter_password_page()
-        build_choose_password_page()
-        build_file_load_layout()
-        build_file_create_layout()
+        data.page_builders = {
+            "enter_password_page": build_enter_password_page,
+            "choose_password_page": build_choose_password_page,
+            "file_load_layout": build_file_load_layout,
+            "file_create_layout": build_file_create_layout,
+        }
+        data.built_pages = set()
+        load_recent_vaults()
         build_start_page()
         build_main_layout()
 
@@ -2156,4 +3301,6 @@ class HerePassUI(App):
         data.window.add_widget(data.main_layout)
         sync_height(data.start_page)
 
+        data.startup["build_ms"] = (time.perf_counter() - build_started) * 1000
+        Window.bind(on_flip=time_first_frame)
         return data.window
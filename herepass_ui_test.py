@@ -0,0 +1,160 @@
+"""
+Copyright (c) 2022 Nader G. Zeid
+
+This file is part of HerePass.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
+"""
+
+import os
+import time
+
+import pytest
+
+from herepass import HerePass, max_file_size
+
+# Kivy must neither parse pytest's arguments nor need a display:
+os.environ["KIVY_NO_ARGS"] = "1"
+os.environ.setdefault("SDL_VIDEODRIVER", "offscreen")
+from kivy.base import EventLoop  # noqa: E402
+from kivy.core.window import Window  # noqa: E402
+from kivy.uix.button import Button  # noqa: E402
+
+import herepass_ui  # noqa: E402
+from herepass_ui import HerePassUI  # noqa: E402
+
+
+@pytest.fixture
+def ui(tmp_path):
+    app = HerePassUI()
+    # As App.run would, short of its loop:
+    app._run_prepare()
+    app.data.recent_vaults_path = tmp_path / "recent_vaults.json"
+    yield app
+    app.clean_up_current_file()
+    app.data.jobs.stop()
+    app.stop()
+
+
+def frames_until(done, timeout=60):
+    started = time.perf_counter()
+    while not done():
+        assert time.perf_counter() - started < timeout
+        EventLoop.idle()
+
+
+def press(text):
+    pending = [Window]
+    while pending:
+        widget = pending.pop()
+        if isinstance(widget, Button) and widget.text == text and not widget.disabled:
+            widget.dispatch("on_release")
+            return
+        pending.extend(widget.children)
+    raise LookupError(text)
+
+
+def choose_file(data, path):
+    frames_until(lambda: data.startup["first_frame_ms"] is not None)
+    press("Load an Existing File")
+    data.file_load_chooser.path = str(path.parent)
+    frames_until(lambda: str(path) in data.file_load_chooser.files)
+    data.file_load_chooser.selection = [str(path)]
+    press("Continue")
+
+
+def test_cancel_while_decrypting(ui, tmp_path):
+    data = ui.data
+    path = tmp_path / "vault.enc.json"
+    vault = HerePass()
+    vault.create("passphrase")
+    path.write_bytes(vault.to_encrypted_json())
+    choose_file(data, path)
+    frames_until(
+        lambda: data.current_page is getattr(data, "enter_password_page", None)
+    )
+    data.enter_password_text_input.text = "passphrase"
+    press("Load")
+    # Closed while the key is still being derived:
+    press("Cancel")
+    assert data.current_file is None
+    frames_until(lambda: [i["name"] for i in data.jobs.history][-1:] == ["decrypt"])
+    frames_until(lambda: not data.enter_password_load.disabled)
+    assert data.jobs.history[-1]["outcome"] == "cancelled"
+    assert data.current_page is data.start_page
+    assert data.recent_vaults == []
+    assert data.writer is None
+
+
+def test_file_size_limit(ui, tmp_path):
+    data = ui.data
+    # Past the 3 MB once allowed, as vaults saving their index soon are:
+    path = tmp_path / "large.enc.json"
+    with open(path, "wb") as handle:
+        handle.truncate(4 * 1048576)
+    choose_file(data, path)
+    frames_until(
+        lambda: data.current_page is getattr(data, "enter_password_page", None)
+    )
+    press("Cancel")
+    path = tmp_path / "too_large.enc.json"
+    with open(path, "wb") as handle:
+        handle.truncate(max_file_size + 1)
+    choose_file(data, path)
+    frames_until(lambda: data.error_bubble is not None)
+    assert data.error_bubble_label.text == "The selected file is too large!"
+    assert data.current_page is not getattr(data, "enter_password_page", None)
+
+
+def list_files(data, path):
+    frames_until(lambda: data.startup["first_frame_ms"] is not None)
+    press("Load an Existing File")
+    chooser = data.file_load_chooser
+    chooser.path = str(path)
+    frames_until(lambda: str(path / "vault.enc.json") in chooser.files)
+    return chooser
+
+
+def test_file_chooser_listing(ui, tmp_path):
+    # Fails here first when a Kivy upgrade changes what the chooser relies on:
+    assert (
+        herepass_ui.chooser_kivy_versions[1]
+        >= herepass_ui.parse_kivy_version(herepass_ui.kivy_version)[0]
+    )
+    (tmp_path / "vault.enc.json").write_bytes(b"")
+    for i in range(500):
+        (tmp_path / "notes_{:03}.txt".format(i)).write_bytes(b"")
+    chooser = list_files(ui.data, tmp_path)
+    assert chooser.lists_own_directories()
+    assert chooser.files == [str(tmp_path.parent), str(tmp_path / "vault.enc.json")]
+    chooser.vaults_only = False
+    chooser.refresh_listing()
+    frames_until(lambda: len(chooser.files) == 502)
+    # Only the rows in view have entries:
+    assert 0 < len(chooser._items) < 100
+    assert all(i.path in chooser.files for i in chooser._items)
+
+
+def test_file_chooser_kivy_listing(ui, tmp_path, monkeypatch):
+    # As on a Kivy version the chooser wasn't tested against:
+    monkeypatch.setattr(herepass_ui, "chooser_kivy_versions", ([0], [0]))
+    (tmp_path / "vault.enc.json").write_bytes(b"")
+    (tmp_path / "notes.txt").write_bytes(b"")
+    chooser = list_files(ui.data, tmp_path)
+    assert not chooser.lists_own_directories()
+    # Listed in order, so past where the notes would have been:
+    assert str(tmp_path / "notes.txt") not in chooser.files
+    chooser.vaults_only = False
+    chooser.refresh_listing()
+    frames_until(lambda: str(tmp_path / "notes.txt") in chooser.files)
@@ -0,0 +1,247 @@
+"""
+Copyright (c) 2022 Nader G. Zeid
+
+This file is part of HerePass.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
+"""
+
+import os
+import re
+import stat
+import time
+from tempfile import mkstemp
+from threading import Condition, Thread
+
+fsync_policies = ("always", "batched", "on-close")
+
+
+class DebouncedWriter:
+    """
+    Runs "write" on a background thread once requests stop arriving for
+    "debounce" seconds. Requests made while waiting or writing are coalesced,
+    so "write" must always persist the latest state. "on_done" receives None
+    or the raised exception, from the writer thread. A write that raised is
+    left pending, to be tried again with the next request or when stopping.
+
+    "idle", if given, runs on the writer thread after each write, and returns
+    the seconds after which it runs again unless another write comes first,
+    or None to wait for the next request. Its exceptions go to "on_done" too.
+    """
+
+    def __init__(self, write, on_done, debounce=0.25, idle=None):
+        self.write = write
+        self.on_done = on_done
+        self.debounce = debounce
+        self.idle = idle
+        self.condition = Condition()
+        self.pending = False
+        # Whether the last write raised:
+        self.failed = False
+        self.requested_at = 0
+        self.keep_writing = True
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def run(self):
+        idle_at = None
+        while True:
+            with self.condition:
+                while self.keep_writing and not self.pending:
+                    if idle_at is None:
+                        self.condition.wait()
+                        continue
+                    remaining = idle_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                writing = self.pending or (self.failed and not self.keep_writing)
+                if not writing and not self.keep_writing:
+                    return
+                # Wait until requests go quiet, unless stopping:
+                while writing and self.keep_writing:
+                    remaining = self.requested_at + self.debounce - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                self.pending = False
+            idle_at = None
+            try:
+                if writing:
+                    try:
+                        self.write()
+                    except Exception:
+                        self.failed = True
+                        raise
+                    self.failed = False
+                if self.idle is not None:
+                    delay = self.idle()
+                    if delay is not None:
+                        idle_at = time.monotonic() + delay
+                error = None
+            except Exception as caught:
+                error = caught
+            if writing or error is not None:
+                self.on_done(error)
+            if self.failed and not self.keep_writing:
+                # Tried once more when stopping, then given up on:
+                return
+
+    def start(self):
+        self.thread.start()
+
+    def request(self):
+        with self.condition:
+            self.pending = True
+            self.requested_at = time.monotonic()
+            self.condition.notify()
+
+    def stop(self):
+        """
+        Writes anything still pending right away, then ends the thread.
+        """
+        with self.condition:
+            self.keep_writing = False
+            self.condition.notify()
+        self.thread.join()
+
+
+def fsync_directory(path):
+    # Not every platform can open directories, Windows being one:
+    try:
+        handle = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(handle)
+    except OSError:
+        pass
+    finally:
+        os.close(handle)
+
+
+class VaultFile:
+    """
+    Writes an encrypted file either by appending to it or by replacing it
+    whole. Replacements go through a temporary file that is synced, then
+    renamed over the original, so a crash leaves either the old or the new
+    file intact. When everything else gets synced depends on the policy:
+
+    - "always": after every write.
+    - "batched": after a write, at most once per "batch_interval" seconds.
+      A write that comes sooner is synced once the interval is up, if sync
+      is called again then, see DebouncedWriter's "idle", or when closing.
+    - "on-close": only when closing.
+    """
+
+    # Younger temporary files may still be written by another process:
+    stale_temp_age = 3600
+
+    def __init__(self, path, handle, fsync_policy="batched", batch_interval=2.0):
+        if fsync_policy not in fsync_policies:
+            raise ValueError("Unknown fsync policy: " + str(fsync_policy))
+        self.path = path
+        self.handle = handle
+        self.fsync_policy = fsync_policy
+        self.batch_interval = batch_interval
+        self.synced_at = time.monotonic()
+        self.file_synced = True
+        self.directory_synced = True
+        self.directory = os.path.dirname(os.path.abspath(path))
+        self.temp_prefix = "." + os.path.basename(path)
+        # As mkstemp names them in rewrite, with 8 random characters:
+        self.temp_pattern = re.compile(
+            re.escape(self.temp_prefix) + r"[a-z0-9_]{8}\.tmp"
+        )
+        self.remove_stale_temps()
+
+    def remove_stale_temps(self):
+        # Left behind by a crash in the middle of a rewrite:
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        now = time.time()
+        for name in names:
+            if not self.temp_pattern.fullmatch(name):
+                continue
+            temp_path = os.path.join(self.directory, name)
+            try:
+                if now - os.stat(temp_path).st_mtime > self.stale_temp_age:
+                    os.remove(temp_path)
+            except OSError:
+                pass
+
+    def rewrite(self, output):
+        temp_handle, temp_path = mkstemp(
+            dir=self.directory, prefix=self.temp_prefix, suffix=".tmp"
+        )
+        try:
+            try:
+                os.chmod(temp_path, stat.S_IMODE(os.stat(self.path).st_mode))
+            except OSError:
+                pass
+            with os.fdopen(temp_handle, "wb") as temp_file:
+                temp_file.write(output)
+                temp_file.flush()
+                # Unconditional, or the rename could outlive the data:
+                os.fsync(temp_file.fileno())
+            # Windows can't replace a file that's still open:
+            self.handle.close()
+            os.replace(temp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
+        finally:
+            if self.handle.closed:
+                self.handle = open(self.path, "rb+")
+        self.directory_synced = False
+        self.sync()
+
+    def append(self, output):
+        self.handle.seek(0, 2)
+        self.handle.write(output)
+        self.handle.flush()
+        self.file_synced = False
+        self.sync()
+
+    def sync(self, closing=False):
+        """
+        Returns the seconds left before a batched sync that was put off is
+        due, or None if nothing is left unsynced until closing.
+        """
+        if self.fsync_policy == "on-close" and not closing:
+            return None
+        if self.file_synced and self.directory_synced:
+            return None
+        if self.fsync_policy == "batched" and not closing:
+            remaining = self.synced_at + self.batch_interval - time.monotonic()
+            if remaining > 0:
+                return remaining
+        if not self.file_synced:
+            os.fsync(self.handle.fileno())
+            self.file_synced = True
+        if not self.directory_synced:
+            fsync_directory(self.directory)
+            self.directory_synced = True
+        self.synced_at = time.monotonic()
+        return None
+
+    def close(self):
+        try:
+            self.sync(True)
+        finally:
+            self.handle.close()
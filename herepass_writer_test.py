@@ -0,0 +1,264 @@
+"""
+Copyright (c) 2022 Nader G. Zeid
+
+This file is part of HerePass.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with HerePass. If not, see <https://www.gnu.org/licenses/gpl.html>.
+"""
+
+import os
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+from herepass_writer import DebouncedWriter, VaultFile
+
+
+def test_debounced_writer():
+    state = {"value": 0}
+    written = []
+    reported = []
+
+    def write():
+        written.append(state["value"])
+
+    writer = DebouncedWriter(write, reported.append, 0.2)
+    writer.start()
+    # Rapid requests are coalesced into one write of the latest state:
+    for i in range(1, 6):
+        state["value"] = i
+        writer.request()
+        time.sleep(0.01)
+    time.sleep(0.5)
+    assert written == [5]
+    assert reported == [None]
+    # Stopping flushes a pending request without waiting:
+    state["value"] = 6
+    writer.debounce = 60
+    writer.request()
+    started = time.monotonic()
+    writer.stop()
+    assert time.monotonic() - started < 5
+    assert written == [5, 6]
+    assert reported == [None, None]
+    assert not writer.thread.is_alive()
+
+
+def test_debounced_writer_errors():
+    reported = []
+
+    def write():
+        raise OSError("Disk full")
+
+    writer = DebouncedWriter(write, reported.append, 0)
+    writer.start()
+    writer.request()
+    while not reported:
+        time.sleep(0.01)
+    assert isinstance(reported[0], OSError)
+    # What failed to be written is tried once more when stopping:
+    writer.stop()
+    assert len(reported) == 2
+    assert isinstance(reported[1], OSError)
+    # Stopping without anything pending writes nothing:
+    writer = DebouncedWriter(write, reported.append, 0)
+    writer.start()
+    writer.stop()
+    assert len(reported) == 2
+    reported.clear()
+    attempts = []
+
+    def write_once_failed():
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            raise OSError("Disk full")
+
+    writer = DebouncedWriter(write_once_failed, reported.append, 0)
+    writer.start()
+    writer.request()
+    while not reported:
+        time.sleep(0.01)
+    writer.stop()
+    assert attempts == [0, 1]
+    assert isinstance(reported[0], OSError) and reported[1] is None
+
+
+def test_debounced_writer_idle():
+    written = []
+    idled = []
+    reported = []
+
+    def idle():
+        idled.append(time.monotonic())
+        # Runs once more, 0.2 seconds after the write:
+        return 0.2 if len(idled) == 1 else None
+
+    writer = DebouncedWriter(lambda: written.append(1), reported.append, 0, idle)
+    writer.start()
+    writer.request()
+    time.sleep(0.6)
+    assert written == [1]
+    assert len(idled) == 2
+    assert idled[1] - idled[0] >= 0.2
+    # Only writes are reported:
+    assert reported == [None]
+    writer.stop()
+    assert len(idled) == 2
+
+
+@pytest.fixture
+def vault_path(tmp_path):
+    path = tmp_path / "vault.enc.json"
+    path.write_bytes(b"first")
+    return str(path)
+
+
+def count_fsyncs(monkeypatch):
+    fsyncs = []
+    original_fsync = os.fsync
+
+    def fsync(handle):
+        fsyncs.append(handle)
+        original_fsync(handle)
+
+    monkeypatch.setattr(os, "fsync", fsync)
+    return fsyncs
+
+
+def test_vault_file(vault_path):
+    vault_file = VaultFile(vault_path, open(vault_path, "rb+"), "always")
+    vault_file.append(b"\nsecond")
+    vault_file.rewrite(b"third")
+    vault_file.append(b"\nfourth")
+    vault_file.close()
+    with open(vault_path, "rb") as handle:
+        assert handle.read() == b"third\nfourth"
+    assert os.listdir(os.path.dirname(vault_path)) == ["vault.enc.json"]
+    with pytest.raises(ValueError):
+        VaultFile(vault_path, None, "never")
+
+
+def test_vault_file_policies(vault_path, monkeypatch):
+    fsyncs = count_fsyncs(monkeypatch)
+    vault_file = VaultFile(vault_path, open(vault_path, "rb+"), "always")
+    vault_file.append(b"\nsecond")
+    vault_file.append(b"\nthird")
+    assert len(fsyncs) == 2
+    vault_file.close()
+    assert len(fsyncs) == 2
+    fsyncs.clear()
+    vault_file = VaultFile(vault_path, open(vault_path, "rb+"), "batched", 60)
+    vault_file.append(b"\nfourth")
+    vault_file.append(b"\nfifth")
+    assert len(fsyncs) == 0
+    vault_file.batch_interval = 0
+    vault_file.append(b"\nsixth")
+    assert len(fsyncs) == 1
+    vault_file.batch_interval = 60
+    vault_file.append(b"\nseventh")
+    vault_file.close()
+    assert len(fsyncs) == 2
+    fsyncs.clear()
+    # A lone write soon after a sync is synced once the interval is up, by the
+    # writer calling sync again without waiting for another write:
+    vault_file = VaultFile(vault_path, open(vault_path, "rb+"), "batched", 0.3)
+    writer = DebouncedWriter(
+        lambda: vault_file.append(b"\nlone"), lambda error: None, 0, vault_file.sync
+    )
+    writer.start()
+    writer.request()
+    time.sleep(0.1)
+    assert len(fsyncs) == 0
+    time.sleep(0.6)
+    assert len(fsyncs) == 1
+    writer.stop()
+    vault_file.close()
+    assert len(fsyncs) == 1
+    fsyncs.clear()
+    vault_file = VaultFile(vault_path, open(vault_path, "rb+"), "on-close")
+    vault_file.append(b"\neighth")
+    # Only the temporary file is synced before it replaces the original:
+    vault_file.rewrite(b"ninth")
+    assert len(fsyncs) == 1
+    vault_file.close()
+    assert len(fsyncs) >= 2
+
+
+def test_vault_file_failed_rewrite(vault_path, monkeypatch):
+    vault_file = VaultFile(vault_path, open(vault_path, "rb+"), "always")
+
+    def replace(source, target):
+        raise OSError("Interrupted")
+
+    monkeypatch.setattr(os, "replace", replace)
+    with pytest.raises(OSError):
+        vault_file.rewrite(b"second")
+    monkeypatch.undo()
+    # The original is untouched, and still writable:
+    assert os.listdir(os.path.dirname(vault_path)) == ["vault.enc.json"]
+    vault_file.append(b"\nthird")
+    vault_file.close()
+    with open(vault_path, "rb") as handle:
+        assert handle.read() == b"first\nthird"
+
+
+@pytest.mark.skipif(not hasattr(signal, "SIGKILL"), reason="Needs SIGKILL")
+def test_vault_file_killed_mid_rewrite(vault_path):
+    size = 4194304
+    with open(vault_path, "wb") as handle:
+        handle.write(b"A" * size)
+    script = (
+        "import sys\n"
+        "from herepass_writer import VaultFile\n"
+        "vault_file = VaultFile(sys.argv[1], open(sys.argv[1], 'rb+'), 'always')\n"
+        "size = int(sys.argv[2])\n"
+        "i = 0\n"
+        "while True:\n"
+        "    i += 1\n"
+        "    vault_file.rewrite((b'B' if i % 2 else b'A') * size)\n"
+    )
+    for delay in (0.05, 0.2, 0.4):
+        writer = subprocess.Popen(
+            [sys.executable, "-c", script, vault_path, str(size)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        time.sleep(delay)
+        writer.send_signal(signal.SIGKILL)
+        writer.wait()
+        with open(vault_path, "rb") as handle:
+            content = handle.read()
+        # Either the old or the new content, never a mix:
+        assert len(content) == size
+        assert content in (b"A" * size, b"B" * size)
+    # Those left behind are removed once they're old enough not to be another
+    # writer's:
+    directory = os.path.dirname(vault_path)
+    with open(os.path.join(directory, ".vault.enc.jsonab_12xyz.tmp"), "wb") as handle:
+        handle.write(b"A")
+    temp_paths = [os.path.join(directory, i) for i in os.listdir(directory)]
+    VaultFile(vault_path, None)
+    assert sorted(os.listdir(directory)) == sorted(map(os.path.basename, temp_paths))
+    other_path = os.path.join(directory, ".vault.enc.json.backup.tmp")
+    with open(other_path, "wb") as handle:
+        handle.write(b"other")
+    for temp_path in temp_paths + [other_path]:
+        os.utime(temp_path, (0, 0))
+    VaultFile(vault_path, None)
+    assert sorted(os.listdir(directory)) == [
+        ".vault.enc.json.backup.tmp",
+        "vault.enc.json",
+    ]
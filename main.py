@@ -93,7 +93,9 @@ def print_pyinstaller_bloat():
         "hashlib",
         "heapq",
         "herepass",
+        "herepass_jobs",
         "herepass_ui",
+        "herepass_writer",
         "hmac",
         "imghdr",
         "importlib",